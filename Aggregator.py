@@ -0,0 +1,199 @@
+# IoT Project
+# Rolling Aggregation
+
+# aggregator.py
+# Per-appliance consumption statistics with O(1) updates. Every series owns one slot in a
+# set of NumPy arrays: running count/sum/min/max/EWMA plus, for each rolling window, a small
+# ring of time buckets. Reading a window only sums the buckets that are still inside it.
+import threading
+import time
+import numpy as np
+
+EWMA_ALPHA = 0.1
+# Rolling windows: (name, seconds, buckets)
+WINDOWS = (("1m", 60, 12), ("15m", 900, 15), ("1h", 3600, 60))
+INITIAL_CAPACITY = 64
+
+
+class RollingWindow:
+    def __init__(self, name, seconds, buckets, capacity):
+        self.name = name
+        self.buckets = buckets
+        self.width = seconds / buckets
+        self.sums = np.zeros((capacity, buckets))
+        self.counts = np.zeros((capacity, buckets), dtype=np.int64)
+        self.ids = np.full((capacity, buckets), -1, dtype=np.int64)  # Bucket number held at each position
+
+    def grow(self, capacity):
+        extra = capacity - len(self.sums)
+        self.sums = np.vstack([self.sums, np.zeros((extra, self.buckets))])
+        self.counts = np.vstack([self.counts, np.zeros((extra, self.buckets), dtype=np.int64)])
+        self.ids = np.vstack([self.ids, np.full((extra, self.buckets), -1, dtype=np.int64)])
+
+    def add(self, slot, timestamp, kwh, count=1):
+        bucket = int(timestamp // self.width)
+        position = bucket % self.buckets
+        if self.ids[slot, position] != bucket:
+            if self.ids[slot, position] > bucket:
+                return  # Older than the window
+            self.ids[slot, position] = bucket
+            self.sums[slot, position] = 0.0
+            self.counts[slot, position] = 0
+        self.sums[slot, position] += kwh
+        self.counts[slot, position] += count
+
+    def add_many(self, slot, timestamps, values):
+        buckets = (timestamps // self.width).astype(np.int64)
+        newest = max(int(buckets.max()), int(self.ids[slot].max()))
+        keep = buckets > newest - self.buckets
+        if not keep.any():
+            return
+        unique, inverse = np.unique(buckets[keep], return_inverse=True)
+        sums = np.bincount(inverse, weights=values[keep])
+        counts = np.bincount(inverse)
+        for bucket, total, count in zip(unique.tolist(), sums.tolist(), counts.tolist()):
+            position = bucket % self.buckets
+            if self.ids[slot, position] < bucket:
+                self.ids[slot, position] = bucket
+                self.sums[slot, position] = 0.0
+                self.counts[slot, position] = 0
+            if self.ids[slot, position] == bucket:
+                self.sums[slot, position] += total
+                self.counts[slot, position] += count
+
+    def totals(self, slots, now):
+        # Vectorized over the requested slots: (sum, count) of buckets still in the window
+        live = self.ids[slots] > int(now // self.width) - self.buckets
+        return (self.sums[slots] * live).sum(axis=1), (self.counts[slots] * live).sum(axis=1)
+
+
+class RollingAggregator:
+    def __init__(self, capacity=INITIAL_CAPACITY, alpha=EWMA_ALPHA):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.slots = {}  # (home, appliance) -> slot
+        self.keys = []
+        self.by_appliance = {}  # appliance -> [slot]
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.total = np.zeros(capacity)
+        self.minimum = np.full(capacity, np.inf)
+        self.maximum = np.full(capacity, -np.inf)
+        self.ewma = np.zeros(capacity)
+        self.last = np.zeros(capacity)
+        self.last_timestamp = np.zeros(capacity)
+        self.windows = [RollingWindow(name, seconds, buckets, capacity) for name, seconds, buckets in WINDOWS]
+
+    def slot(self, home, appliance):
+        key = (home, appliance)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.keys)
+            if slot == len(self.count):
+                self.grow(2 * slot)
+            self.slots[key] = slot
+            self.keys.append(key)
+            self.by_appliance.setdefault(appliance, []).append(slot)
+        return slot
+
+    def grow(self, capacity):
+        extra = capacity - len(self.count)
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.total = np.concatenate([self.total, np.zeros(extra)])
+        self.minimum = np.concatenate([self.minimum, np.full(extra, np.inf)])
+        self.maximum = np.concatenate([self.maximum, np.full(extra, -np.inf)])
+        self.ewma = np.concatenate([self.ewma, np.zeros(extra)])
+        self.last = np.concatenate([self.last, np.zeros(extra)])
+        self.last_timestamp = np.concatenate([self.last_timestamp, np.zeros(extra)])
+        for window in self.windows:
+            window.grow(capacity)
+
+    def update(self, timestamp, home, appliance, kwh):
+        with self.lock:
+            slot = self.slot(home, appliance)
+            self.ewma[slot] = kwh if not self.count[slot] else self.ewma[slot] + self.alpha * (kwh - self.ewma[slot])
+            self.count[slot] += 1
+            self.total[slot] += kwh
+            if kwh < self.minimum[slot]:
+                self.minimum[slot] = kwh
+            if kwh > self.maximum[slot]:
+                self.maximum[slot] = kwh
+            self.last[slot] = kwh
+            self.last_timestamp[slot] = timestamp
+            for window in self.windows:
+                window.add(slot, timestamp, kwh)
+
+    def merge(self, timestamp, home, appliance, count, total, minimum, maximum, last):
+        # Folds in readings that were already summed elsewhere (IngestWorkers summaries), as if
+        # all `count` of them arrived at timestamp with the batch mean
+        with self.lock:
+            slot = self.slot(home, appliance)
+            mean = total / count
+            decay = (1.0 - self.alpha) ** count
+            self.ewma[slot] = mean if not self.count[slot] else decay * self.ewma[slot] + (1.0 - decay) * mean
+            self.count[slot] += count
+            self.total[slot] += total
+            if minimum < self.minimum[slot]:
+                self.minimum[slot] = minimum
+            if maximum > self.maximum[slot]:
+                self.maximum[slot] = maximum
+            self.last[slot] = last
+            self.last_timestamp[slot] = timestamp
+            for window in self.windows:
+                window.add(slot, timestamp, total, count)
+
+    def backfill(self, home, appliance, timestamps, values):
+        # Vectorized bulk load of a time-ordered history, e.g. from Storage.TimeSeriesStore
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        with self.lock:
+            slot = self.slot(home, appliance)
+            if not self.count[slot]:
+                self.ewma[slot] = values[0]
+            # EWMA after n more samples: (1-a)^n * ewma + sum(a * (1-a)^(n-1-i) * x_i)
+            decay = 1.0 - self.alpha
+            weights = self.alpha * decay ** np.arange(len(values) - 1, -1, -1)
+            self.ewma[slot] = decay ** len(values) * self.ewma[slot] + float(weights @ values)
+            self.count[slot] += len(values)
+            self.total[slot] += float(values.sum())
+            self.minimum[slot] = min(self.minimum[slot], float(values.min()))
+            self.maximum[slot] = max(self.maximum[slot], float(values.max()))
+            self.last[slot] = values[-1]
+            self.last_timestamp[slot] = timestamps[-1]
+            for window in self.windows:
+                window.add_many(slot, timestamps, values)
+
+    def backfill_from_store(self, store, start=None):
+        for home, appliance in store.keys():
+            records = store.query(home, appliance, start)
+            self.backfill(home, appliance, records["timestamp"], records["kwh"])
+
+    def summary(self, slots, now=None):
+        # Combined statistics of the given slots
+        now = time.time() if now is None else now
+        with self.lock:
+            slots = np.asarray(slots, dtype=np.int64)
+            count = int(self.count[slots].sum())
+            total = float(self.total[slots].sum())
+            summary = {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else 0.0,
+                "min": float(self.minimum[slots].min()) if count else 0.0,
+                "max": float(self.maximum[slots].max()) if count else 0.0,
+                "ewma": float(self.ewma[slots].mean()) if count else 0.0,
+            }
+            for window in self.windows:
+                sums, _ = window.totals(slots, now)
+                summary[window.name] = float(sums.sum())
+        return summary
+
+    def appliance_summary(self, appliance, now=None):
+        # All homes reporting this appliance
+        slots = self.by_appliance.get(appliance)
+        return self.summary(slots, now) if slots else None
+
+    def series_summary(self, home, appliance, now=None):
+        slot = self.slots.get((home, appliance))
+        return None if slot is None else self.summary([slot], now)
@@ -0,0 +1,240 @@
+# IoT Project
+# Alerting
+
+# alerts.py
+# Per-appliance alert rules evaluated on the live reading stream. The MQTT callback only
+# appends to a queue; a worker thread evaluates the rules against O(1) state per
+# (home, appliance) series, drops repeats of the same alert within a cooldown, caps the
+# overall alert rate, and hands what is left to the GUI and to pr/home/<id>/alert.
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+import Metrics
+
+ALERT_QUEUE_SIZE = 100000  # Readings waiting for evaluation; oldest are dropped beyond this
+ALERT_STOP_TIMEOUT = 1.0  # Seconds stop() waits for the worker to finish its batch
+ALERT_COOLDOWN = 60.0  # Seconds before the same rule may fire again for a series
+ALERT_RATE = 5.0  # Alerts per second allowed overall...
+ALERT_BURST = 20  # ...with bursts up to this many
+RECENT_ALERTS = 100  # Alerts kept for display
+ZSCORE_ALPHA = 0.05  # EWMA weight of the rolling baseline
+ZSCORE_WARMUP = 30  # Readings before a baseline is trusted
+ALERT_RULES_FILE = os.environ.get("IOT_ALERT_RULES") or None  # JSON rules replacing DEFAULT_RULES
+
+log = logging.getLogger(__name__)
+
+
+class Alert:
+    __slots__ = ("timestamp", "home", "appliance", "rule", "kwh", "message")
+
+    def __init__(self, timestamp, home, appliance, rule, kwh, message):
+        self.timestamp = timestamp
+        self.home = home
+        self.appliance = appliance
+        self.rule = rule
+        self.kwh = kwh
+        self.message = message
+
+    def __str__(self):
+        return f"{self.home or '?'} {self.appliance}: {self.message}"
+
+    def to_json(self):
+        return json.dumps({
+            "timestamp": self.timestamp, "home": self.home, "appliance": self.appliance,
+            "rule": self.rule, "kwh": self.kwh, "message": self.message,
+        })
+
+
+class SeriesState:
+    # Everything the rules need about one series, updated in O(1) per reading
+    __slots__ = ("count", "last_kwh", "last_timestamp", "mean", "variance")
+
+    def __init__(self):
+        self.count = 0
+        self.last_kwh = 0.0
+        self.last_timestamp = 0.0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def update(self, timestamp, kwh, alpha=ZSCORE_ALPHA):
+        if self.count:
+            delta = kwh - self.mean
+            self.mean += alpha * delta
+            self.variance = (1 - alpha) * (self.variance + alpha * delta * delta)
+        else:
+            self.mean = kwh
+        self.count += 1
+        self.last_kwh = kwh
+        self.last_timestamp = timestamp
+
+
+# Rules look at a reading and the series state from before it; they return a message or None
+class ThresholdRule:
+    def __init__(self, appliance=None, above=None, below=None):
+        self.appliance = appliance  # None applies to every appliance
+        self.above = above
+        self.below = below
+        self.name = "threshold"
+
+    def check(self, state, timestamp, kwh):
+        if self.above is not None and kwh > self.above:
+            return f"{kwh:.2f} kWh above {self.above:.2f}"
+        if self.below is not None and kwh < self.below:
+            return f"{kwh:.2f} kWh below {self.below:.2f}"
+        return None
+
+
+class RateOfChangeRule:
+    def __init__(self, appliance=None, max_rate=1.0):
+        self.appliance = appliance
+        self.max_rate = max_rate  # kWh per second
+        self.name = "rate"
+
+    def check(self, state, timestamp, kwh):
+        elapsed = timestamp - state.last_timestamp
+        if not state.count or elapsed <= 0:
+            return None
+        rate = (kwh - state.last_kwh) / elapsed
+        if abs(rate) > self.max_rate:
+            return f"changing {rate:+.2f} kWh/s, limit {self.max_rate:.2f}"
+        return None
+
+
+class ZScoreRule:
+    def __init__(self, appliance=None, threshold=4.0, warmup=ZSCORE_WARMUP):
+        self.appliance = appliance
+        self.threshold = threshold
+        self.warmup = warmup
+        self.name = "zscore"
+
+    def check(self, state, timestamp, kwh):
+        if state.count < self.warmup or state.variance <= 0:
+            return None
+        score = (kwh - state.mean) / math.sqrt(state.variance)
+        if abs(score) > self.threshold:
+            return f"{kwh:.2f} kWh is {score:+.1f} sigma from the {state.mean:.2f} baseline"
+        return None
+
+
+RULE_TYPES = {"threshold": ThresholdRule, "rate": RateOfChangeRule, "zscore": ZScoreRule}
+# Publisher readings are 0.1 to 2.0 kWh
+DEFAULT_RULES = [ThresholdRule(above=2.5), ZScoreRule(threshold=4.0)]
+
+
+def load_rules(path):
+    # JSON list such as [{"type": "threshold", "appliance": "oven", "above": 2.5}]
+    with open(path) as f:
+        specs = json.load(f)
+    rules = []
+    for spec in specs:
+        spec = dict(spec)
+        rule_type = spec.pop("type")
+        if rule_type not in RULE_TYPES:
+            raise ValueError(f"Unknown alert rule type {rule_type!r}")
+        rules.append(RULE_TYPES[rule_type](**spec))
+    return rules
+
+
+def configured_rules():
+    return load_rules(ALERT_RULES_FILE) if ALERT_RULES_FILE else list(DEFAULT_RULES)
+
+
+class AlertEngine:
+    def __init__(self, rules=None, on_alert=None, cooldown=ALERT_COOLDOWN, rate=ALERT_RATE, burst=ALERT_BURST):
+        self.rules = configured_rules() if rules is None else list(rules)
+        self.on_alert = on_alert  # Called from the worker thread for every alert that survives
+        self.cooldown = cooldown
+        self.rate = rate
+        self.burst = burst
+        self.queue = deque(maxlen=ALERT_QUEUE_SIZE)
+        self.wakeup = threading.Event()  # Set when the queue may have readings
+        self.series = {}  # (home, appliance) -> SeriesState
+        self.rules_by_appliance = {}  # appliance -> rules that apply, filled on first sight
+        self.last_fired = {}  # (home, appliance, rule) -> timestamp
+        self.tokens = float(burst)
+        self.tokens_at = time.monotonic()
+        self.recent = deque(maxlen=RECENT_ALERTS)
+        self.recent_lock = threading.Lock()
+        self.dropped = 0
+        self.fired = Metrics.counter("alerts_fired_total", "Alerts published")
+        self.suppressed = Metrics.counter("alerts_suppressed_total", "Alerts dropped as repeats or over the rate limit")
+        Metrics.gauge("alerts_queue_depth", "Readings waiting for alert evaluation", lambda: len(self.queue))
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="alerts", daemon=True)
+        self.thread.start()
+
+    def submit(self, timestamp, home, appliance, kwh):
+        # Called on the MQTT network thread: one append, no evaluation. A full queue drops its oldest reading.
+        if len(self.queue) == ALERT_QUEUE_SIZE:
+            self.dropped += 1
+        self.queue.append((timestamp, home, appliance, kwh))
+        if not self.wakeup.is_set():  # Already set while the worker is behind, skip its lock
+            self.wakeup.set()
+
+    def run(self):
+        queue = self.queue
+        while True:
+            self.wakeup.wait()
+            # Cleared before draining, so a reading appended after the drain sets it again
+            self.wakeup.clear()
+            if not self.running:
+                return
+            while queue:
+                self.evaluate(*queue.popleft())
+
+    def evaluate(self, timestamp, home, appliance, kwh):
+        key = (home, appliance)
+        state = self.series.get(key)
+        if state is None:
+            state = self.series[key] = SeriesState()
+        rules = self.rules_by_appliance.get(appliance)
+        if rules is None:
+            rules = self.rules_by_appliance[appliance] = [
+                rule for rule in self.rules if rule.appliance in (None, appliance)
+            ]
+        for rule in rules:
+            message = rule.check(state, timestamp, kwh)
+            if message:
+                self.raise_alert(Alert(timestamp, home, appliance, rule.name, kwh, message))
+        state.update(timestamp, kwh)
+
+    def raise_alert(self, alert):
+        # Same series and rule within the cooldown is a repeat
+        key = (alert.home, alert.appliance, alert.rule)
+        last = self.last_fired.get(key)
+        if last is not None and alert.timestamp - last < self.cooldown:
+            self.suppressed.inc()
+            return
+        # Token bucket over all alerts
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.tokens_at) * self.rate)
+        self.tokens_at = now
+        if self.tokens < 1:
+            self.suppressed.inc()
+            return
+        self.tokens -= 1
+        self.last_fired[key] = alert.timestamp
+        with self.recent_lock:
+            self.recent.append(alert)
+        self.fired.inc()
+        log.warning("Alert: %s", alert)
+        if self.on_alert:
+            try:
+                self.on_alert(alert)
+            except Exception as e:
+                log.error("Alert delivery failed: %s", e)
+
+    def recent_alerts(self):
+        # Newest first
+        with self.recent_lock:
+            return list(reversed(self.recent))
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(ALERT_STOP_TIMEOUT)
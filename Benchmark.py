@@ -0,0 +1,214 @@
+# IoT Project
+# End-to-end Benchmark
+
+# benchmark.py
+# Publisher load generator -> local broker -> IoT_Project subscriber, across QoS levels,
+# payload sizes and client counts. Results are appended as JSON lines.
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import Codec
+import IoT_Project
+import Metrics
+import Publisher
+import TopicRouter
+
+DEFAULT_OUTPUT = "benchmark_results.jsonl"
+SETTLE_TIME = 1.0  # Seconds to wait for in-flight messages after each run
+
+
+# Stands in for the IoT_Project window and records publish-to-receive latency
+class LatencySink:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.received = 0
+
+    def update_subscriber_data(self, topic, reading):
+        now = time.time()
+        with self.lock:
+            self.received += 1
+            if reading.timestamp:
+                self.latencies.append(now - reading.timestamp)
+
+    def reset(self):
+        with self.lock:
+            self.latencies = []
+            self.received = 0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_cpu_seconds(pid):
+    # utime + stime of another process, Linux only
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def start_broker(port, workdir):
+    # Prefer mosquitto, fall back to the pure-python amqtt broker
+    if shutil.which("mosquitto"):
+        command = ["mosquitto", "-p", str(port)]
+    elif shutil.which("amqtt"):
+        config = os.path.join(workdir, "amqtt.yaml")
+        with open(config, "w") as f:
+            f.write(f"listeners:\n  default:\n    type: tcp\n    bind: 127.0.0.1:{port}\n")
+        command = ["amqtt", "-c", config]
+    else:
+        raise RuntimeError("No local broker found, install mosquitto or amqtt")
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return command[0], process
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Broker {command[0]} did not start on port {port}")
+
+
+def connect_subscriber(broker, port, sink):
+    subscriber = IoT_Project.MqttClient()
+    subscriber.on_message_to_form = sink.update_subscriber_data
+    subscriber.client_name = f"Benchmark-sub-{os.getpid()}"
+    subscriber.broker = broker
+    subscriber.port = port
+    connected = threading.Event()
+    subscriber.on_connected_to_form = connected.set
+    subscriber.connect_to()
+    if not connected.wait(10):
+        raise RuntimeError("Subscriber could not connect")
+    subscriber.subscribe_to(TopicRouter.STATUS_FILTER)  # Always QoS 2, so the publisher QoS is effective
+    time.sleep(0.5)
+    return subscriber
+
+
+async def drive(generators):
+    await asyncio.gather(*(generator.run() for generator in generators))
+
+
+def run_case(broker, port, broker_pid, sink, qos, payload_size, clients, rate, duration):
+    publishers = []
+    generators = []
+    for index in range(clients):
+        client = Publisher.create_client(f"Benchmark-pub-{os.getpid()}-{index}")
+        client.connect(broker, port)
+        client.loop_start()
+        generator = Publisher.LoadGenerator(
+            client, 1, 1, rate / clients, qos, False, payload_size, Codec.BINARY_FORMAT, duration, quiet=True
+        )
+        client.on_publish = generator.on_publish
+        client.max_inflight_messages_set(1000)
+        publishers.append(client)
+        generators.append(generator)
+    time.sleep(0.5)
+
+    sink.reset()
+    cpu_start = time.process_time()
+    broker_cpu_start = process_cpu_seconds(broker_pid)
+    wall_start = time.perf_counter()
+    asyncio.run(drive(generators))
+    time.sleep(SETTLE_TIME)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    broker_cpu_end = process_cpu_seconds(broker_pid)
+
+    for client in publishers:
+        client.disconnect()
+        client.loop_stop()
+
+    with sink.lock:
+        latencies = sink.latencies
+        received = sink.received
+    sent = sum(generator.sent for generator in generators)
+    p = Metrics.percentiles(latencies, (50, 99))
+    result = {
+        "timestamp": time.time(),
+        "qos": qos,
+        "payload_size": payload_size,
+        "clients": clients,
+        "target_rate": rate,
+        "duration": duration,
+        "sent": sent,
+        "received": received,
+        "msgs_per_sec": received / (wall - SETTLE_TIME) if wall > SETTLE_TIME else 0.0,
+        "latency_ms_p50": p[50] * 1000,
+        "latency_ms_p99": p[99] * 1000,
+        "cpu_us_per_msg": cpu / received * 1e6 if received else None,
+        "broker_cpu_us_per_msg": None,
+    }
+    if broker_cpu_start is not None and broker_cpu_end is not None and received:
+        result["broker_cpu_us_per_msg"] = (broker_cpu_end - broker_cpu_start) / received * 1e6
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end MQTT latency and throughput benchmark")
+    parser.add_argument("--qos", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--payload-sizes", type=int, nargs="+", default=[0, 256, 4096])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--rate", type=float, default=1000, help="total target msgs/sec per case")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per case")
+    parser.add_argument("--broker", default=None, help="use a running broker HOST:PORT instead of spawning one")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON lines file results are appended to")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="iot-bench-")
+    broker_process = None
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        port = int(port or Publisher.port)
+        broker_name, broker_pid = args.broker, None
+    else:
+        host, port = "127.0.0.1", free_port()
+        broker_name, broker_process = start_broker(port, workdir)
+        broker_pid = broker_process.pid
+
+    sink = LatencySink()
+    try:
+        subscriber = connect_subscriber(host, port, sink)
+        with open(args.output, "a") as output:
+            for qos, payload_size, clients in itertools.product(args.qos, args.payload_sizes, args.clients):
+                result = run_case(host, port, broker_pid, sink, qos, payload_size, clients,
+                                  args.rate, args.duration)
+                result["broker"] = broker_name
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                print(
+                    f"qos={qos} payload={payload_size}B clients={clients}: "
+                    f"{result['msgs_per_sec']:.0f} msgs/sec, "
+                    f"p50={result['latency_ms_p50']:.2f} ms p99={result['latency_ms_p99']:.2f} ms, "
+                    f"cpu={result['cpu_us_per_msg'] or 0:.1f} us/msg"
+                )
+        subscriber.disconnect_from()
+    finally:
+        if broker_process:
+            broker_process.terminate()
+            broker_process.wait(10)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Results appended to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# IoT Project
+# Traffic Capture and Replay
+
+# capture.py
+# Records every message on the pr/home/... topics into an append-only binary log, and
+# publishes a log back at its recorded pace, N times faster, or as fast as possible.
+# A log is a header followed by records of (receive time, topic, payload, QoS); the
+# replayer reads it through mmap, so a multi-GB capture is never loaded into memory.
+import argparse
+import logging
+import mmap
+import struct
+import sys
+import threading
+import time
+import Metrics
+import MqttCore
+
+CAPTURE_MAGIC = b"IOTCAP1\n"
+CAPTURE_RECORD = struct.Struct("<dHIB")  # receive time, topic length, payload length, qos
+CAPTURE_FILTER = "pr/home/#"
+CAPTURE_BUFFER = 1 << 20  # Bytes buffered before a write
+FLUSH_INTERVAL = 1.0  # Seconds between flushes of the capture file
+SLEEP_THRESHOLD = 0.001  # Replay publishes records due this soon without sleeping
+REPORT_INTERVAL = 5  # Seconds between progress reports
+
+log = logging.getLogger(__name__)
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "ab", buffering=CAPTURE_BUFFER)
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.bytes = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, timestamp, topic, payload, qos=0):
+        topic = topic.encode("utf-8")
+        record = CAPTURE_RECORD.pack(timestamp, len(topic), len(payload), qos) + topic + payload
+        with self.lock:
+            self.file.write(record)
+            self.count += 1
+            self.bytes += len(record)
+            now = time.monotonic()
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a capture file")
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)  # Let the kernel read ahead and drop pages behind us
+
+    def __iter__(self):
+        # Yields (timestamp, topic, payload, qos); a torn last record is ignored
+        data = self.map
+        size = len(data)
+        offset = len(CAPTURE_MAGIC)
+        while offset + CAPTURE_RECORD.size <= size:
+            timestamp, topic_length, payload_length, qos = CAPTURE_RECORD.unpack_from(data, offset)
+            offset += CAPTURE_RECORD.size
+            end = offset + topic_length + payload_length
+            if end > size:
+                break
+            yield timestamp, data[offset:offset + topic_length].decode("utf-8"), data[offset + topic_length:end], qos
+            offset = end
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def record(connection, path, topic_filter=CAPTURE_FILTER, duration=None):
+    writer = CaptureWriter(path)
+
+    def on_message(client, userdata, msg):
+        # Retained copies sent on subscribe are old state, not traffic
+        if not msg.retain:
+            writer.write(time.time(), msg.topic, msg.payload, msg.qos)
+
+    connection.subscribe(topic_filter, on_message, qos=2)
+    log.info("Recording %s to %s", topic_filter, path)
+    end = None if duration is None else time.monotonic() + duration
+    last = 0
+    try:
+        while end is None or time.monotonic() < end:
+            wait = REPORT_INTERVAL if end is None else min(REPORT_INTERVAL, end - time.monotonic())
+            time.sleep(max(wait, 0))
+            log.info("%d messages (%.0f msgs/sec), %.1f MB", writer.count,
+                     (writer.count - last) / max(wait, 1e-3), writer.bytes / 1e6)
+            last = writer.count
+    except KeyboardInterrupt:
+        log.info("Recording stopped by user.")
+    finally:
+        connection.unsubscribe(topic_filter, on_message)
+        writer.close()
+    return writer.count
+
+
+def replay(connection, path, speed=1.0, qos=None, loops=1):
+    # speed 0 publishes as fast as possible, otherwise recorded gaps are divided by speed
+    reader = CaptureReader(path)
+    sent = 0
+    max_lag = 0.0
+    info = None
+    start = time.monotonic()
+    try:
+        for _ in range(loops):
+            base = None
+            pass_start = time.monotonic()
+            next_report = pass_start + REPORT_INTERVAL
+            for timestamp, topic, payload, recorded_qos in reader:
+                if base is None:
+                    base = timestamp
+                now = time.monotonic()
+                if speed:
+                    due = pass_start + (timestamp - base) / speed
+                    if due - now > SLEEP_THRESHOLD:
+                        time.sleep(due - now)
+                    else:
+                        max_lag = max(max_lag, now - due)
+                info = connection.publish(topic, payload, qos=recorded_qos if qos is None else qos) or info
+                sent += 1
+                if now >= next_report:
+                    log.info("Replayed %d messages (%.0f msgs/sec), max lag %.1f ms",
+                             sent, sent / (now - start), max_lag * 1000)
+                    next_report += REPORT_INTERVAL
+    except KeyboardInterrupt:
+        log.info("Replay stopped by user.")
+    finally:
+        reader.close()
+    if info is not None:
+        info.wait_for_publish(REPORT_INTERVAL)  # paho sends in order, so the rest are out too
+    elapsed = time.monotonic() - start
+    return sent, elapsed, max_lag
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record and replay smart home MQTT traffic")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1884)
+    Metrics.add_arguments(parser)
+    commands = parser.add_subparsers(dest="command", required=True)
+    recorder = commands.add_parser("record", help="append live traffic to a capture file")
+    recorder.add_argument("path")
+    recorder.add_argument("--topic", default=CAPTURE_FILTER, help=f"topic filter, {CAPTURE_FILTER} by default")
+    recorder.add_argument("--duration", type=float, default=None, help="seconds to record, until Ctrl+C by default")
+    replayer = commands.add_parser("replay", help="publish a capture file back to the broker")
+    replayer.add_argument("path")
+    replayer.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 10 = ten times faster, 0 = max")
+    replayer.add_argument("--qos", type=int, choices=(0, 1, 2), default=None, help="override the recorded QoS")
+    replayer.add_argument("--loops", type=int, default=1, help="replay the capture this many times")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    Metrics.configure(args)
+    client_id = f"Capture-{args.command}-{int(time.time()) % 100000}"
+    connected = threading.Event()
+    on_connect = lambda client, userdata, flags, rc: rc == 0 and connected.set()
+    connection = MqttCore.acquire(args.broker, args.port, client_id, on_connect=on_connect)
+    if not connected.wait(10):
+        log.error("Connection to %s:%d failed", args.broker, args.port)
+        return 1
+    try:
+        if args.command == "record":
+            count = record(connection, args.path, args.topic, args.duration)
+            print(f"Recorded {count} messages to {args.path}")
+        else:
+            sent, elapsed, max_lag = replay(connection, args.path, args.speed, args.qos, args.loops)
+            print(f"Replayed {sent} messages in {elapsed:.2f}s ({sent / max(elapsed, 1e-9):.0f} msgs/sec), "
+                  f"max lag {max_lag * 1000:.1f} ms")
+    finally:
+        MqttCore.release(connection, on_connect=on_connect)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
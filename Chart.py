@@ -0,0 +1,190 @@
+# IoT Project
+# Live Consumption Chart
+
+# chart.py
+# Real-time kWh plot per appliance. Points live in preallocated NumPy ring buffers and are
+# reduced to one min/max pair per pixel column before drawing, so paint cost depends on the
+# widget width, not on how many points are stored. Repaints are capped at CHART_FPS.
+# NumPy is imported with the first points, so panels with only a Sparkline never load it.
+import time
+from PyQt5.QtCore import QPointF, QRectF, Qt, QTimer
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtWidgets import QSizePolicy, QWidget
+
+CHART_CAPACITY = 65536  # Points kept per series
+CHART_SPAN = 300.0  # Seconds of history shown
+CHART_FPS = 10
+CHART_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#17becf"]
+
+
+class RingSeries:
+    def __init__(self, capacity=CHART_CAPACITY):
+        import numpy as np
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.head = 0  # Next write position
+        self.size = 0
+        self.newest = float("-inf")
+        self.in_order = True  # False once a point older than the newest was written
+
+    def extend(self, timestamps, values):
+        # Points from several homes and late samples can arrive out of timestamp order
+        import numpy as np
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+        timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+        count = len(timestamps)
+        if not count:
+            return
+        if timestamps[0] < self.newest:
+            self.in_order = False
+        self.newest = max(self.newest, timestamps[-1])
+        first = min(count, self.capacity - self.head)
+        self.timestamps[self.head:self.head + first] = timestamps[:first]
+        self.values[self.head:self.head + first] = values[:first]
+        self.timestamps[:count - first] = timestamps[first:]
+        self.values[:count - first] = values[first:]
+        self.head = (self.head + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def ordered(self):
+        # Oldest to newest by timestamp; only copies when the ring has wrapped or needs sorting
+        import numpy as np
+        if not self.in_order:
+            timestamps, values = self.linear()
+            order = np.argsort(timestamps, kind="stable")
+            self.timestamps[:self.size] = timestamps[order]
+            self.values[:self.size] = values[order]
+            self.head = self.size % self.capacity
+            self.in_order = True
+        return self.linear()
+
+    def linear(self):
+        # Oldest to newest in write order
+        if self.size < self.capacity or self.head == 0:
+            return self.timestamps[:self.size], self.values[:self.size]
+        import numpy as np
+        return (np.concatenate([self.timestamps[self.head:], self.timestamps[:self.head]]),
+                np.concatenate([self.values[self.head:], self.values[:self.head]]))
+
+
+def decimate(timestamps, values, start, end, width):
+    # Min/max per pixel column: returns x (pixels) and y pairs, two points per column
+    import numpy as np
+    columns = ((timestamps - start) * ((width - 1) / (end - start))).astype(np.int64)
+    np.clip(columns, 0, width - 1, out=columns)
+    starts = np.flatnonzero(np.diff(columns, prepend=-1))
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    x = np.repeat(columns[starts], 2)
+    y = np.empty(2 * len(starts))
+    y[0::2] = lows
+    y[1::2] = highs
+    return x, y
+
+
+# Small line plot of the most recent values, e.g. ping round-trip times
+class Sparkline(QWidget):
+    def __init__(self, parent=None, color=CHART_COLORS[0]):
+        super().__init__(parent)
+        self.values = []
+        self.color = QColor(color)
+        self.setMinimumSize(120, 32)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+    def set_values(self, values):
+        self.values = list(values)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        if len(self.values) < 2:
+            return
+        high = max(self.values) or 1.0
+        area = QRectF(self.rect()).adjusted(1, 2, -1, -2)
+        step = area.width() / (len(self.values) - 1)
+        scale = area.height() / high
+        painter.setPen(QPen(self.color, 1))
+        painter.drawPolyline(QPolygonF([
+            QPointF(area.left() + index * step, area.bottom() - value * scale)
+            for index, value in enumerate(self.values)
+        ]))
+
+
+class ConsumptionChart(QWidget):
+    def __init__(self, parent=None, span=CHART_SPAN, fps=CHART_FPS):
+        super().__init__(parent)
+        self.span = span
+        self.series = {}  # appliance -> RingSeries, all homes share it
+        self.dirty = False
+        self.setMinimumHeight(160)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000 // fps)
+
+    def add_points(self, rows):
+        # rows: [(timestamp, appliance, kwh)] from the GUI thread, in arrival order
+        grouped = {}
+        for timestamp, appliance, kwh in rows:
+            if kwh == kwh:  # Skip NaN
+                grouped.setdefault(appliance, ([], []))
+                grouped[appliance][0].append(timestamp)
+                grouped[appliance][1].append(kwh)
+        for appliance, (timestamps, values) in grouped.items():
+            series = self.series.get(appliance)
+            if series is None:
+                series = self.series[appliance] = RingSeries()
+            series.extend(timestamps, values)
+        if grouped:
+            self.dirty = True
+
+    def refresh(self):
+        # Throttled: at most one repaint per timer tick, and only when new points arrived
+        if self.dirty:
+            self.dirty = False
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        plot = QRectF(self.rect()).adjusted(40, 10, -10, -20)
+        painter.setPen(Qt.gray)
+        painter.drawRect(plot)
+        width = max(int(plot.width()), 2)
+
+        end = time.time()
+        start = end - self.span
+        visible = []
+        for appliance, series in sorted(self.series.items()):
+            timestamps, values = series.ordered()
+            first = timestamps.searchsorted(start, "left")
+            if first < len(timestamps):
+                visible.append((appliance, decimate(timestamps[first:], values[first:], start, end, width)))
+        if not visible:
+            painter.drawText(plot, Qt.AlignCenter, "Waiting for readings")
+            return
+
+        low = min(float(y.min()) for _, (_, y) in visible)
+        high = max(float(y.max()) for _, (_, y) in visible)
+        if high - low < 1e-9:
+            low, high = low - 0.5, high + 0.5
+        scale = plot.height() / (high - low)
+        painter.drawText(QRectF(0, plot.top() - 6, 38, 12), Qt.AlignRight, f"{high:.2f}")
+        painter.drawText(QRectF(0, plot.bottom() - 6, 38, 12), Qt.AlignRight, f"{low:.2f}")
+        painter.drawText(QRectF(plot.left(), plot.bottom() + 2, plot.width(), 16), Qt.AlignLeft,
+                         f"-{self.span:.0f}s")
+
+        # No antialiasing: min/max columns are one pixel wide and AA doubles the raster cost
+        for index, (appliance, (x, y)) in enumerate(visible):
+            color = QColor(CHART_COLORS[index % len(CHART_COLORS)])
+            painter.setPen(QPen(color, 1))
+            xs = (plot.left() + x).tolist()
+            ys = (plot.bottom() - (y - low) * scale).tolist()
+            painter.drawPolyline(QPolygonF([QPointF(px, py) for px, py in zip(xs, ys)]))
+            painter.drawText(QPointF(plot.left() + 6, plot.top() + 14 * (index + 1)), appliance)
@@ -0,0 +1,113 @@
+# IoT Project
+# Reading Codec
+
+# codec.py
+import struct
+import sys
+
+# Payload formats the publisher and the GUIs can negotiate
+TEXT_FORMAT = "text"
+BINARY_FORMAT = "binary"
+PAYLOAD_FORMATS = (TEXT_FORMAT, BINARY_FORMAT)
+
+# Binary layout: magic, version, timestamp (float64), kWh (float64), name length, name (utf-8)
+BINARY_MAGIC = 0xA7  # Never the first byte of a UTF-8 text payload
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<BBddB")
+BINARY_MAGIC_BYTE = bytes([BINARY_MAGIC])
+
+# Sent on the command topic to switch the publisher's payload format, e.g. "format:binary"
+FORMAT_COMMAND_PREFIX = "format:"
+
+# Appliances of simulated homes; beyond these they are numbered
+LOAD_APPLIANCES = ["oven", "kettle", "refrigerator", "washing machine", "dishwasher", "dryer", "heater", "boiler"]
+
+# Decoded appliance names, so repeated readings share one string object
+NAME_CACHE_SIZE = 4096
+_names = {}
+
+
+class Reading:
+    __slots__ = ("appliance", "kwh", "timestamp", "home")
+
+    def __init__(self, appliance, kwh, timestamp=0.0, home=""):
+        self.appliance = appliance
+        self.kwh = kwh
+        self.timestamp = timestamp  # Publisher clock, 0.0 when the payload carries none
+        self.home = home
+
+    def __str__(self):
+        return f"{self.appliance}:{self.kwh}"
+
+    def __repr__(self):
+        return f"Reading({self.appliance!r}, {self.kwh!r}, {self.timestamp!r}, {self.home!r})"
+
+
+def home_from_topic(topic):
+    # pr/home/<id>/sts -> <id>
+    parts = topic.split("/", 3)
+    return parts[2] if len(parts) > 2 else ""
+
+
+def _name(raw):
+    name = _names.get(raw)
+    if name is None:
+        name = sys.intern(raw.decode("utf-8", "ignore"))
+        if len(_names) < NAME_CACHE_SIZE:
+            _names[raw] = name
+    return name
+
+
+def encode(appliance, kwh, payload_format=TEXT_FORMAT, timestamp=0.0, size=0):
+    if payload_format == BINARY_FORMAT:
+        name = appliance.encode("utf-8")[:255]
+        payload = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, timestamp, kwh, len(name)) + name
+        padding = b"\0"
+    else:
+        payload = f"{appliance}:{kwh}".encode("utf-8")
+        padding = b" "  # float() ignores trailing whitespace
+    if len(payload) < size:
+        payload += padding * (size - len(payload))
+    return payload
+
+
+def decode(payload, topic=""):
+    # Returns a Reading, or None when the payload is not a reading
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    home = home_from_topic(topic) if topic else ""
+    if payload[:1] == BINARY_MAGIC_BYTE:
+        try:
+            _, version, timestamp, kwh, length = BINARY_HEADER.unpack_from(payload)
+        except struct.error:
+            return None
+        if version != BINARY_VERSION:
+            return None
+        start = BINARY_HEADER.size
+        return Reading(_name(payload[start:start + length]), kwh, timestamp, home)
+    name, separator, value = payload.partition(b":")
+    if not separator:
+        return None
+    try:
+        kwh = float(value)
+    except ValueError:
+        return None
+    return Reading(_name(name), kwh, 0.0, home)
+
+
+def format_command(payload_format):
+    return f"{FORMAT_COMMAND_PREFIX}{payload_format}"
+
+
+def load_appliances(count):
+    # Names for `count` simulated appliances per home
+    return (LOAD_APPLIANCES + [f"appliance{index}" for index in range(len(LOAD_APPLIANCES), count)])[:count]
+
+
+def parse_format_command(command):
+    # Returns the requested payload format, or None for any other command
+    if command.startswith(FORMAT_COMMAND_PREFIX):
+        payload_format = command[len(FORMAT_COMMAND_PREFIX):].strip().lower()
+        if payload_format in PAYLOAD_FORMATS:
+            return payload_format
+    return None
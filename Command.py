@@ -0,0 +1,209 @@
+# IoT Project
+# Command Channel
+
+# command.py
+# Correlated commands on pr/home/<id>/cmd. A request carries an ID and the topic to answer
+# on; the Publisher acknowledges with the same ID, so many commands can be in flight at once
+# and each round trip is timed. Bare text commands (e.g. "oven") are still accepted.
+import argparse
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+import Metrics
+import MqttCore
+import TopicRouter
+
+COMMAND_TIMEOUT = 5.0  # Seconds before an unanswered command fails
+MAX_IN_FLIGHT = 64  # Commands awaiting an ack; more are queued locally
+RTT_SAMPLES = 1000  # Round trips kept for percentiles
+
+log = logging.getLogger(__name__)
+
+
+def make_request(request_id, command, reply_to):
+    return json.dumps({"id": request_id, "cmd": command, "reply_to": reply_to}).encode("utf-8")
+
+
+def parse_request(payload):
+    # Returns (request_id, command, reply_to); request_id is None for a bare text command
+    text = payload.decode("utf-8", "ignore") if isinstance(payload, bytes) else payload
+    if text.startswith("{"):
+        try:
+            request = json.loads(text)
+            return request["id"], str(request["cmd"]), request.get("reply_to")
+        except (ValueError, KeyError, TypeError):
+            pass
+    return None, text, None
+
+
+def make_response(request_id, ok, result=""):
+    return json.dumps({"id": request_id, "ok": ok, "result": result}).encode("utf-8")
+
+
+class CommandChannel:
+    def __init__(self, connection, requester, timeout=COMMAND_TIMEOUT, max_in_flight=MAX_IN_FLIGHT):
+        self.connection = connection
+        self.requester = requester
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.reply_topics = set()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.pending = {}  # request ID -> (sent at, deadline, callback)
+        self.waiting = deque()  # (request ID, home, command, callback) beyond the in-flight window
+        self.rtts = deque(maxlen=RTT_SAMPLES)
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rtt_seconds = Metrics.histogram("command_rtt_seconds", "Command round-trip times")
+        self.timeouts_total = Metrics.counter("command_timeouts_total", "Commands that were never acknowledged")
+
+        self.running = True
+        self.wakeup = threading.Event()
+        self.sweeper = threading.Thread(target=self.sweep, name="command-timeouts", daemon=True)
+        self.sweeper.start()
+
+    def send(self, home, command, callback=None):
+        # callback(request_id, ok, rtt_seconds, result) runs on the MQTT network thread
+        reply_to = TopicRouter.ack_topic(home, self.requester)
+        if reply_to not in self.reply_topics:
+            self.reply_topics.add(reply_to)
+            self.connection.subscribe(reply_to, self.on_ack, qos=1)
+        request_id = f"{self.requester}-{next(self.ids)}"
+        with self.lock:
+            if len(self.pending) >= self.max_in_flight:
+                self.waiting.append((request_id, home, command, callback))
+                return request_id
+            self.track(request_id, callback)
+        self.publish(request_id, home, command)
+        return request_id
+
+    def track(self, request_id, callback):
+        now = time.monotonic()
+        self.pending[request_id] = (now, now + self.timeout, callback)
+        self.sent += 1
+
+    def publish(self, request_id, home, command):
+        reply_to = TopicRouter.ack_topic(home, self.requester)
+        self.connection.publish(TopicRouter.command_topic(home), make_request(request_id, command, reply_to), qos=1)
+
+    def release_window(self):
+        # Start queued commands as in-flight slots free up
+        while True:
+            with self.lock:
+                if not self.waiting or len(self.pending) >= self.max_in_flight:
+                    return
+                request_id, home, command, callback = self.waiting.popleft()
+                self.track(request_id, callback)
+            self.publish(request_id, home, command)
+
+    def on_ack(self, client, userdata, msg):
+        try:
+            response = json.loads(msg.payload)
+            request_id = response["id"]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self.lock:
+            entry = self.pending.pop(request_id, None)
+            if entry is None:
+                return  # Late ack for a command that already timed out
+            rtt = time.monotonic() - entry[0]
+            self.rtts.append(rtt)
+            self.rtt_seconds.observe(rtt)
+            ok = bool(response.get("ok"))
+            if ok:
+                self.acked += 1
+            else:
+                self.failed += 1
+        if entry[2]:
+            entry[2](request_id, ok, rtt, response.get("result", ""))
+        self.release_window()
+
+    def sweep(self):
+        while self.running:
+            self.wakeup.wait(min(self.timeout / 10, 0.5))
+            now = time.monotonic()
+            with self.lock:
+                expired = [(request_id, entry) for request_id, entry in self.pending.items() if entry[1] <= now]
+                for request_id, _ in expired:
+                    del self.pending[request_id]
+                self.timeouts += len(expired)
+            if expired:
+                self.timeouts_total.inc(len(expired))
+            for request_id, entry in expired:
+                if entry[2]:
+                    entry[2](request_id, False, None, "timeout")
+            if expired:
+                self.release_window()
+
+    def stats(self):
+        with self.lock:
+            rtts = list(self.rtts)
+            stats = {
+                "sent": self.sent,
+                "acked": self.acked,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "in_flight": len(self.pending),
+                "queued": len(self.waiting),
+            }
+        for point, rtt in Metrics.percentiles(rtts, (50, 90, 99)).items():
+            stats[f"rtt_ms_p{point}"] = rtt * 1000
+        return stats
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        for reply_to in self.reply_topics:
+            self.connection.unsubscribe(reply_to, self.on_ack)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Send pipelined commands and measure round-trip latency")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1884)
+    parser.add_argument("--homes", nargs="+", default=[TopicRouter.DEFAULT_HOME])
+    parser.add_argument("--command", default="oven")
+    parser.add_argument("--count", type=int, default=100, help="commands per home")
+    parser.add_argument("--inflight", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--timeout", type=float, default=COMMAND_TIMEOUT)
+    Metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    Metrics.configure(args)
+    requester = f"Command-{int(time.time()) % 100000}"
+    connected = threading.Event()
+    on_connect = lambda client, userdata, flags, rc: rc == 0 and connected.set()
+    connection = MqttCore.acquire(args.broker, args.port, requester, on_connect=on_connect)
+    if not connected.wait(10):
+        log.error("Connection failed")
+        return 1
+    channel = CommandChannel(connection, requester, args.timeout, args.inflight)
+    total = args.count * len(args.homes)
+    done = threading.Semaphore(0)
+    start = time.perf_counter()
+    for _ in range(args.count):
+        for home in args.homes:
+            channel.send(home, args.command, lambda *result: done.release())
+    for _ in range(total):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    stats = channel.stats()
+    print(f"{total} commands in {elapsed:.2f}s ({total / elapsed:.0f}/s): acked {stats['acked']}, "
+          f"failed {stats['failed']}, timeouts {stats['timeouts']}, RTT ms p50={stats['rtt_ms_p50']:.2f} "
+          f"p90={stats['rtt_ms_p90']:.2f} p99={stats['rtt_ms_p99']:.2f}")
+    channel.close()
+    MqttCore.release(connection, on_connect=on_connect)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
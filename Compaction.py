@@ -0,0 +1,310 @@
+# IoT Project
+# History Compaction
+
+# compaction.py
+# Rolls the raw samples of a TimeSeriesStore up into 1-minute, 1-hour and 1-day tiers and
+# applies a retention period to each level, so the history directory stops growing with time.
+# Every tier keeps one file of (bucket start, count, sum, min, max) records per series, built
+# with numpy reductions over complete buckets only. Queries read the coarsest tier that meets
+# the requested resolution and fill in the part not yet rolled up from finer data.
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from urllib.parse import quote, unquote
+import numpy as np
+import Metrics
+import Storage
+
+ROLLUP_DTYPE = np.dtype([("timestamp", "<f8"), ("count", "<i8"), ("sum", "<f8"), ("min", "<f8"), ("max", "<f8")])
+ROLLUP_DIR = ".rollups"  # Under the history directory; Storage skips dot directories
+ROLLUP_SUFFIX = ".roll"
+RAW_RETENTION = 7 * 86400  # Seconds of raw samples kept
+TIERS = [  # (name, bucket width in seconds, retention in seconds or None to keep forever)
+    ("1m", 60, 30 * 86400),
+    ("1h", 3600, 2 * 365 * 86400),
+    ("1d", 86400, None),
+]
+COMPACTION_INTERVAL = 60.0  # Seconds between compaction passes
+RETENTION_INTERVAL = 3600.0  # Seconds between retention passes, which rewrite tier files
+SETTLE_TIME = 10.0  # Buckets ending less than this long ago may still get samples from the write-behind buffer
+
+log = logging.getLogger(__name__)
+
+
+def rollup(records, width):
+    # Merges sorted ROLLUP_DTYPE records into buckets of `width` seconds, aligned to the epoch
+    if not len(records):
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    buckets = np.floor(records["timestamp"] / width) * width
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    rolled = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    rolled["timestamp"] = buckets[starts]
+    rolled["count"] = np.add.reduceat(records["count"], starts)
+    rolled["sum"] = np.add.reduceat(records["sum"], starts)
+    rolled["min"] = np.minimum.reduceat(records["min"], starts)
+    rolled["max"] = np.maximum.reduceat(records["max"], starts)
+    return rolled
+
+
+def from_raw(records):
+    # Raw (timestamp, kwh) samples as one-sample rollup records
+    converted = np.empty(len(records), dtype=ROLLUP_DTYPE)
+    converted["timestamp"] = records["timestamp"]
+    converted["count"] = 1
+    converted["sum"] = converted["min"] = converted["max"] = records["kwh"]
+    return converted
+
+
+class RollupFile:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self.count = os.path.getsize(path) // ROLLUP_DTYPE.itemsize
+        self.mapped = None
+        self.mapped_count = 0
+        self.last = float(self.records()["timestamp"][-1]) if self.count else None
+
+    def records(self):
+        if self.mapped_count != self.count:
+            self.mapped = np.memmap(self.path, dtype=ROLLUP_DTYPE, mode="r", shape=(self.count,)) if self.count else None
+            self.mapped_count = self.count
+        return self.mapped if self.count else np.empty(0, dtype=ROLLUP_DTYPE)
+
+    def append(self, records):
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+        self.count += len(records)
+        self.last = float(records["timestamp"][-1])
+
+    def slice(self, start=None, end=None):
+        records = self.records()
+        timestamps = records["timestamp"]
+        low = 0 if start is None else np.searchsorted(timestamps, start, "left")
+        high = self.count if end is None else np.searchsorted(timestamps, end, "right")
+        return records[low:high]
+
+    def drop_before(self, cutoff):
+        # Rewrites the file without the buckets older than the cutoff
+        records = self.records()
+        keep = int(np.searchsorted(records["timestamp"], cutoff, "left"))
+        if not keep:
+            return 0
+        kept = np.array(records[keep:])
+        temporary = f"{self.path}.tmp"
+        kept.tofile(temporary)
+        self.mapped = None
+        self.mapped_count = 0
+        os.replace(temporary, self.path)
+        self.count = len(kept)
+        return keep
+
+
+class Tier:
+    def __init__(self, root, name, width, retention):
+        self.path = os.path.join(root, name)
+        self.name = name
+        self.width = width
+        self.retention = retention
+        self.files = {}  # (home, appliance) -> RollupFile
+        os.makedirs(self.path, exist_ok=True)
+        for home in os.listdir(self.path):
+            home_path = os.path.join(self.path, home)
+            if not os.path.isdir(home_path):
+                continue
+            for name in os.listdir(home_path):
+                if name.endswith(ROLLUP_SUFFIX):
+                    key = (unquote(home), unquote(name[:-len(ROLLUP_SUFFIX)]))
+                    self.files[key] = RollupFile(os.path.join(home_path, name))
+
+    def file(self, key):
+        rollups = self.files.get(key)
+        if rollups is None:
+            home, appliance = key
+            path = os.path.join(self.path, quote(home, safe=""), quote(appliance, safe="") + ROLLUP_SUFFIX)
+            rollups = self.files[key] = RollupFile(path)
+        return rollups
+
+    def watermark(self, key):
+        # Everything before this time is rolled up; None when the series has no buckets yet
+        rollups = self.files.get(key)
+        return rollups.last + self.width if rollups and rollups.last is not None else None
+
+    def query(self, key, start=None, end=None):
+        rollups = self.files.get(key)
+        return rollups.slice(start, end) if rollups else np.empty(0, dtype=ROLLUP_DTYPE)
+
+    def size(self):
+        return sum(rollups.count for rollups in self.files.values())
+
+
+class Compactor:
+    def __init__(self, store, tiers=TIERS, raw_retention=RAW_RETENTION, interval=COMPACTION_INTERVAL):
+        if store.read_only:
+            raise ValueError("Compaction needs the store of the process that owns the history")
+        self.store = store
+        self.raw_retention = raw_retention
+        self.interval = interval
+        root = os.path.join(store.path, ROLLUP_DIR)
+        self.tiers = [Tier(root, name, width, retention) for name, width, retention in tiers]
+        self.lock = threading.Lock()  # One compaction pass or query at a time
+        self.last_retention = 0.0
+        self.pass_seconds = Metrics.histogram("compaction_pass_seconds", "Time spent in a compaction pass")
+        self.rolled = Metrics.counter("compaction_buckets_total", "Buckets written to the rollup tiers")
+        self.dropped = Metrics.counter("compaction_dropped_total", "Raw samples and buckets removed by retention")
+
+        self.running = True
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="compaction", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        # The first pass waits an interval too, keeping it off the startup path
+        while not self.wakeup.wait(self.interval) and self.running:
+            try:
+                self.compact()
+            except Exception:
+                log.exception("Compaction pass failed")
+
+    def keys(self):
+        keys = set(self.store.keys())
+        for tier in self.tiers:
+            keys.update(tier.files)
+        return keys
+
+    def read_source(self, level, key, start, end):
+        # Records of level-1 (raw for the first tier) with start <= timestamp < end
+        if level == 0:
+            records = from_raw(self.store.query(key[0], key[1], start, end))
+        else:
+            records = self.tiers[level - 1].query(key, start, end)
+        return records[records["timestamp"] < end]
+
+    def compact(self, now=None):
+        # Rolls every tier up to its last complete bucket, then applies retention
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        written = 0
+        with self.lock:
+            keys = self.keys()
+            # Finest first, so each tier rolls from a source that is already up to date.
+            # Samples older than a tier's watermark when they arrive are not rolled up again.
+            for level, tier in enumerate(self.tiers):
+                end = (now - SETTLE_TIME) // tier.width * tier.width
+                for key in keys:
+                    rolled = rollup(self.read_source(level, key, tier.watermark(key), end), tier.width)
+                    if len(rolled):
+                        tier.file(key).append(rolled)
+                        written += len(rolled)
+            dropped = 0
+            if now - self.last_retention >= RETENTION_INTERVAL:
+                self.last_retention = now
+                for tier in self.tiers:
+                    if tier.retention is not None:
+                        dropped += sum(rollups.drop_before(now - tier.retention) for rollups in tier.files.values())
+                dropped += self.store.drop_before(now - self.raw_retention)
+        self.rolled.inc(written)
+        self.dropped.inc(dropped)
+        elapsed = time.perf_counter() - started
+        self.pass_seconds.observe(elapsed)
+        if written or dropped:
+            log.info("Compaction: %d buckets written, %d dropped in %.1f ms", written, dropped, elapsed * 1000)
+        return written, dropped
+
+    def level_for(self, resolution, start, now):
+        # Coarsest tier no wider than the resolution (-1 is raw), moved to coarser tiers while
+        # the chosen one no longer keeps data as old as start
+        level = -1
+        for index, tier in enumerate(self.tiers):
+            if tier.width <= resolution:
+                level = index
+        retentions = [self.raw_retention] + [tier.retention for tier in self.tiers]
+        while start is not None and level + 1 < len(self.tiers):
+            retention = retentions[level + 1]
+            if retention is None or start >= now - retention:
+                break
+            level += 1
+        return level
+
+    def read(self, level, key, start, end):
+        if level < 0:
+            return from_raw(self.store.query(key[0], key[1], start, end))
+        tier = self.tiers[level]
+        records = tier.query(key, start, end)
+        # Buckets after the watermark are not rolled up yet: build them from the finer level
+        watermark = tier.watermark(key)
+        if watermark is None or end is None or end >= watermark:
+            fresh_start = start if watermark is None else watermark if start is None else max(start, watermark)
+            fresh = self.read(level - 1, key, fresh_start, end)
+            if len(fresh):
+                records = np.concatenate((records, rollup(fresh, tier.width)))
+        return records
+
+    def query(self, home, appliance, start=None, end=None, resolution=0):
+        # ROLLUP_DTYPE records at the coarsest available resolution not above `resolution` seconds
+        key = (home or Storage.UNKNOWN_HOME, appliance)
+        with self.lock:
+            return self.read(self.level_for(resolution, start, time.time()), key, start, end)
+
+    def stats(self):
+        with self.lock:
+            stats = {"raw": sum(self.store.aggregate(*key)["count"] for key in self.store.keys())}
+            for tier in self.tiers:
+                stats[tier.name] = tier.size()
+        return stats
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(self.interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Roll up and trim the stored consumption history")
+    parser.add_argument("--history-dir", default=Storage.HISTORY_DIR)
+    parser.add_argument("--once", action="store_true", help="run one compaction pass and exit")
+    parser.add_argument("--query", nargs=2, metavar=("HOME", "APPLIANCE"), help="print a series instead of compacting")
+    parser.add_argument("--days", type=float, default=365, help="how far back --query reaches")
+    parser.add_argument("--resolution", type=float, default=86400, help="seconds per point for --query")
+    Metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    Metrics.configure(args)
+    try:
+        store = Storage.TimeSeriesStore(args.history_dir)
+    except Storage.HistoryLocked as e:
+        log.error("%s; stop the daemon or GUI that writes it first", e)
+        return 1
+    compactor = Compactor(store)
+    try:
+        if args.query:
+            start = time.perf_counter()
+            records = compactor.query(args.query[0], args.query[1], time.time() - args.days * 86400, None, args.resolution)
+            elapsed = time.perf_counter() - start
+            for timestamp, count, total, low, high in records.tolist():
+                print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))} "
+                      f"n={count} sum={total:.2f} min={low:.2f} max={high:.2f}")
+            print(f"{len(records)} points in {elapsed * 1000:.1f} ms")
+        elif args.once:
+            compactor.compact()
+            print(", ".join(f"{name}: {count}" for name, count in compactor.stats().items()))
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        compactor.stop()
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,128 @@
 # Connect Button
 
 # connect_button
+import logging
+import os
 import sys
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import *
-import paho.mqtt.client as mqtt
-import random
+import threading
+import time
+from collections import deque
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QIntValidator
+from PyQt5.QtWidgets import QApplication, QFormLayout, QLabel, QLineEdit, QMainWindow, QMessageBox, QPushButton, QWidget
+import Chart
+import Codec
+import Metrics
+import TopicRouter
+# MqttCore (and with it paho) is imported on the first connect
+
+log = logging.getLogger(__name__)
 
 # Default Client ID
 DEFAULT_CLIENT_ID = "IOT_client-3164"
 broker_ip = "127.0.0.1"
 broker_port = 1884
-button_topic = 'pr/home/id3164/sts'
+button_topic = TopicRouter.status_topic()
+
+# Health monitor settings
+PING_INTERVAL = 1000  # Milliseconds between loopback pings
+PING_TIMEOUT = 5.0  # Seconds before a ping counts as lost
+RTT_HISTORY = 120  # Round trips kept for the sparkline and percentiles
+DEGRADED_RTT = 0.25  # Seconds; a p90 above this marks the link degraded
+BROKER_COUNTERS = "$SYS/broker/messages/+"  # Total messages received/sent, published by mosquitto and amqtt
+
+
+# Measures link quality with timestamped pings the broker routes back to us
+class HealthMonitor:
+    def __init__(self, connection, requester):
+        self.connection = connection
+        self.topic = TopicRouter.ping_topic(requester)
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.pending = {}  # sequence -> monotonic send time
+        self.rtts = deque(maxlen=RTT_HISTORY)
+        self.sent = 0
+        self.lost = 0
+        self.keepalive_misses = 0
+        self.disconnects = 0
+        self.broker_totals = {}  # received/sent -> (count, monotonic time)
+        self.broker_rates = {}  # received/sent -> msgs/sec
+
+    def start(self):
+        self.connection.subscribe(self.topic, self.on_ping)
+        self.connection.subscribe(BROKER_COUNTERS, self.on_broker_counter)
+
+    def stop(self):
+        self.connection.unsubscribe(self.topic, self.on_ping)
+        self.connection.unsubscribe(BROKER_COUNTERS, self.on_broker_counter)
+
+    def ping(self):
+        # Offline pings would sit in the outbox and come back with a bogus RTT, so skip them
+        if not self.connection.is_connected():
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+            self.pending[sequence] = now
+            expired = [seq for seq, sent in self.pending.items() if now - sent > PING_TIMEOUT]
+            for seq in expired:
+                del self.pending[seq]
+            self.lost += len(expired)
+            self.sent += 1
+        self.connection.publish(self.topic, f"{sequence}:{time.time():.6f}")
+
+    def on_ping(self, client, userdata, msg):
+        now = time.monotonic()
+        try:
+            sequence = int(msg.payload.split(b":", 1)[0])
+        except ValueError:
+            return
+        with self.lock:
+            sent = self.pending.pop(sequence, None)
+            if sent is not None:
+                self.rtts.append(now - sent)
+
+    def on_broker_counter(self, client, userdata, msg):
+        direction = msg.topic.rsplit("/", 1)[-1]
+        if direction not in ("received", "sent"):
+            return
+        try:
+            count = int(msg.payload)
+        except ValueError:
+            return
+        now = time.monotonic()
+        with self.lock:
+            previous = self.broker_totals.get(direction)
+            self.broker_totals[direction] = (count, now)
+            if previous and now > previous[1] and count >= previous[0]:
+                self.broker_rates[direction] = (count - previous[0]) / (now - previous[1])
+
+    def on_disconnect(self, rc):
+        import paho.mqtt.client as mqtt  # Already loaded by MqttCore
+        with self.lock:
+            self.disconnects += 1
+            if rc == mqtt.MQTT_ERR_KEEPALIVE:
+                self.keepalive_misses += 1  # No PINGRESP within the keepalive interval
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            rtts = list(self.rtts)
+            # A ping still unanswered past the threshold shows a stall before any RTT does
+            stalled = any(now - sent > DEGRADED_RTT for sent in self.pending.values())
+            snapshot = {
+                "rtts": rtts,
+                "sent": self.sent,
+                "lost": self.lost,
+                "keepalive_misses": self.keepalive_misses,
+                "disconnects": self.disconnects,
+                "broker_rates": dict(self.broker_rates),
+            }
+        for point, rtt in Metrics.percentiles(rtts, (50, 90, 99)).items():
+            snapshot[f"p{point}"] = rtt
+        snapshot["degraded"] = stalled or snapshot["p90"] > DEGRADED_RTT
+        return snapshot
 
 class MqttClient:
     def __init__(self):
@@ -25,7 +134,10 @@ class MqttClient:
         self.subscribe_topic = ''
         self.on_connected_to_form = None
         self.on_disconnected_from_form = None  # New callback for disconnection
-        self.client = None
+        self.on_message_to_form = None
+        self.connection = None
+        self.subscriptions = []
+        self.health = None
 
     def set_on_connected_to_form(self, on_connected_to_form):
         self.on_connected_to_form = on_connected_to_form
@@ -33,59 +145,78 @@ class MqttClient:
     def set_on_disconnected_from_form(self, on_disconnected_from_form):
         self.on_disconnected_from_form = on_disconnected_from_form
 
+    def set_on_message_to_form(self, on_message_to_form):
+        self.on_message_to_form = on_message_to_form
+
     def connect_to(self):
          try:
             # Check if the client is already connected
-            if self.client and self.client.is_connected():
-                print("Client is already connected. Skipping reconnection.")
+            if self.connection and self.connection.is_connected():
+                log.info("Client is already connected. Skipping reconnection.")
                 return
 
-            # Initialize MQTT client only if it hasn't been created yet
-            if not self.client:
-                self.client = mqtt.Client(client_id=self.client_name, clean_session=True)
-                self.client.on_connect = self.on_connect
-                self.client.on_disconnect = self.on_disconnect
-                self.client.on_message = self.on_message
-
-            # Attempt to connect to the broker
-            print(f"Connecting to broker {self.broker}:{self.port}")
-            self.client.connect(self.broker, int(self.port))
-            self.client.loop_start()
+            # Attempt to connect to the broker, sharing an open connection if there is one
+            if not self.connection:
+                import MqttCore
+                log.info("Connecting to broker %s:%s", self.broker, self.port)
+                self.connection = MqttCore.acquire(
+                    self.broker, self.port, self.client_name,
+                    on_connect=self.on_connect, on_disconnect=self.on_disconnect,
+                )
+                self.health = HealthMonitor(self.connection, f"{self.client_name}-{os.getpid()}")
+                self.health.start()
          except Exception as e:
-             print(f"Connection failed: {e}")
+             log.error("Connection failed: %s", e)
 
     def disconnect_from(self):
           try:
-              if self.client:
-                  self.client.loop_stop()  # Stop the loop to prevent further callbacks
-                  self.client.disconnect()
-                  self.client = None  # Reset the client to allow reinitialization
-                  print("Disconnected from broker.")
+              if self.connection:
+                  import MqttCore
+                  # Stop callbacks for this panel before letting go of the connection
+                  for topic in self.subscriptions:
+                      self.connection.unsubscribe(topic, self.on_message)
+                  self.subscriptions = []
+                  if self.health:
+                      self.health.stop()
+                      self.health = None
+                  MqttCore.release(
+                      self.connection, on_connect=self.on_connect, on_disconnect=self.on_disconnect
+                  )
+                  self.connection = None  # Reset the connection to allow reinitialization
+                  log.info("Disconnected from broker.")
+                  if self.on_disconnected_from_form:
+                      self.on_disconnected_from_form()
           except Exception as e:
-              print(f"Disconnection failed: {e}")
+              log.error("Disconnection failed: %s", e)
 
     def subscribe_to(self, topic):
-        if self.client:
-            self.client.subscribe(topic)
+        if self.connection:
+            self.connection.subscribe(topic, self.on_message)
+            self.subscriptions.append(topic)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("Connected OK")
+            log.info("Connected OK")
             if self.on_connected_to_form:
                 self.on_connected_to_form()
         else:
-            print(f"Bad connection. Returned code={rc}")
+            log.warning("Bad connection. Returned code=%s", rc)
 
     def on_disconnect(self, client, userdata, rc):
-        print(f"Disconnected. Result code={rc}")
+        log.info("Disconnected. Result code=%s", rc)
+        if self.health:
+            self.health.on_disconnect(rc)
         if self.on_disconnected_from_form:
             self.on_disconnected_from_form()  # Trigger disconnection callback
 
     def on_message(self, client, userdata, msg):
         topic = msg.topic
-        payload = msg.payload.decode("utf-8", "ignore")
-        print(f"Message received from topic {topic}: {payload}")
-        mainwin.update_status_label("Message Received")
+        reading = Codec.decode(msg.payload, topic)
+        if reading is None:
+            reading = msg.payload.decode("utf-8", "ignore")
+        log.debug("Message received from topic %s: %s", topic, reading)
+        if self.on_message_to_form:
+            self.on_message_to_form("Message Received")
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -93,6 +224,7 @@ class MainWindow(QMainWindow):
         self.mc = MqttClient()
         self.mc.set_on_connected_to_form(self.on_connected)
         self.mc.set_on_disconnected_from_form(self.on_disconnected)  # Set disconnection callback
+        self.mc.set_on_message_to_form(self.update_status_label)
 
         # Broker Connection Section
         self.ip_input = QLineEdit()
@@ -124,11 +256,21 @@ class MainWindow(QMainWindow):
         form_layout.addRow("", self.connect_button)
         form_layout.addRow("Status:", self.status_label)
 
+        # Link health: loopback ping RTTs, keepalive misses and broker throughput
+        self.rtt_sparkline = Chart.Sparkline()
+        self.health_label = QLabel("")
+        self.health_label.setWordWrap(True)
+        form_layout.addRow("Ping RTT:", self.rtt_sparkline)
+        form_layout.addRow("Health:", self.health_label)
+        self.health_timer = QTimer(self)
+        self.health_timer.timeout.connect(self.check_health)
+        self.health_timer.start(PING_INTERVAL)
+
         container = QWidget()
         container.setLayout(form_layout)
         self.setCentralWidget(container)
         self.setWindowTitle("MQTT Connect Button")
-        self.setGeometry(100, 100, 300, 200)
+        self.setGeometry(100, 100, 300, 260)
 
     def on_connected(self):
         self.connect_button.setStyleSheet("background-color: green")
@@ -152,6 +294,25 @@ class MainWindow(QMainWindow):
         self.mc.connect_to()
         self.mc.subscribe_to(button_topic)
 
+    def check_health(self):
+        health = self.mc.health
+        if not health:
+            return
+        health.ping()
+        snapshot = health.snapshot()
+        self.rtt_sparkline.set_values([rtt * 1000 for rtt in snapshot["rtts"]])
+        rates = snapshot["broker_rates"]
+        throughput = (
+            f"{rates.get('received', 0):.0f} in / {rates.get('sent', 0):.0f} out msgs/sec" if rates else "n/a"
+        )
+        self.health_label.setText(
+            f"{'Degraded' if snapshot['degraded'] else 'OK'} | RTT ms p50 {snapshot['p50'] * 1000:.1f} "
+            f"p90 {snapshot['p90'] * 1000:.1f} p99 {snapshot['p99'] * 1000:.1f}\n"
+            f"Lost pings: {snapshot['lost']}/{snapshot['sent']} | Keepalive misses: {snapshot['keepalive_misses']} | "
+            f"Disconnects: {snapshot['disconnects']}\nBroker: {throughput}"
+        )
+        self.health_label.setStyleSheet("color: orange;" if snapshot["degraded"] else "")
+
     def update_status_label(self, status):
         if status == "Connected":
             self.status_label.setText("Connected")
@@ -164,6 +325,8 @@ class MainWindow(QMainWindow):
             self.status_label.setStyleSheet("color: red; font-weight: bold;")
 
 if __name__ == "__main__":
+    Metrics.setup_logging()
+    Metrics.start()  # Only when IOT_METRICS_PORT or IOT_METRICS_FILE is set
     app = QApplication(sys.argv)
     mainwin = MainWindow()
     mainwin.show()
@@ -0,0 +1,323 @@
+# IoT Project
+# Headless Subscriber Daemon
+
+# daemon.py
+# Subscribes to the pr/home/<id>/sts topics without a display. paho's socket is driven by an
+# asyncio event loop (reader/writer callbacks instead of a network thread), every payload is
+# decoded once and handed to pluggable sinks: stdout, storage, aggregation, and a local
+# forward socket the subscriber GUI can attach to instead of opening its own broker connection.
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+import paho.mqtt.client as mqtt
+import Codec
+import Metrics
+import MqttCore
+import TopicRouter
+
+log = logging.getLogger(__name__)
+
+DAEMON_CLIENT_ID = "IOT_daemon-3164"
+DAEMON_PORT = 18840  # Local forward socket for attached GUIs
+FORWARD_BUFFER_LIMIT = 1 << 20  # Bytes queued for a slow attached client before it is skipped
+STATS_INTERVAL = 10  # Seconds between throughput reports
+
+
+# Glue between paho's socket callbacks and the asyncio loop
+class AsyncioHelper:
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.misc:
+            self.misc.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        # Keepalive pings and retries
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+class StdoutSink:
+    def handle(self, timestamp, topic, reading):
+        print(f"{topic} {reading}")
+
+    def handle_summary(self, rows):
+        for home, appliance, count, total, minimum, maximum, _, last in rows:
+            print(f"{TopicRouter.status_topic(home)} {appliance}: {count} readings, {total:.2f} kWh, "
+                  f"min {minimum:.2f}, max {maximum:.2f}, last {last}")
+
+    def close(self):
+        pass
+
+
+class StorageSink:
+    def __init__(self, history_dir):
+        import Compaction
+        import Storage
+        self.store = Storage.TimeSeriesStore(history_dir)
+        self.compactor = Compaction.Compactor(self.store)
+
+    def handle(self, timestamp, topic, reading):
+        self.store.append(reading.timestamp or timestamp, reading.home, reading.appliance, reading.kwh)
+
+    def close(self):
+        self.compactor.stop()
+        self.store.close()
+
+
+class AggregatorSink:
+    def __init__(self):
+        import Aggregator
+        self.aggregator = Aggregator.RollingAggregator()
+
+    def handle(self, timestamp, topic, reading):
+        self.aggregator.update(reading.timestamp or timestamp, reading.home, reading.appliance, reading.kwh)
+
+    def handle_summary(self, rows):
+        for home, appliance, count, total, minimum, maximum, timestamp, last in rows:
+            self.aggregator.merge(timestamp, home, appliance, count, total, minimum, maximum, last)
+
+    def report(self):
+        for appliance in sorted(self.aggregator.by_appliance):
+            summary = self.aggregator.appliance_summary(appliance)
+            log.info("%s: total %.2f kWh, mean %.2f, 1m %.2f, 15m %.2f, 1h %.2f", appliance,
+                     summary["sum"], summary["mean"], summary["1m"], summary["15m"], summary["1h"])
+
+    def close(self):
+        pass
+
+
+# Streams decoded readings to attached GUIs as "timestamp\ttopic\tappliance\tkwh" lines
+class ForwardSink:
+    def __init__(self, port=DAEMON_PORT):
+        self.port = port
+        self.writers = set()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.on_client, "127.0.0.1", self.port)
+        log.info("Forwarding readings on 127.0.0.1:%s", self.port)
+
+    async def on_client(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            await reader.read()  # Attached clients only listen; wait for them to go away
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def handle(self, timestamp, topic, reading):
+        if not self.writers:
+            return
+        line = f"{reading.timestamp or timestamp}\t{topic}\t{reading.appliance}\t{reading.kwh}\n".encode("utf-8")
+        for writer in list(self.writers):
+            if writer.transport.get_write_buffer_size() < FORWARD_BUFFER_LIMIT:
+                writer.write(line)
+
+    def close(self):
+        if self.server:
+            self.server.close()
+
+
+class SubscriberDaemon:
+    def __init__(self, broker, port, topics, sinks, client_id=DAEMON_CLIENT_ID, qos=2):
+        self.broker = broker
+        self.port = port
+        self.topics = topics
+        self.sinks = sinks
+        self.client_id = client_id
+        self.qos = qos
+        self.received = 0
+        self.skipped = 0
+        self.disconnected = None
+        self.delay = MqttCore.RECONNECT_MIN_DELAY
+        # Same metric names as the shared GUI connections
+        self.received_total = Metrics.counter("mqtt_messages_received_total", "Messages delivered by the broker")
+        self.skipped_total = Metrics.counter("mqtt_messages_skipped_total", "Payloads that were not readings")
+        self.message_seconds = Metrics.histogram(
+            "mqtt_callback_seconds", "Time spent in MQTT callbacks", callback="on_message"
+        )
+        # Readings are routed by topic, so sinks can be attached per home
+        self.router = TopicRouter.TopicRouter()
+        for topic in topics:
+            for sink in sinks:
+                self.router.add(topic, sink.handle)
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            # Only an accepted CONNACK ends the backoff, a refused one keeps growing it
+            self.delay = MqttCore.RECONNECT_MIN_DELAY
+            log.info("Connected OK, subscribing to %s", ', '.join(self.topics))
+            client.subscribe([(topic, self.qos) for topic in self.topics])
+        else:
+            log.warning("Bad connection. Returned code=%s", rc)
+
+    def on_disconnect(self, client, userdata, rc):
+        log.info("Disconnected. Result code=%s", rc)
+        self.disconnected.set()
+
+    def on_message(self, client, userdata, msg):
+        start = time.perf_counter()
+        reading = Codec.decode(msg.payload, msg.topic)
+        if reading is None:
+            self.skipped += 1
+            self.skipped_total.inc()
+            return
+        self.received += 1
+        self.router.dispatch(msg.topic, time.time(), msg.topic, reading)
+        self.message_seconds.observe(time.perf_counter() - start)
+        self.received_total.inc()
+
+    async def report(self):
+        last = self.received
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            log.info("%.0f msgs/sec, %d received, %d skipped, on_message p99 < %.3f ms",
+                     (self.received - last) / STATS_INTERVAL, self.received, self.skipped,
+                     self.message_seconds.percentile(99) * 1000)
+            last = self.received
+            for sink in self.sinks:
+                if isinstance(sink, AggregatorSink):
+                    sink.report()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.disconnected = asyncio.Event()
+        client = mqtt.Client(client_id=self.client_id, clean_session=True)
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_message = self.on_message
+        AsyncioHelper(loop, client)
+        for sink in self.sinks:
+            if isinstance(sink, ForwardSink):
+                await sink.start()
+        reporter = loop.create_task(self.report())
+
+        # Same backoff policy as the GUI connections
+        try:
+            while True:
+                self.disconnected.clear()
+                try:
+                    log.info("Connecting to broker %s:%s", self.broker, self.port)
+                    client.connect(self.broker, self.port)
+                    await self.disconnected.wait()
+                except OSError as e:
+                    log.warning("Connection failed: %s", e)
+                wait = self.delay / 2 + random.uniform(0, self.delay / 2)
+                await asyncio.sleep(wait)
+                self.delay = min(self.delay * 2, MqttCore.RECONNECT_MAX_DELAY)
+        finally:
+            reporter.cancel()
+            client.disconnect()
+            for sink in self.sinks:
+                sink.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Headless smart home subscriber")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1884)
+    parser.add_argument("--client-id", default=DAEMON_CLIENT_ID)
+    parser.add_argument("--homes", nargs="*", default=None,
+                        help="home IDs to subscribe to, all homes (pr/home/+/sts) by default")
+    parser.add_argument("--sink", action="append", choices=("stdout", "storage", "aggregate", "forward"),
+                        help="where readings go, may be repeated (default: stdout)")
+    parser.add_argument("--history-dir", default="history")
+    parser.add_argument("--forward-port", type=int, default=DAEMON_PORT)
+    parser.add_argument("--ingest-workers", type=int, default=0,
+                        help="decode and aggregate in this many processes; sinks get per-second summaries")
+    parser.add_argument("--shared-subscription", action="store_true",
+                        help="with --ingest-workers, each worker subscribes via $share instead of a fan-out")
+    Metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.ingest_workers and set(args.sink or ["stdout"]) - {"stdout", "aggregate"}:
+        parser.error("--ingest-workers supports the stdout and aggregate sinks")
+    return args
+
+
+def run_ingest_workers(args, topics, sinks):
+    # Readings never reach this process, only the workers' summaries
+    import IngestWorkers
+
+    def on_summary(rows):
+        for sink in sinks:
+            sink.handle_summary(rows)
+
+    pool = IngestWorkers.IngestPool(args.broker, args.port, topics, args.ingest_workers, args.client_id,
+                                    shared=args.shared_subscription, on_summary=on_summary)
+    pool.start()
+    last = 0
+    try:
+        while True:
+            time.sleep(STATS_INTERVAL)
+            stats = pool.stats()
+            log.info("%.0f msgs/sec, %d received, %d skipped, %d dropped, worker busy %s s",
+                     (stats["received"] - last) / STATS_INTERVAL, stats["received"], stats["skipped"],
+                     stats["dropped"], ", ".join(f"{busy:.1f}" for busy in stats["busy_seconds"]))
+            last = stats["received"]
+            for sink in sinks:
+                if isinstance(sink, AggregatorSink):
+                    sink.report()
+    except KeyboardInterrupt:
+        log.info("Daemon stopped by user.")
+    finally:
+        pool.close()
+        for sink in sinks:
+            sink.close()
+
+
+def main():
+    args = parse_args()
+    Metrics.configure(args)
+    topics = [TopicRouter.status_topic(home) for home in args.homes] if args.homes else [TopicRouter.STATUS_FILTER]
+    sinks = []
+    for name in args.sink or ["stdout"]:
+        if name == "stdout":
+            sinks.append(StdoutSink())
+        elif name == "storage":
+            import Storage
+            try:
+                sinks.append(StorageSink(args.history_dir))
+            except Storage.HistoryLocked as e:
+                log.error("%s; close the GUI or use another --history-dir", e)
+                for sink in sinks:
+                    sink.close()
+                return 1
+        elif name == "aggregate":
+            sinks.append(AggregatorSink())
+        else:
+            sinks.append(ForwardSink(args.forward_port))
+    if args.ingest_workers:
+        run_ingest_workers(args, topics, sinks)
+        return 0
+    daemon = SubscriberDaemon(args.broker, args.port, topics, sinks, args.client_id)
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        log.info("Daemon stopped by user.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
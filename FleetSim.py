@@ -0,0 +1,757 @@
+# IoT Project
+# Fleet Simulation
+
+# fleet_sim.py
+# An in-process broker, transport and clock for running the panels' MqttClient classes
+# against thousands of virtual devices without a network. Time is simulated: events run
+# in timestamp order as fast as Python allows, so an hour of fleet traffic takes seconds.
+# While a Simulation is installed, MqttCore opens SimConnections: a SimClient stands in for
+# paho and the simulation steps the network loop, so reconnect backoff and the outbox run as is.
+# Besides restarts, the broker can stay up but turn clients away, with a refusing CONNACK or
+# by closing the socket before any CONNACK, the way a broker with a failing auth backend does.
+# Results (throughput, delivery and callback latency, reconnects) come back as a dict that
+# automated checks can assert on; the command line exits non-zero when a limit is missed.
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+from collections import deque
+import paho.mqtt.client as mqtt
+import Codec
+import Metrics
+import MqttCore
+import TopicRouter
+
+SIM_BROKER = "fleet-sim"  # Broker host the panels are pointed at
+SIM_PORT = 1883
+SIM_EPOCH = 1700000000.0  # Simulated wall-clock time at the start of a run
+LINK_LATENCY = 0.005  # Seconds each way between a client and the broker...
+LINK_JITTER = 0.002  # ...plus up to this much per hop
+BROKER_CAPACITY = 0  # Messages per second the broker routes, 0 is unlimited
+DEVICE_PERIOD = 5.0  # Seconds between readings of each virtual device
+MAX_INFLIGHT = 20  # paho's default limit of unacknowledged QoS 1/2 publishes
+REJECT_RC = 5  # CONNACK "not authorised", sent while the broker turns clients away
+LATENCY_SAMPLES = 200000  # Latencies kept per measurement
+PANEL_KINDS = ("iot", "connect", "relay")
+RELAY_TOPIC = "pr/relay"
+
+log = logging.getLogger(__name__)
+
+
+class SimClock:
+    def __init__(self, start=SIM_EPOCH):
+        self.start = start
+        self.now = start
+        self.queue = []  # (time, sequence, fn, args)
+        self.sequence = itertools.count()
+        self.events = 0
+
+    def call_at(self, when, fn, *args):
+        heapq.heappush(self.queue, (when, next(self.sequence), fn, args))
+
+    def call_later(self, delay, fn, *args):
+        self.call_at(self.now + delay, fn, *args)
+
+    def run_until(self, end):
+        # Runs every event due up to `end`, in order; events may schedule more events
+        queue = self.queue
+        while queue and queue[0][0] <= end:
+            when, _, fn, args = heapq.heappop(queue)
+            self.now = when
+            fn(*args)
+            self.events += 1
+        self.now = max(self.now, end)
+
+
+class _Subscription:
+    __slots__ = ("client", "qos")
+
+    def __init__(self, client, qos):
+        self.client = client
+        self.qos = qos
+
+
+# Members of one $share/<group>/<filter>, each message goes to the next one in turn
+class _ShareGroup:
+    __slots__ = ("members", "next")
+
+    def __init__(self):
+        self.members = []
+        self.next = 0
+
+    def pick(self):
+        self.next = (self.next + 1) % len(self.members)
+        return self.members[self.next]
+
+
+# Clean sessions only: a dropped client loses its subscriptions and anything in transit
+class SimBroker:
+    def __init__(self, clock, latency=LINK_LATENCY, jitter=LINK_JITTER, capacity=BROKER_CAPACITY, rng=None):
+        self.clock = clock
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.random = rng or random.Random()
+        self.up = True
+        self.sessions = {}  # client ID -> SimClient
+        self.subscriptions = {}  # client ID -> {topic filter: _Subscription}
+        self.router = TopicRouter.TopicRouter()  # Topic filter -> _Subscription or _ShareGroup
+        self.groups = {}  # $share/<group>/<filter> -> _ShareGroup
+        self.retained = {}  # topic -> (payload, qos)
+        self.busy_until = 0.0  # When the broker is done routing what it already has
+        self.received = 0
+        self.delivered = 0
+        self.refused = 0
+        self.restarts = 0
+        self.rejections = 0
+        self.connack_rc = 0  # Return code of the CONNACKs sent, non-zero refuses the connection
+        self.close_early = False  # Accept connections, then close them before any CONNACK
+        self.started_at = []  # Times the broker came back up after a restart
+        self.callback_seconds = []  # Real time spent in on_message, per delivery
+
+    def hop(self):
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def connect(self, client):
+        if not self.up:
+            self.refused += 1
+            raise ConnectionRefusedError("simulated broker is down")
+        # Returns the CONNACK return code, or None when the socket is closed before one
+        if self.close_early or self.connack_rc:
+            self.refused += 1
+            return None if self.close_early else self.connack_rc
+        previous = self.sessions.get(client.client_id)
+        if previous is not None and previous is not client:
+            self.drop(previous)  # Session takeover by the same client ID
+        self.clear_subscriptions(client.client_id)
+        self.sessions[client.client_id] = client
+        return 0
+
+    def disconnect(self, client):
+        if self.sessions.get(client.client_id) is client:
+            del self.sessions[client.client_id]
+            self.clear_subscriptions(client.client_id)
+
+    def drop(self, client):
+        self.disconnect(client)
+        client.lose()
+
+    def clear_subscriptions(self, client_id):
+        for topic_filter, subscription in self.subscriptions.pop(client_id, {}).items():
+            self.remove_subscription(topic_filter, subscription)
+
+    def add_subscription(self, topic_filter, subscription):
+        route = TopicRouter.route_filter(topic_filter)
+        if route == topic_filter:
+            self.router.add(topic_filter, subscription)
+            return
+        group = self.groups.get(topic_filter)
+        if group is None:
+            group = self.groups[topic_filter] = _ShareGroup()
+            self.router.add(route, group)
+        group.members.append(subscription)
+
+    def remove_subscription(self, topic_filter, subscription):
+        route = TopicRouter.route_filter(topic_filter)
+        if route == topic_filter:
+            self.router.remove(topic_filter, subscription)
+            return
+        group = self.groups[topic_filter]
+        group.members.remove(subscription)
+        if not group.members:
+            del self.groups[topic_filter]
+            self.router.remove(route, group)
+
+    def subscribe(self, client, filters):
+        subscriptions = self.subscriptions.setdefault(client.client_id, {})
+        for topic_filter, qos in filters:
+            subscription = subscriptions.get(topic_filter)
+            if subscription is None:
+                subscription = subscriptions[topic_filter] = _Subscription(client, qos)
+                self.add_subscription(topic_filter, subscription)
+            subscription.qos = qos
+            # Shared subscriptions are not sent retained messages
+            if self.retained and TopicRouter.route_filter(topic_filter) == topic_filter:
+                matcher = TopicRouter.TopicRouter()
+                matcher.add(topic_filter, True)
+                for topic, (payload, retained_qos) in self.retained.items():
+                    if matcher.match(topic):
+                        client.post(self.hop(), client.deliver, topic, payload, min(qos, retained_qos), True)
+
+    def unsubscribe(self, client, topic_filter):
+        subscription = self.subscriptions.get(client.client_id, {}).pop(topic_filter, None)
+        if subscription is not None:
+            self.remove_subscription(topic_filter, subscription)
+
+    def publish(self, client, mid, topic, payload, qos, retain):
+        self.route(topic, payload, qos, retain)
+        if qos:
+            # PUBACK, or PUBREC/PUBREL/PUBCOMP for QoS 2
+            client.post(self.hop() * (1 if qos == 1 else 3), client.acked, mid)
+
+    def route(self, topic, payload, qos, retain):
+        self.received += 1
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        start = self.clock.now
+        if self.capacity:
+            start = max(start, self.busy_until)
+            self.busy_until = start + 1.0 / self.capacity
+        # A client with several matching filters gets one copy at the highest QoS
+        granted = {}
+        for subscription in self.router.match(topic):
+            if type(subscription) is _ShareGroup:
+                subscription = subscription.pick()
+            granted[subscription.client] = max(granted.get(subscription.client, 0), subscription.qos)
+        delay = start - self.clock.now
+        for client, client_qos in granted.items():
+            client.post(delay + self.hop(), client.deliver, topic, payload, min(qos, client_qos), False)
+
+    def stop(self, keep_retained=True):
+        # Every connection drops; clients find out from their next loop
+        self.up = False
+        self.restarts += 1
+        for client in list(self.sessions.values()):
+            self.drop(client)
+        self.busy_until = 0.0
+        if not keep_retained:
+            self.retained.clear()
+
+    def start(self):
+        self.up = True
+        self.started_at.append(self.clock.now)
+
+    def restart(self, downtime, keep_retained=True):
+        self.stop(keep_retained)
+        self.clock.call_later(downtime, self.start)
+
+    def reject(self, downtime, rc=REJECT_RC, close_early=False):
+        # Drops every client and, for `downtime`, answers their reconnects with CONNACK `rc`,
+        # or with close_early, by closing the socket before sending any CONNACK
+        self.rejections += 1
+        for client in list(self.sessions.values()):
+            self.drop(client)
+        self.connack_rc = rc
+        self.close_early = close_early
+        self.clock.call_later(downtime, self.accept)
+
+    def accept(self):
+        self.connack_rc = 0
+        self.close_early = False
+        self.started_at.append(self.clock.now)
+
+
+# The part of paho's Client that MqttCore and the panels use, over a SimBroker
+class SimClient:
+    def __init__(self, broker, client_id, clean_session=True):
+        self.broker = broker
+        self.clock = broker.clock
+        self.client_id = client_id
+        self.clean_session = clean_session  # Sessions are always clean on the simulated broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_log = None
+        self.wake = None  # Called when the connection drops, so the owner's loop notices at once
+        self.open = False  # Socket open
+        self.connected = False  # CONNACK received
+        self.lost = None  # Error of a drop by the broker, reported by the next loop()
+        self.generation = 0  # Bumped per connection; packets of an older one are discarded
+        self.mids = itertools.count(1)
+        self._out_messages = {}  # MID -> publish awaiting its ack, as in paho
+        self.held = deque()  # QoS 1/2 publishes beyond the in-flight limit
+        self.max_inflight = MAX_INFLIGHT
+        self.connects = 0
+        self.received = 0
+
+    def max_inflight_messages_set(self, inflight):
+        self.max_inflight = inflight
+
+    def next_mid(self):
+        return next(self.mids) % 65535 + 1
+
+    def send(self, handler, *args):
+        # A packet to the broker; it is lost if this connection drops before it arrives
+        self.clock.call_later(self.broker.hop(), self.arrive, self.generation, handler, args)
+
+    def post(self, delay, handler, *args):
+        # A packet from the broker to this client
+        self.clock.call_later(delay, self.arrive, self.generation, handler, args)
+
+    def arrive(self, generation, handler, args):
+        if generation == self.generation and self.open:
+            handler(*args)
+
+    def connect(self, host, port=SIM_PORT, keepalive=60):
+        rc = self.broker.connect(self)
+        self.generation += 1
+        self.open = True
+        self.lost = None
+        if rc is None:
+            self.post(2 * self.broker.hop(), self.lose)
+        else:
+            self.post(2 * self.broker.hop(), self.connack, rc)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def connack(self, rc=0):
+        if rc:
+            # Like paho: on_connect hears the refusal, then the socket closes and loop() fails
+            if self.on_connect:
+                self.on_connect(self, None, {"session present": 0}, rc)
+            self.lose(mqtt.MQTT_ERR_CONN_REFUSED)
+            return
+        self.connected = True
+        self.connects += 1
+        if self.on_connect:
+            self.on_connect(self, None, {"session present": 0}, 0)
+        # Like paho, unacknowledged publishes are sent again on the new connection
+        self.release_held()
+
+    def lose(self, error=mqtt.MQTT_ERR_CONN_LOST):
+        self.generation += 1
+        self.open = False
+        self.connected = False
+        self.lost = error
+        for entry in reversed(list(self._out_messages.values())):
+            if entry[3]:
+                self.held.appendleft(entry)
+        self._out_messages.clear()
+        if self.wake:
+            self.wake()
+
+    def loop(self, timeout=1.0):
+        # Packets are handled as they arrive; the loop only reports on the connection
+        if self.lost:
+            error, self.lost = self.lost, None
+            if self.on_disconnect:
+                self.on_disconnect(self, None, error)
+            return error
+        return mqtt.MQTT_ERR_SUCCESS if self.open else mqtt.MQTT_ERR_NO_CONN
+
+    def disconnect(self):
+        if not self.open:
+            return mqtt.MQTT_ERR_NO_CONN
+        self.broker.disconnect(self)
+        self.generation += 1
+        self.open = False
+        self.connected = False
+        if self.on_disconnect:
+            self.on_disconnect(self, None, mqtt.MQTT_ERR_SUCCESS)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic, qos=0):
+        if not self.open:
+            return mqtt.MQTT_ERR_NO_CONN, None
+        filters = topic if isinstance(topic, list) else [(topic, qos)]
+        self.send(self.broker.subscribe, self, filters)
+        return mqtt.MQTT_ERR_SUCCESS, self.next_mid()
+
+    def unsubscribe(self, topic):
+        if not self.open:
+            return mqtt.MQTT_ERR_NO_CONN, None
+        self.send(self.broker.unsubscribe, self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, self.next_mid()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if payload is None:
+            payload = b""
+        elif isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode("ascii")
+        info = mqtt.MQTTMessageInfo(self.next_mid())
+        entry = (info, topic, payload, qos, retain)
+        if not self.open:
+            info.rc = mqtt.MQTT_ERR_NO_CONN
+        elif qos and len(self._out_messages) >= self.max_inflight:
+            self.held.append(entry)
+        else:
+            self.transmit(entry)
+        return info
+
+    def transmit(self, entry):
+        info, topic, payload, qos, retain = entry
+        self.send(self.broker.publish, self, info.mid, topic, payload, qos, retain)
+        if qos:
+            self._out_messages[info.mid] = entry
+        elif self.on_publish:
+            self._out_messages[info.mid] = entry
+            self.post(0, self.acked, info.mid)  # QoS 0 counts as published once written
+        else:
+            info._set_as_published()
+
+    def acked(self, mid):
+        entry = self._out_messages.pop(mid, None)
+        if entry is None:
+            return
+        entry[0]._set_as_published()
+        if self.on_publish:
+            self.on_publish(self, None, mid)
+        self.release_held()
+
+    def release_held(self):
+        while self.held and self.connected and len(self._out_messages) < self.max_inflight:
+            self.transmit(self.held.popleft())
+
+    def deliver(self, topic, payload, qos, retain):
+        message = mqtt.MQTTMessage(0, topic.encode("utf-8"))
+        message.payload = payload
+        message.qos = qos
+        message.retain = retain
+        self.received += 1
+        self.broker.delivered += 1
+        if self.on_message:
+            start = time.perf_counter()
+            self.on_message(self, None, message)
+            if len(self.broker.callback_seconds) < LATENCY_SAMPLES:
+                self.broker.callback_seconds.append(time.perf_counter() - start)
+
+
+# A smart plug publishing one appliance's readings on its home's status topic
+class Device:
+    def __init__(self, simulation, home, appliance, period=DEVICE_PERIOD, qos=0, retain=False,
+                 payload_format=Codec.BINARY_FORMAT):
+        self.clock = simulation.clock
+        self.random = simulation.random
+        self.client = SimClient(simulation.broker, f"device-{home}-{appliance}")
+        self.topic = TopicRouter.status_topic(home)
+        self.appliance = appliance
+        self.period = period
+        self.qos = qos
+        self.retain = retain
+        self.payload_format = payload_format
+        self.sent = 0
+        self.skipped = 0  # Readings taken while not connected
+
+    def start(self, offset):
+        self.clock.call_later(offset, self.tick)
+
+    def tick(self):
+        if self.client.connected:
+            reading = round(self.random.uniform(0.1, 2.0), 2)
+            message = Codec.encode(self.appliance, reading, self.payload_format, self.clock.now)
+            self.client.publish(self.topic, message, qos=self.qos, retain=self.retain)
+            self.sent += 1
+        else:
+            self.skipped += 1
+            if not self.client.open:
+                try:
+                    self.client.connect(SIM_BROKER)  # Devices retry on their own reading period
+                except ConnectionRefusedError:
+                    pass
+        self.clock.call_later(self.period, self.tick)
+
+
+# A SharedConnection on the simulated broker and clock, without a network thread
+class SimConnection(MqttCore.SharedConnection):
+    def __init__(self, simulation, broker, port, client_id, clean_session=True):
+        self.simulation = simulation
+        rng = random.Random(simulation.random.getrandbits(32))  # Reconnect jitter, per connection
+        super().__init__(broker, port, client_id, clean_session, rng)
+
+    def create_client(self, client_id, clean_session):
+        return SimClient(self.simulation.broker, client_id, clean_session)
+
+    def start(self):
+        self.running = True
+        self.simulation.attach(self)  # The simulation calls step() on its clock
+
+
+class Simulation:
+    def __init__(self, latency=LINK_LATENCY, jitter=LINK_JITTER, capacity=BROKER_CAPACITY, seed=0):
+        self.random = random.Random(seed)
+        self.clock = SimClock()
+        self.broker = SimBroker(self.clock, latency, jitter, capacity, self.random)
+        self.devices = []
+        self.panels = []  # (kind, MqttClient)
+        self.steps = {}  # SharedConnection -> token of its next scheduled step
+        self.connected_at = []  # (client ID, simulated time) of every panel connect
+        self.panel_received = 0
+        self.delivery_seconds = []  # Reading timestamp to panel callback, simulated
+        self.relayed = 0
+        self.flooded = 0
+        self.wall_seconds = 0.0
+        self.previous = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def install(self):
+        self.previous = MqttCore.CONNECTION_FACTORY
+        MqttCore.CONNECTION_FACTORY = self.open_connection
+
+    # SimConnection hooks
+    def open_connection(self, broker, port, client_id, clean_session=True):
+        return SimConnection(self, broker, port, client_id, clean_session)
+
+    def attach(self, connection):
+        connection.client.wake = lambda: self.schedule_step(connection, 0)
+        self.schedule_step(connection, 0)
+
+    def schedule_step(self, connection, delay):
+        # A newer schedule replaces the pending one
+        token = self.steps[connection] = self.steps.get(connection, 0) + 1
+        self.clock.call_later(delay, self.step, connection, token)
+
+    def step(self, connection, token):
+        if self.steps.get(connection) != token or not connection.running:
+            return
+        wait = connection.step()
+        if not wait:
+            wait = MqttCore.LOOP_TIMEOUT if connection.socket_open else 0
+        self.schedule_step(connection, wait)
+
+    # Fleet
+    def add_devices(self, homes, appliances, period=DEVICE_PERIOD, qos=0, retain=False,
+                    payload_format=Codec.BINARY_FORMAT):
+        # Binary payloads carry the reading's timestamp, which delivery latency is measured from
+        # Named like the load generator's streams
+        names = Codec.load_appliances(appliances)
+        for home in range(homes):
+            for appliance in names:
+                device = Device(self, f"sim{home:04d}", appliance, period, qos, retain, payload_format)
+                device.start(self.random.uniform(0, period))  # Spread the first readings over a period
+                self.devices.append(device)
+
+    def add_panel(self, kind, client_id, topic=TopicRouter.STATUS_FILTER):
+        # Connects one of the panels' MqttClient classes through MqttCore; kind is one of PANEL_KINDS
+        if kind == "iot":
+            import IoT_Project
+            client = IoT_Project.MqttClient()
+            client.on_message_to_form = self.on_reading
+        elif kind == "connect":
+            import Connect
+            client = Connect.MqttClient()
+            client.set_on_message_to_form(self.on_notice)
+        elif kind == "relay":
+            import Relay
+            client = Relay.MqttClient()
+        else:
+            raise ValueError(f"Unknown panel kind {kind!r}")
+        client.broker = SIM_BROKER
+        client.port = SIM_PORT
+        client.client_name = client_id
+        client.on_connected_to_form = lambda: self.connected_at.append((client_id, self.clock.now))
+        client.connect_to()
+        if kind == "relay":
+            self.clock.call_later(self.random.uniform(0, 1), self.relay_tick, client)
+        elif topic:
+            client.subscribe_to(topic)
+        self.panels.append((kind, client))
+        return client
+
+    def on_reading(self, topic, reading):
+        self.panel_received += 1
+        if reading.timestamp and len(self.delivery_seconds) < LATENCY_SAMPLES:
+            self.delivery_seconds.append(self.clock.now - reading.timestamp)
+
+    def on_notice(self, text):
+        self.panel_received += 1
+
+    def relay_tick(self, client):
+        # Relay panels send one reading a second; offline ones queue in the outbox
+        if client.connection:
+            reading = round(self.random.uniform(0.1, 2.0), 2)
+            client.publish_to(RELAY_TOPIC, Codec.encode("relay", reading, Codec.BINARY_FORMAT, self.clock.now))
+            self.relayed += 1
+            self.clock.call_later(1.0, self.relay_tick, client)
+
+    # Scenario events, `at` in seconds from the start of the simulation
+    def restart_broker(self, at, downtime, keep_retained=True):
+        self.clock.call_at(self.clock.start + at, self.broker.restart, downtime, keep_retained)
+
+    def reject_connections(self, at, downtime, rc=REJECT_RC, close_early=False):
+        self.clock.call_at(self.clock.start + at, self.broker.reject, downtime, rc, close_early)
+
+    def flood(self, at, count, rate=0.0, topic=None, qos=0):
+        # `count` readings from one extra client, all at once or at `rate` msgs/sec
+        flooder = SimClient(self.broker, f"flooder-{len(self.devices)}")
+        flooder.max_inflight_messages_set(count)
+        topic = topic or TopicRouter.status_topic("flood")
+        start = self.clock.start + at
+
+        def connect():
+            try:
+                flooder.connect(SIM_BROKER)
+            except ConnectionRefusedError:
+                pass
+
+        def send(index):
+            if not flooder.connected:
+                return
+            message = Codec.encode("flood", 1.0, Codec.BINARY_FORMAT, self.clock.now)
+            flooder.publish(topic, message, qos=qos)
+            self.flooded += 1
+            if index + 1 < count:
+                self.clock.call_later(1.0 / rate if rate else 0.0, send, index + 1)
+
+        # Connected a second early, so the flood starts on time
+        self.clock.call_at(max(start - 1.0, self.clock.now), connect)
+        self.clock.call_at(start, send, 0)
+
+    def run(self, seconds):
+        started = time.perf_counter()
+        self.clock.run_until(self.clock.now + seconds)
+        self.wall_seconds += time.perf_counter() - started
+
+    def close(self):
+        for kind, client in self.panels:
+            client.disconnect_from()
+        for device in self.devices:
+            device.client.disconnect()
+        self.panels = []
+        MqttCore.CONNECTION_FACTORY = self.previous
+
+    def reconnect_seconds(self):
+        # Per restart, how long each panel took to reconnect once the broker was back
+        delays = []
+        panel_ids = {client.client_name for _, client in self.panels}
+        for up in self.broker.started_at:
+            first = {}
+            for client_id, when in self.connected_at:
+                if when >= up and client_id not in first:
+                    first[client_id] = when - up
+            delays.extend(first.get(client_id, float("inf")) for client_id in panel_ids)
+        return delays
+
+    def results(self):
+        sim_seconds = self.clock.now - self.clock.start
+        connections = [client.connection for _, client in self.panels if client.connection]
+        delivery = Metrics.percentiles(self.delivery_seconds, (50, 99, 100))
+        callback = Metrics.percentiles(self.broker.callback_seconds, (50, 99, 100))
+        reconnects = Metrics.percentiles(self.reconnect_seconds(), (50, 100))
+        published = sum(device.sent for device in self.devices) + self.flooded
+        listening = sum(1 for kind, _ in self.panels if kind != "relay")
+        return {
+            "sim_seconds": sim_seconds,
+            "wall_seconds": self.wall_seconds,
+            "speedup": sim_seconds / self.wall_seconds if self.wall_seconds else 0.0,
+            "events": self.clock.events,
+            "devices": len(self.devices),
+            "panels": len(self.panels),
+            "published": published,
+            "skipped_offline": sum(device.skipped for device in self.devices),
+            "flooded": self.flooded,
+            "relayed": self.relayed,
+            "broker_received": self.broker.received,
+            "broker_delivered": self.broker.delivered,
+            "panel_received": self.panel_received,
+            "delivery_ratio": self.panel_received / (published * listening) if published and listening else 0.0,
+            "msgs_per_sim_sec": self.broker.delivered / sim_seconds if sim_seconds else 0.0,
+            "msgs_per_wall_sec": self.broker.delivered / self.wall_seconds if self.wall_seconds else 0.0,
+            "delivery_ms_p50": delivery[50] * 1000,
+            "delivery_ms_p99": delivery[99] * 1000,
+            "delivery_ms_max": delivery[100] * 1000,
+            "callback_us_p50": callback[50] * 1e6,
+            "callback_us_p99": callback[99] * 1e6,
+            "callback_us_max": callback[100] * 1e6,
+            "restarts": self.broker.restarts,
+            "refused": self.broker.refused,
+            "rejections": self.broker.rejections,
+            "panel_connects": sum(connection.connects for connection in connections),
+            "panel_failed_attempts": sum(connection.failed_attempts for connection in connections),
+            "outbox_flushed": sum(connection.flushed for connection in connections),
+            "reconnect_s_p50": reconnects[50],
+            "reconnect_s_max": reconnects[100],
+        }
+
+
+def check(results, max_delivery_ms=None, max_reconnect=None, min_delivery_ratio=None):
+    # Returns the limits the results miss, empty when they all hold
+    failures = []
+    if max_delivery_ms is not None and results["delivery_ms_p99"] > max_delivery_ms:
+        failures.append(f"delivery p99 {results['delivery_ms_p99']:.1f} ms above {max_delivery_ms} ms")
+    if max_reconnect is not None and results["reconnect_s_max"] > max_reconnect:
+        failures.append(f"slowest reconnect {results['reconnect_s_max']:.1f}s above {max_reconnect}s")
+    if min_delivery_ratio is not None and results["delivery_ratio"] < min_delivery_ratio:
+        failures.append(f"delivery ratio {results['delivery_ratio']:.4f} below {min_delivery_ratio}")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the panels' MQTT clients against a simulated fleet")
+    parser.add_argument("--homes", type=int, default=500)
+    parser.add_argument("--appliances", type=int, default=4, help="devices per home")
+    parser.add_argument("--period", type=float, default=DEVICE_PERIOD, help="seconds between readings per device")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0, help="QoS of the device readings")
+    parser.add_argument("--retain", action="store_true", help="devices publish retained readings")
+    parser.add_argument("--format", choices=Codec.PAYLOAD_FORMATS, default=Codec.BINARY_FORMAT,
+                        help="device payload format; text readings carry no timestamp to measure latency from")
+    parser.add_argument("--panels", nargs="+", default=["iot"], choices=PANEL_KINDS,
+                        help="panel MqttClients to connect, e.g. iot connect relay")
+    parser.add_argument("--panel-count", type=int, default=1, help="instances of each panel kind")
+    parser.add_argument("--duration", type=float, default=600, help="simulated seconds")
+    parser.add_argument("--latency", type=float, default=LINK_LATENCY, help="seconds per hop")
+    parser.add_argument("--jitter", type=float, default=LINK_JITTER)
+    parser.add_argument("--capacity", type=float, default=BROKER_CAPACITY, help="broker msgs/sec, 0 = unlimited")
+    parser.add_argument("--restart-at", type=float, nargs="*", default=[], help="simulated times of broker restarts")
+    parser.add_argument("--downtime", type=float, default=10, help="seconds the broker stays down per restart")
+    parser.add_argument("--reject-at", type=float, nargs="*", default=[],
+                        help="simulated times the broker starts turning clients away for --downtime")
+    parser.add_argument("--reject-rc", type=int, default=REJECT_RC, help="CONNACK return code of the refusals")
+    parser.add_argument("--close-early", action="store_true",
+                        help="refuse by closing the socket before any CONNACK instead")
+    parser.add_argument("--flood-at", type=float, default=None, help="simulated time of a message flood")
+    parser.add_argument("--flood-count", type=int, default=100000)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="flood msgs/sec, 0 = all at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-delivery-ms", type=float, default=None, help="fail when delivery p99 is above this")
+    parser.add_argument("--max-reconnect", type=float, default=None, help="fail when a panel takes longer to reconnect")
+    parser.add_argument("--min-delivery-ratio", type=float, default=None, help="fail when fewer readings arrive")
+    parser.add_argument("--json", action="store_true", help="print the results as one JSON line")
+    Metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    Metrics.configure(args)
+    with Simulation(args.latency, args.jitter, args.capacity, args.seed) as simulation:
+        simulation.add_devices(args.homes, args.appliances, args.period, args.qos, args.retain, args.format)
+        for kind in args.panels:
+            for index in range(args.panel_count):
+                simulation.add_panel(kind, f"sim-{kind}-{index}")
+        for at in args.restart_at:
+            simulation.restart_broker(at, args.downtime)
+        for at in args.reject_at:
+            simulation.reject_connections(at, args.downtime, args.reject_rc, args.close_early)
+        if args.flood_at is not None:
+            simulation.flood(args.flood_at, args.flood_count, args.flood_rate)
+        simulation.run(args.duration)
+        results = simulation.results()
+    failures = check(results, args.max_delivery_ms, args.max_reconnect, args.min_delivery_ratio)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(
+            f"{results['devices']} devices, {results['panels']} panels: {results['sim_seconds']:.0f}s simulated in "
+            f"{results['wall_seconds']:.2f}s ({results['speedup']:.0f}x), {results['broker_delivered']} deliveries "
+            f"({results['msgs_per_wall_sec']:.0f} msgs/sec real)\n"
+            f"delivery ms p50={results['delivery_ms_p50']:.2f} p99={results['delivery_ms_p99']:.2f} "
+            f"max={results['delivery_ms_max']:.2f}, ratio {results['delivery_ratio']:.4f}\n"
+            f"callback us p50={results['callback_us_p50']:.1f} p99={results['callback_us_p99']:.1f} "
+            f"max={results['callback_us_max']:.1f}\n"
+            f"{results['restarts']} restarts, {results['rejections']} rejections: "
+            f"{results['panel_connects']} panel connects, "
+            f"{results['panel_failed_attempts']} failed attempts, reconnect s p50={results['reconnect_s_p50']:.2f} "
+            f"max={results['reconnect_s_max']:.2f}, {results['outbox_flushed']} outbox messages flushed"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+# IoT Project
+# Multi-process Ingest
+
+# ingest_workers.py
+# Spreads decoding and aggregation of pr/home/+/sts traffic over worker processes, so ingest
+# is not bound to one interpreter's GIL. By default one MQTT connection fans raw payloads out
+# to the workers, sharded by topic (one topic per home), in length-prefixed batches over pipes.
+# With shared=True every worker holds its own $share/<group>/... subscription instead and the
+# broker spreads the messages (mosquitto and EMQX; not amqtt). Either way the workers only send
+# back one summary per series every SUMMARY_INTERVAL seconds.
+import argparse
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.connection import wait
+import Codec
+import Metrics
+import TopicRouter
+
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # One core is left for the fan-out connection
+BATCH_SIZE = 1000  # Messages per batch that wake the sender early
+BATCH_INTERVAL = 0.01  # Seconds a partial batch waits before it is sent
+MAX_PENDING_BYTES = 8 << 20  # Per worker; messages beyond this are dropped while it catches up
+SUMMARY_INTERVAL = 1.0  # Seconds between summaries from each worker
+SHARE_GROUP = "iot-ingest"
+FRAME = struct.Struct("<HI")  # topic length, payload length
+INGEST_CLIENT_ID = "IOT_ingest-3164"
+STATS_INTERVAL = 10  # Seconds between throughput reports
+
+log = logging.getLogger(__name__)
+
+
+def shard_for(topic, workers):
+    # crc32, not hash(): the same topic must map to the same worker in every run
+    return zlib.crc32(topic.encode("utf-8")) % workers
+
+
+# Lives in a worker process: decodes readings and keeps per-series totals for one interval
+class IngestWorker:
+    def __init__(self, index):
+        self.index = index
+        self.lock = threading.Lock()  # The shared-subscription network thread also updates
+        self.series = {}  # (home, appliance) -> [count, sum, min, max, last timestamp, last kWh]
+        self.messages = 0
+        self.skipped = 0
+        self.busy = 0.0
+
+    def ingest(self, data):
+        # One batch of FRAME-prefixed (topic, payload) records from the fan-out connection
+        start = time.perf_counter()
+        offset = 0
+        size = len(data)
+        with self.lock:
+            while offset < size:
+                topic_length, payload_length = FRAME.unpack_from(data, offset)
+                offset += FRAME.size
+                topic = data[offset:offset + topic_length].decode("utf-8")
+                offset += topic_length
+                self.update(topic, data[offset:offset + payload_length])
+                offset += payload_length
+            self.busy += time.perf_counter() - start
+
+    def subscribe(self, connection, topics, qos):
+        # Joins the share group on every topic, the broker spreads the messages over its members
+        for topic in topics:
+            connection.subscribe(TopicRouter.shared_filter(SHARE_GROUP, topic), self.on_message, qos)
+
+    def on_message(self, client, userdata, msg):
+        start = time.perf_counter()
+        with self.lock:
+            self.update(msg.topic, msg.payload)
+            self.busy += time.perf_counter() - start
+
+    def update(self, topic, payload):
+        self.messages += 1
+        reading = Codec.decode(payload, topic)
+        if reading is None:
+            self.skipped += 1
+            return
+        kwh = reading.kwh
+        timestamp = reading.timestamp or time.time()
+        entry = self.series.get((reading.home, reading.appliance))
+        if entry is None:
+            self.series[(reading.home, reading.appliance)] = [1, kwh, kwh, kwh, timestamp, kwh]
+            return
+        entry[0] += 1
+        entry[1] += kwh
+        if kwh < entry[2]:
+            entry[2] = kwh
+        if kwh > entry[3]:
+            entry[3] = kwh
+        entry[4] = timestamp
+        entry[5] = kwh
+
+    def take_summary(self):
+        # (worker, messages, skipped, busy seconds, rows) since the last summary; rows are
+        # (home, appliance, count, sum, min, max, last timestamp, last kWh)
+        with self.lock:
+            rows = [key + tuple(entry) for key, entry in self.series.items()]
+            summary = (self.index, self.messages, self.skipped, self.busy, rows)
+            self.series = {}
+            self.messages = 0
+            self.skipped = 0
+            self.busy = 0.0
+        return summary
+
+
+def worker_main(index, batches, summaries, summary_interval, subscription):
+    # Entry point of a worker process. subscription is None for fan-out, or
+    # (broker, port, client ID, topics, qos) for a shared subscription of its own.
+    worker = IngestWorker(index)
+    connection = None
+    if subscription:
+        import MqttCore
+        broker, port, client_id, topics, qos = subscription
+        connection = MqttCore.acquire(broker, port, f"{client_id}-{index}")
+        worker.subscribe(connection, topics, qos)
+    next_summary = time.monotonic() + summary_interval
+    try:
+        while True:
+            if batches.poll(max(0.0, next_summary - time.monotonic())):
+                try:
+                    data = batches.recv_bytes()
+                except EOFError:
+                    break
+                if not data:
+                    break  # Stop marker
+                worker.ingest(data)
+            if time.monotonic() >= next_summary:
+                summaries.send(worker.take_summary())
+                next_summary += summary_interval
+    except KeyboardInterrupt:
+        pass  # The parent shuts the pool down
+    finally:
+        if connection:
+            MqttCore.release(connection)
+        summaries.send(worker.take_summary())
+        summaries.close()
+
+
+class IngestPool:
+    def __init__(self, broker, port, topics=(TopicRouter.STATUS_FILTER,), workers=INGEST_WORKERS,
+                 client_id=INGEST_CLIENT_ID, shared=False, qos=2, on_summary=None, summary_interval=SUMMARY_INTERVAL):
+        self.broker = broker
+        self.port = port
+        self.topics = list(topics)
+        self.workers = workers
+        self.client_id = client_id
+        self.shared = shared
+        self.qos = qos
+        self.on_summary = on_summary  # on_summary(rows) on the collector thread
+        self.summary_interval = summary_interval
+        self.lock = threading.Lock()
+        self.buffers = [bytearray() for _ in range(workers)]
+        self.counts = [0] * workers
+        self.shards = {}  # topic -> (worker, encoded topic)
+        self.processes = []
+        self.batch_pipes = []
+        self.summary_pipes = []
+        self.connection = None
+        self.running = False
+        self.wakeup = threading.Event()
+        self.received = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.busy = [0.0] * workers
+        self.received_total = Metrics.counter("ingest_messages_total", "Messages decoded by the ingest workers")
+        self.dropped_total = Metrics.counter("ingest_dropped_total", "Messages dropped for a worker that fell behind")
+        Metrics.gauge("ingest_pending_bytes", "Bytes waiting to be sent to the ingest workers",
+                      lambda: sum(len(buffer) for buffer in self.buffers))
+
+    def start(self):
+        # spawn, not fork: the parent already runs paho and Qt threads
+        context = multiprocessing.get_context("spawn")
+        subscription = (self.broker, self.port, self.client_id, self.topics, self.qos) if self.shared else None
+        for index in range(self.workers):
+            batches_in, batches_out = context.Pipe(duplex=False)
+            summaries_in, summaries_out = context.Pipe(duplex=False)
+            process = context.Process(
+                target=worker_main, name=f"ingest-{index}", daemon=True,
+                args=(index, batches_in, summaries_out, self.summary_interval, subscription),
+            )
+            process.start()
+            batches_in.close()
+            summaries_out.close()
+            self.processes.append(process)
+            self.batch_pipes.append(batches_out)
+            self.summary_pipes.append(summaries_in)
+        self.running = True
+        self.collector = threading.Thread(target=self.collect, name="ingest-summaries", daemon=True)
+        self.collector.start()
+        if not self.shared:
+            import MqttCore
+            self.sender = threading.Thread(target=self.send, name="ingest-fanout", daemon=True)
+            self.sender.start()
+            self.connection = MqttCore.acquire(self.broker, self.port, self.client_id)
+            for topic in self.topics:
+                self.connection.subscribe(topic, self.on_message, self.qos)
+        log.info("%d ingest workers (%s)", self.workers, "shared subscription" if self.shared else "fan-out")
+
+    def on_message(self, client, userdata, msg):
+        # Network thread: no decoding here, just a copy into the worker's next batch
+        topic = msg.topic
+        shard = self.shards.get(topic)
+        if shard is None:
+            shard = self.shards[topic] = (shard_for(topic, self.workers), topic.encode("utf-8"))
+        index, topic_bytes = shard
+        payload = msg.payload
+        with self.lock:
+            buffer = self.buffers[index]
+            if len(buffer) >= MAX_PENDING_BYTES:
+                self.dropped += 1
+                self.dropped_total.inc()
+                return
+            buffer += FRAME.pack(len(topic_bytes), len(payload))
+            buffer += topic_bytes
+            buffer += payload
+            self.counts[index] += 1
+            full = self.counts[index] >= BATCH_SIZE
+        if full:
+            self.wakeup.set()
+
+    def send(self):
+        # Exits after one last pass once stopped, so batched messages reach the workers
+        # before close() sends the stop markers
+        while True:
+            self.wakeup.wait(BATCH_INTERVAL)
+            self.wakeup.clear()
+            stopping = not self.running
+            with self.lock:
+                ready = [(index, buffer) for index, buffer in enumerate(self.buffers) if buffer]
+                for index, _ in ready:
+                    self.buffers[index] = bytearray()
+                    self.counts[index] = 0
+            for index, buffer in ready:
+                try:
+                    self.batch_pipes[index].send_bytes(buffer)  # Blocks while the worker is behind
+                except OSError:
+                    return
+            if stopping:
+                return
+
+    def collect(self):
+        pipes = list(self.summary_pipes)
+        while pipes:
+            for pipe in wait(pipes, self.summary_interval):
+                try:
+                    index, messages, skipped, busy, rows = pipe.recv()
+                except EOFError:
+                    pipes.remove(pipe)
+                    continue
+                self.received += messages
+                self.skipped += skipped
+                self.busy[index] += busy
+                self.received_total.inc(messages)
+                if rows and self.on_summary:
+                    try:
+                        self.on_summary(rows)
+                    except Exception as e:
+                        log.error("Summary handler failed: %s", e)
+
+    def stats(self):
+        with self.lock:
+            pending = sum(len(buffer) for buffer in self.buffers)
+        return {
+            "workers": self.workers,
+            "received": self.received,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "pending_bytes": pending,
+            "busy_seconds": list(self.busy),
+        }
+
+    def close(self):
+        if self.connection:
+            import MqttCore
+            for topic in self.topics:
+                self.connection.unsubscribe(topic, self.on_message)
+            MqttCore.release(self.connection)
+            self.connection = None
+        # No message arrives after the release; the sender flushes what is buffered, then exits
+        self.running = False
+        self.wakeup.set()
+        if not self.shared:
+            self.sender.join(self.summary_interval * 5)
+        for pipe in self.batch_pipes:
+            try:
+                pipe.send_bytes(b"")  # Stop marker, after any batch already sent
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(self.summary_interval * 5)
+            if process.is_alive():
+                process.terminate()
+        self.collector.join(self.summary_interval * 2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decode and aggregate smart home readings in worker processes")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1884)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--shared", action="store_true", help="one $share subscription per worker instead of fan-out")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run, until Ctrl+C by default")
+    Metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    Metrics.configure(args)
+    series = {}
+
+    def on_summary(rows):
+        for home, appliance, count, total, *_ in rows:
+            entry = series.setdefault((home, appliance), [0, 0.0])
+            entry[0] += count
+            entry[1] += total
+
+    pool = IngestPool(args.broker, args.port, workers=args.workers, shared=args.shared, on_summary=on_summary)
+    pool.start()
+    start = last_time = time.monotonic()
+    last = 0
+    try:
+        while args.duration is None or time.monotonic() - start < args.duration:
+            remaining = STATS_INTERVAL if args.duration is None else args.duration - (time.monotonic() - start)
+            time.sleep(max(0.0, min(STATS_INTERVAL, remaining)))
+            stats = pool.stats()
+            now = time.monotonic()
+            log.info("%.0f msgs/sec, %d received, %d skipped, %d dropped, %d series",
+                     (stats["received"] - last) / max(now - last_time, 1e-9), stats["received"], stats["skipped"],
+                     stats["dropped"], len(series))
+            last, last_time = stats["received"], now
+    except KeyboardInterrupt:
+        log.info("Ingest stopped by user.")
+    finally:
+        pool.close()
+    elapsed = time.monotonic() - start
+    stats = pool.stats()
+    print(f"{stats['received']} messages in {elapsed:.1f}s ({stats['received'] / elapsed:.0f} msgs/sec) "
+          f"over {stats['workers']} workers, {stats['dropped']} dropped, {len(series)} series")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,140 @@
 # ID 3164XXXXX
 
 # main_gui.py
+import logging
+import os
 import sys
-from PyQt5.QtWidgets import *
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
-import paho.mqtt.client as mqtt
+import threading
+import time
+from array import array
+from collections import deque
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
+from PyQt5.QtGui import QDoubleValidator, QIntValidator
+from PyQt5.QtWidgets import (
+    QApplication, QComboBox, QHBoxLayout, QHeaderView, QLabel, QLineEdit, QListWidget, QMainWindow,
+    QMessageBox, QPushButton, QTableView, QVBoxLayout, QWidget,
+)
+import Chart
+import Codec
+import Metrics
+import TopicRouter
+# paho (MqttCore, Command, Daemon), NumPy (Aggregator, Storage, Compaction), Alerts and
+# QtNetwork are imported where they are first used, keeping them off the startup path
+
+log = logging.getLogger(__name__)
+
+# Subscriber ingest settings
+INGEST_QUEUE_SIZE = 10000  # Oldest messages are dropped beyond this depth
+INGEST_BATCH_SIZE = 1000  # Max messages painted per frame
+MAX_FPS = 20  # Max repaints of the subscriber panel per second
+SUBSCRIBER_LOG_CAPACITY = 50000  # Rows kept in the subscriber log
+HISTORY_DIR = "history"  # Storage.HISTORY_DIR, without importing Storage at startup
+
+
+# Thread-safe queue between the paho network thread and the Qt timer
+class IngestQueue:
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.lock:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+
+    def drain(self, limit):
+        with self.lock:
+            count = min(limit, len(self.items))
+            return [self.items.popleft() for _ in range(count)]
+
+    def depth(self):
+        return len(self.items)
+
+
+# Fixed-capacity ring buffer of received readings, oldest rows are overwritten
+class ReadingRingBuffer:
+    def __init__(self, capacity=SUBSCRIBER_LOG_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.kwh = array('d', bytes(8 * capacity))
+        self.topics = [None] * capacity
+        self.appliances = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, topic, appliance, kwh):
+        index = (self.start + self.size) % self.capacity
+        self.timestamps[index] = timestamp
+        self.topics[index] = sys.intern(topic)
+        self.appliances[index] = sys.intern(appliance)
+        self.kwh[index] = kwh
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def row(self, row):
+        index = (self.start + row) % self.capacity
+        return self.timestamps[index], self.topics[index], self.appliances[index], self.kwh[index]
+
+
+# Table model over the ring buffer; the view only asks for the visible rows
+class SubscriberLogModel(QAbstractTableModel):
+    HEADERS = ["Timestamp", "Topic", "Appliance", "kWh"]
+
+    def __init__(self, capacity=SUBSCRIBER_LOG_CAPACITY, parent=None):
+        super().__init__(parent)
+        self.buffer = ReadingRingBuffer(capacity)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.buffer)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        timestamp, topic, appliance, kwh = self.buffer.row(index.row())
+        column = index.column()
+        if column == 0:
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+        if column == 1:
+            return topic
+        if column == 2:
+            return appliance
+        return "" if kwh != kwh else f"{kwh:.2f}"  # NaN marks a payload without a reading
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def append_rows(self, rows):
+        capacity = self.buffer.capacity
+        rows = rows[-capacity:]
+        # Rows that fit are inserted, the rest overwrite the oldest rows in place
+        inserted = min(capacity - len(self.buffer), len(rows))
+        if inserted:
+            first = len(self.buffer)
+            self.beginInsertRows(QModelIndex(), first, first + inserted - 1)
+            for row in rows[:inserted]:
+                self.buffer.append(*row)
+            self.endInsertRows()
+        if inserted < len(rows):
+            for row in rows[inserted:]:
+                self.buffer.append(*row)
+            self.dataChanged.emit(
+                self.index(0, 0), self.index(len(self.buffer) - 1, len(self.HEADERS) - 1)
+            )
+
 
 # MQTT Client Class
 class MqttClient:
@@ -20,78 +149,104 @@ class MqttClient:
         self.subscribe_topic = ''
         self.publish_topic = ''
         self.on_connected_to_form = None
-        self.client = None
+        self.on_message_to_form = None
+        self.connection = None
+        self.subscriptions = []
+        self.command_channel = None
 
     def connect_to(self):
         try:
-            if self.client:  # Check if already connected
-                print("Already connected to broker.")
+            if self.connection:  # Check if already connected
+                log.info("Already connected to broker.")
                 return
-            # Initialize MQTT client
-            self.client = mqtt.Client(client_id=self.client_name, clean_session=True)
-            self.client.on_connect = self.on_connect
-            self.client.on_message = self.on_message
-            print(f"Connecting to broker {self.broker}:{self.port}")
-            self.client.connect(self.broker, self.port)
-            self.client.loop_start()
+            import MqttCore
+            # Share the connection with any other panel using this broker and client ID
+            log.info("Connecting to broker %s:%s", self.broker, self.port)
+            self.connection = MqttCore.acquire(
+                self.broker, self.port, self.client_name, on_connect=self.on_connect
+            )
         except Exception as e:
-            print(f"Connection failed: {e}")
+            log.error("Connection failed: %s", e)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("Connected OK")
+            log.info("Connected OK")
             if self.on_connected_to_form:
                 self.on_connected_to_form()
         else:
-            print(f"Bad connection. Returned code={rc}")
+            log.warning("Bad connection. Returned code=%s", rc)
 
     def on_message(self, client, userdata, msg):
-        payload = msg.payload.decode("utf-8", "ignore")
-        print(f"Message received: {payload}")
-        main_window.update_subscriber_data(payload)
+        reading = Codec.decode(msg.payload, msg.topic)
+        if reading is None:
+            # Not an "appliance:kWh" reading, keep the raw text
+            reading = Codec.Reading(msg.payload.decode("utf-8", "ignore"), float("nan"))
+        log.debug("Message received: %s", reading)
+        if self.on_message_to_form:
+            self.on_message_to_form(msg.topic, reading)
 
     def disconnect_from(self):
-        if self.client:
+        if self.connection:
+            import MqttCore
             try:
-                self.client.loop_stop()
-                self.client.disconnect()
-                self.client = None  # Reset the client object
-                print("Disconnected from broker.")
+                if self.command_channel:
+                    self.command_channel.close()
+                    self.command_channel = None
+                for topic in self.subscriptions:
+                    self.connection.unsubscribe(topic, self.on_message)
+                self.subscriptions = []
+                MqttCore.release(self.connection, on_connect=self.on_connect)
+                self.connection = None  # Reset the connection
+                log.info("Disconnected from broker.")
             except Exception as e:
-                print(f"Disconnection failed: {e}")
+                log.error("Disconnection failed: %s", e)
         else:
-            print("No active connection to disconnect.")
+            log.warning("No active connection to disconnect.")
 
     def subscribe_to(self, topic):
-        if self.client:
+        if self.connection:
             try:
-                self.client.subscribe(topic, qos=2)
-                print(f"Subscribed to {topic}")
+                self.connection.subscribe(topic, self.on_message, qos=2)
+                self.subscriptions.append(topic)
+                log.info("Subscribed to %s", topic)
             except Exception as e:
-                print(f"Subscription failed: {e}")
+                log.error("Subscription failed: %s", e)
         else:
-            print("Cannot subscribe. MQTT client is not initialized.")
+            log.warning("Cannot subscribe. MQTT client is not initialized.")
 
     def publish_to(self, topic, message):
-        if self.client:
+        if self.connection:
             try:
-                self.client.publish(topic, message)
-                print(f"Published to {topic}: {message}")
+                self.connection.publish(topic, message)
+                log.debug("Published to %s: %s", topic, message)
             except Exception as e:
-                print(f"Publishing failed: {e}")
+                log.error("Publishing failed: %s", e)
         else:
-            print("Cannot publish. MQTT client is not initialized.")
+            log.warning("Cannot publish. MQTT client is not initialized.")
+
+    def send_command(self, home, command, callback=None):
+        # Correlated command; callback(request_id, ok, rtt, result) gets the ack or a timeout
+        if not self.connection:
+            log.warning("Cannot send command. MQTT client is not initialized.")
+            return None
+        if not self.command_channel:
+            import Command
+            self.command_channel = Command.CommandChannel(self.connection, f"gui-{os.getpid()}")
+        request_id = self.command_channel.send(home, command, callback)
+        log.info("Sent command %s to %s: %s", request_id, home, command)
+        return request_id
 
 
 # Main GUI Window
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, history_dir=HISTORY_DIR):
         super().__init__()
         self.setWindowTitle("Smart Electric Current Reading")
         self.setGeometry(100, 100, 800, 600)
 
         # MQTT Client
         self.mqtt_client = MqttClient()
+        self.mqtt_client.on_message_to_form = self.update_subscriber_data
 
         # Broker Connection Section
         self.ip_input = QLineEdit()
@@ -108,20 +263,47 @@ class MainWindow(QMainWindow):
         self.disconnect_button = QPushButton("Disconnect")
         self.disconnect_button.clicked.connect(self.disconnect_from_broker)
 
+        # Attach to a running Daemon.py (--sink forward) instead of holding a broker connection
+        self.attach_button = QPushButton("Attach to Daemon")
+        self.attach_button.clicked.connect(self.attach_to_daemon)
+        self.daemon_socket = None  # Created on first attach
+
         # Left Side: Appliance Selection and Estimated Usage
         self.appliance_combo = QComboBox()
         self.appliance_combo.addItems(["Oven", "Kettle", "Refrigerator", "Washing Machine"])
         self.estimated_usage = QLineEdit("00.00")
         self.estimated_usage.setValidator(QDoubleValidator(0.0, 999.99, 2))  # Float/Double only
         self.estimated_usage.setMaxLength(6)
+        self.usage_stats = QLabel()  # Live totals for the selected appliance
+        self.usage_stats.setWordWrap(True)
 
         # Publish Button
         self.publish_button = QPushButton("Publish Selected Appliance")
         self.publish_button.clicked.connect(self.publish_selected_appliance)
 
+        # Payload format requested from the Publisher
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(Codec.PAYLOAD_FORMATS)
+        self.format_combo.currentTextChanged.connect(self.publish_payload_format)
+        self.command_status = QLabel()  # Ack latency of the last command
+        self.command_status.setWordWrap(True)
+        self.last_ack = None
+        self.alert_list = QListWidget()  # Newest alerts first
+        self.alert_list.setMaximumHeight(120)
+        self.alerts_shown = 0
+
         # Right Side: Subscriber Data
-        self.subscriber_topic = QLineEdit("pr/home/id3164/sts")
-        self.subscriber_data = QTextEdit()
+        self.subscriber_topic = QLineEdit(TopicRouter.status_topic())  # Wildcards such as pr/home/+/sts work too
+        self.subscriber_model = SubscriberLogModel()
+        self.subscriber_data = QTableView()
+        self.subscriber_data.setModel(self.subscriber_model)
+        self.subscriber_data.verticalHeader().setVisible(False)
+        # Fixed row heights keep scrolling O(1) regardless of the row count
+        self.subscriber_data.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.subscriber_data.verticalHeader().setDefaultSectionSize(20)
+        self.subscriber_data.horizontalHeader().setStretchLastSection(True)
+        self.ingest_stats = QLabel()
+        self.chart = Chart.ConsumptionChart()
         self.subscribe_button = QPushButton("Subscribe")
         self.subscribe_button.clicked.connect(self.subscribe_to_topic)
 
@@ -131,7 +313,13 @@ class MainWindow(QMainWindow):
         left_layout.addWidget(self.appliance_combo)
         left_layout.addWidget(QLabel("Estimated Usage (kWh):"))
         left_layout.addWidget(self.estimated_usage)
+        left_layout.addWidget(self.usage_stats)
         left_layout.addWidget(self.publish_button)
+        left_layout.addWidget(QLabel("Payload Format:"))
+        left_layout.addWidget(self.format_combo)
+        left_layout.addWidget(self.command_status)
+        left_layout.addWidget(QLabel("Alerts:"))
+        left_layout.addWidget(self.alert_list)
 
         right_layout = QVBoxLayout()
         right_layout.addWidget(QLabel("Subscriber Topic:"))
@@ -139,6 +327,9 @@ class MainWindow(QMainWindow):
         right_layout.addWidget(self.subscribe_button)
         right_layout.addWidget(QLabel("Subscriber Data:"))
         right_layout.addWidget(self.subscriber_data)
+        right_layout.addWidget(self.ingest_stats)
+        right_layout.addWidget(QLabel("Consumption (kWh):"))
+        right_layout.addWidget(self.chart)
 
         main_layout = QHBoxLayout()
         main_layout.addLayout(left_layout)
@@ -151,6 +342,7 @@ class MainWindow(QMainWindow):
         top_layout.addWidget(self.port_input)
         top_layout.addWidget(self.connect_button)
         top_layout.addWidget(self.disconnect_button)  # Add Disconnect Button
+        top_layout.addWidget(self.attach_button)
 
         container_layout = QVBoxLayout()
         container_layout.addLayout(top_layout)
@@ -160,6 +352,78 @@ class MainWindow(QMainWindow):
         container.setLayout(container_layout)
         self.setCentralWidget(container)
 
+        # Messages arrive on the paho thread; paint them in batches from the GUI thread
+        self.ingest_queue = IngestQueue()
+        self.coalesced = 0
+        Metrics.gauge("gui_ingest_queue_depth", "Readings waiting to be painted", self.ingest_queue.depth)
+        Metrics.gauge("gui_ingest_dropped", "Readings dropped from a full ingest queue", lambda: self.ingest_queue.dropped)
+        self.update_ingest_stats()
+        self.repaint_timer = QTimer(self)
+        self.repaint_timer.timeout.connect(self.flush_subscriber_data)
+        self.repaint_timer.start(1000 // MAX_FPS)
+
+        # History, aggregation and alerts load NumPy and start threads; they are opened once
+        # the window has painted. Readings that arrive earlier are shown but not aggregated.
+        self.history_dir = history_dir
+        self.services_started = False
+        self.aggregator = None
+        self.store = None
+        self.compactor = None
+        self.alerts = None
+        self.usage_timer = QTimer(self)
+        self.usage_timer.timeout.connect(self.update_usage_stats)
+        self.usage_timer.timeout.connect(self.update_command_status)
+        self.usage_timer.timeout.connect(self.update_alerts)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.services_started:
+            self.services_started = True
+            QTimer.singleShot(0, self.start_services)
+
+    def start_services(self):
+        import Aggregator
+        import Alerts
+        import Compaction
+        import Storage
+        # Readings are kept on disk; reload the latest ones instead of replaying the broker
+        self.aggregator = Aggregator.RollingAggregator()
+        if self.history_dir:
+            try:
+                self.store = Storage.TimeSeriesStore(self.history_dir)
+            except Storage.HistoryLocked as e:
+                # The daemon (--sink storage) owns it and does the writing and compaction
+                log.warning("%s, reading history only", e)
+                self.store = Storage.TimeSeriesStore(self.history_dir, read_only=True)
+        if self.store:
+            self.load_history()
+            self.aggregator.backfill_from_store(self.store)
+            if not self.store.read_only:
+                # Rolls old readings into minute/hour/day tiers so the history stays bounded
+                self.compactor = Compaction.Compactor(self.store)
+        self.update_usage_stats()
+        # Rules run on the alert engine's thread, the network thread only queues readings
+        self.alerts = Alerts.AlertEngine(on_alert=self.publish_alert)
+        self.usage_timer.start(500)
+        self.appliance_combo.currentTextChanged.connect(self.update_usage_stats)
+
+    def load_history(self):
+        import Storage
+        rows = [
+            (timestamp, TopicRouter.status_topic(home) if home != Storage.UNKNOWN_HOME else "", appliance, kwh)
+            for timestamp, home, appliance, kwh in self.store.tail(self.subscriber_model.buffer.capacity)
+        ]
+        self.subscriber_model.append_rows(rows)
+        self.subscriber_data.scrollToBottom()
+        self.chart.add_points([(timestamp, appliance, kwh) for timestamp, _, appliance, kwh in rows])
+        self.update_ingest_stats()
+
+    def close_history(self):
+        if self.compactor:
+            self.compactor.stop()
+        if self.store:
+            self.store.close()
+
     def connect_to_broker(self):
         # Validate inputs
         broker_ip = self.ip_input.text().strip()
@@ -176,17 +440,118 @@ class MainWindow(QMainWindow):
     def disconnect_from_broker(self):
         self.mqtt_client.disconnect_from()
 
+    def attach_to_daemon(self):
+        from PyQt5.QtNetwork import QTcpSocket
+        import Daemon
+        if self.daemon_socket is None:
+            self.daemon_socket = QTcpSocket(self)
+            self.daemon_socket.readyRead.connect(self.read_daemon_data)
+            self.daemon_socket.stateChanged.connect(self.on_daemon_state_changed)
+        if self.daemon_socket.state() != QTcpSocket.UnconnectedState:
+            self.daemon_socket.disconnectFromHost()
+            return
+        self.daemon_socket.connectToHost("127.0.0.1", Daemon.DAEMON_PORT)
+
+    def on_daemon_state_changed(self, state):
+        from PyQt5.QtNetwork import QTcpSocket
+        attached = state == QTcpSocket.ConnectedState
+        self.attach_button.setText("Detach from Daemon" if attached else "Attach to Daemon")
+
+    def read_daemon_data(self):
+        while self.daemon_socket.canReadLine():
+            line = bytes(self.daemon_socket.readLine()).decode("utf-8", "ignore").rstrip("\n")
+            try:
+                timestamp, topic, appliance, kwh = line.split("\t")
+                reading = Codec.Reading(appliance, float(kwh), float(timestamp), Codec.home_from_topic(topic))
+            except ValueError:
+                continue
+            self.update_subscriber_data(topic, reading)
+
     def subscribe_to_topic(self):
         topic = self.subscriber_topic.text().strip()
         if not topic:
             QMessageBox.warning(self, "Error", "Subscriber Topic cannot be empty!")
             return
+        error = TopicRouter.validate_filter(topic)
+        if error:
+            QMessageBox.warning(self, "Error", f"Invalid Subscriber Topic: {error}")
+            return
 
         # Subscribe to the topic
         self.mqtt_client.subscribe_to(topic)
 
-    def update_subscriber_data(self, message):
-        self.subscriber_data.append(message)
+    def update_subscriber_data(self, topic, reading):
+        # Called from the paho network thread, so only queue the reading here
+        received = time.time()
+        aggregator, store, alerts = self.aggregator, self.store, self.alerts  # None until start_services
+        if reading.kwh == reading.kwh:  # Skip NaN, not a reading
+            timestamp = reading.timestamp or received
+            if aggregator:
+                aggregator.update(timestamp, reading.home, reading.appliance, reading.kwh)
+            # A read-only store means the daemon owns the history (--sink storage) and writes it
+            if store and not store.read_only:
+                store.append(timestamp, reading.home, reading.appliance, reading.kwh)
+            if alerts:
+                alerts.submit(timestamp, reading.home, reading.appliance, reading.kwh)
+        self.ingest_queue.put((received, topic, reading))
+
+    def flush_subscriber_data(self):
+        batch = self.ingest_queue.drain(INGEST_BATCH_SIZE)
+        if batch:
+            rows = [
+                (reading.timestamp or received, topic, reading.appliance, reading.kwh)
+                for received, topic, reading in batch
+            ]
+            scrollbar = self.subscriber_data.verticalScrollBar()
+            follow = scrollbar.value() == scrollbar.maximum()
+            # One model update (and one repaint) per frame, however many messages arrived
+            self.subscriber_model.append_rows(rows)
+            if follow:
+                self.subscriber_data.scrollToBottom()
+            self.chart.add_points([(timestamp, appliance, kwh) for timestamp, _, appliance, kwh in rows])
+            self.coalesced += len(batch) - 1
+        self.update_ingest_stats()
+
+    def update_ingest_stats(self):
+        text = (
+            f"Rows: {len(self.subscriber_model.buffer)}/{self.subscriber_model.buffer.capacity} | "
+            f"Queue: {self.ingest_queue.depth()} | "
+            f"Dropped: {self.ingest_queue.dropped} | "
+            f"Coalesced: {self.coalesced}"
+        )
+        connection = self.mqtt_client.connection
+        if connection:
+            stats = connection.stats()
+            text += f" | Outbox: {stats['backlog']} | Flushed: {stats['flushed']} ({stats['flush_rate']:.0f}/s)"
+        self.ingest_stats.setText(text)
+
+    def update_usage_stats(self):
+        appliance = self.appliance_combo.currentText().lower()
+        summary = self.aggregator.appliance_summary(appliance)
+        if not summary:
+            self.usage_stats.setText("No readings yet")
+            return
+        self.usage_stats.setText(
+            f"Total: {summary['sum']:.2f} kWh ({summary['count']} readings)\n"
+            f"Mean: {summary['mean']:.2f} | Min: {summary['min']:.2f} | Max: {summary['max']:.2f} | "
+            f"EWMA: {summary['ewma']:.2f}\n"
+            f"Last 1m: {summary['1m']:.2f} | 15m: {summary['15m']:.2f} | 1h: {summary['1h']:.2f} kWh"
+        )
+
+    def publish_alert(self, alert):
+        # Called from the alert engine's thread
+        connection = self.mqtt_client.connection
+        if connection and connection.is_connected():
+            connection.publish(TopicRouter.alert_topic(alert.home or TopicRouter.DEFAULT_HOME), alert.to_json(), qos=1)
+
+    def update_alerts(self):
+        fired = self.alerts.fired.value
+        if fired == self.alerts_shown:
+            return
+        self.alerts_shown = fired
+        self.alert_list.clear()
+        for alert in self.alerts.recent_alerts():
+            self.alert_list.addItem(f"{time.strftime('%H:%M:%S', time.localtime(alert.timestamp))} {alert}")
 
     def publish_selected_appliance(self):
         selected_appliance = self.appliance_combo.currentText().lower()  # Get selected appliance
@@ -194,21 +559,53 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Error", "No appliance selected!")
             return
 
-        # Publish the selected appliance to the Publisher
-        command_topic = "pr/home/id3164/cmd"
-        self.mqtt_client.publish_to(command_topic, selected_appliance)
+        # Publish the selected appliance to the Publisher, which acknowledges it
+        self.mqtt_client.send_command(self.command_home(), selected_appliance, self.on_command_ack)
+
+    def publish_payload_format(self, payload_format):
+        # Ask the Publisher to switch formats; decoding accepts both either way
+        self.mqtt_client.send_command(self.command_home(), Codec.format_command(payload_format), self.on_command_ack)
+
+    def command_home(self):
+        # Commands go to the subscribed home, or the default home for wildcard subscriptions
+        home = Codec.home_from_topic(self.subscriber_topic.text().strip())
+        if not home or home in ("+", "#"):
+            home = TopicRouter.DEFAULT_HOME
+        return home
+
+    def on_command_ack(self, request_id, ok, rtt, result):
+        # Called from the paho network thread; the usage timer shows it
+        self.last_ack = (request_id, ok, rtt, result)
+
+    def update_command_status(self):
+        channel = self.mqtt_client.command_channel
+        if not self.last_ack or not channel:
+            return
+        request_id, ok, rtt, result = self.last_ack
+        stats = channel.stats()
+        if rtt is None:
+            text = f"Command {request_id} timed out"
+        else:
+            text = f"Command {request_id} {'acknowledged' if ok else 'rejected'} in {rtt * 1000:.1f} ms: {result}"
+        self.command_status.setText(
+            f"{text}\nAcked: {stats['acked']} | Timeouts: {stats['timeouts']} | "
+            f"RTT p50: {stats['rtt_ms_p50']:.1f} ms | p99: {stats['rtt_ms_p99']:.1f} ms"
+        )
 
 
 # Run Application
 if __name__ == "__main__":
+    Metrics.setup_logging()
+    Metrics.start()  # Only when IOT_METRICS_PORT or IOT_METRICS_FILE is set
     app = QApplication(sys.argv)
     main_window = MainWindow()
     main_window.show()
 
     # Ensure clean disconnection
     def clean_disconnect():
-        if main_window.mqtt_client.client:
+        if main_window.mqtt_client.connection:
             main_window.mqtt_client.disconnect_from()
 
     app.aboutToQuit.connect(clean_disconnect)  # Call disconnect safely
+    app.aboutToQuit.connect(main_window.close_history)  # Flush pending readings to disk
     sys.exit(app.exec_())
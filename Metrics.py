@@ -0,0 +1,221 @@
+# IoT Project
+# Metrics
+
+# metrics.py
+# Process-wide counters, gauges and log-bucket latency histograms for the MQTT hot paths.
+# Recording is a lock and an add; nothing is formatted until the metrics are read, either
+# from a local Prometheus-style endpoint (http://127.0.0.1:<port>/metrics) or from a text
+# snapshot rewritten every SNAPSHOT_INTERVAL seconds. Also sets up level-gated logging.
+import atexit
+import logging
+import math
+import os
+import threading
+
+METRICS_PORT = int(os.environ.get("IOT_METRICS_PORT", "0")) or None  # Endpoint port, None disables it
+METRICS_FILE = os.environ.get("IOT_METRICS_FILE") or None  # Snapshot path, None disables it
+SNAPSHOT_INTERVAL = 10.0  # Seconds between snapshot rewrites
+LOG_LEVEL = os.environ.get("IOT_LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Histogram buckets are powers of two seconds, from about 1 us to 64 s
+MIN_EXPONENT = -20
+MAX_EXPONENT = 6
+BUCKET_BOUNDS = [2.0 ** exponent for exponent in range(MIN_EXPONENT, MAX_EXPONENT + 1)]
+
+_families = {}  # name -> (kind, help, {label items: metric})
+_families_lock = threading.Lock()
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Gauge:
+    # Either set() by the owner, or computed by fn() when the metrics are read
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.fn() if self.fn else self.value)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        # frexp gives the power-of-two bucket directly, no search over the bounds
+        exponent = math.frexp(value)[1] if value > 0 else MIN_EXPONENT
+        index = min(max(exponent - MIN_EXPONENT, 0), len(BUCKET_BOUNDS))
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def percentile(self, point):
+        # Upper bound of the bucket holding the given percentile
+        with self.lock:
+            counts = list(self.counts)
+        target = sum(counts) * point / 100
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if count and seen >= target:
+                return BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else math.inf
+        return 0.0
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS + [math.inf], counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(bound)
+            samples.append((f"{name}_bucket", labels + (("le", le),), cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+def _metric(kind, cls, name, help, labels, *args):
+    key = tuple(sorted(labels.items()))
+    with _families_lock:
+        family = _families.get(name)
+        if family is None:
+            family = _families[name] = (kind, help, {})
+        elif family[0] != kind:
+            raise ValueError(f"{name} is already registered as a {family[0]}")
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = cls(*args)
+    return metric
+
+
+def counter(name, help="", **labels):
+    return _metric("counter", Counter, name, help, labels)
+
+
+def gauge(name, help="", fn=None, **labels):
+    metric = _metric("gauge", Gauge, name, help, labels, fn)
+    if fn:
+        metric.fn = fn  # A re-registered gauge reads from its latest owner
+    return metric
+
+
+def histogram(name, help="", **labels):
+    return _metric("histogram", Histogram, name, help, labels)
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    # Nearest-rank percentiles of raw samples: {point: value}, zeros when there are none
+    ordered = sorted(samples)
+    if not ordered:
+        return {point: 0.0 for point in points}
+    return {point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points}
+
+
+def render():
+    # Prometheus text exposition format
+    with _families_lock:
+        families = [(name, kind, help, list(metrics.items())) for name, (kind, help, metrics) in sorted(_families.items())]
+    lines = []
+    for name, kind, help, metrics in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, metric in metrics:
+            for sample, sample_labels, value in metric.samples(name, labels):
+                if sample_labels:
+                    label_text = ",".join(f'{key}="{label}"' for key, label in sample_labels)
+                    sample = f"{sample}{{{label_text}}}"
+                lines.append(f"{sample} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port=METRICS_PORT):
+    # Local-only endpoint, served from a background thread. http.server is imported here,
+    # since most runs never enable the endpoint and it is slow to import.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are not worth a log line each
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.getLogger(__name__).info("Serving metrics on http://127.0.0.1:%d/metrics", server.server_address[1])
+    return server
+
+
+def write_snapshot(path=METRICS_FILE):
+    # Written to a temporary file first so readers never see half a snapshot
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write(render())
+    os.replace(temporary, path)
+
+
+def snapshot_periodically(path=METRICS_FILE, interval=SNAPSHOT_INTERVAL):
+    stopped = threading.Event()
+
+    def loop():
+        while not stopped.wait(interval):
+            write_snapshot(path)
+        write_snapshot(path)
+
+    threading.Thread(target=loop, name="metrics-snapshot", daemon=True).start()
+    atexit.register(write_snapshot, path)  # Keep the final counts on a normal exit
+    return stopped  # set() it to write a last snapshot and stop
+
+
+def start(port=METRICS_PORT, path=METRICS_FILE, interval=SNAPSHOT_INTERVAL):
+    # Starts whichever exporters are configured
+    if port:
+        serve(port)
+    if path:
+        snapshot_periodically(path, interval)
+
+
+def setup_logging(level=LOG_LEVEL):
+    # Per-message logging is at DEBUG, so the default INFO level keeps it off the hot path
+    logging.basicConfig(level=level.upper() if isinstance(level, str) else level, format=LOG_FORMAT)
+
+
+def add_arguments(parser):
+    # Shared command-line options of the headless tools
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="DEBUG shows every message, INFO by default")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve metrics on this local port")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="rewrite a metrics snapshot to this file")
+
+
+def configure(args):
+    setup_logging(args.log_level)
+    start(args.metrics_port, args.metrics_file)
@@ -0,0 +1,443 @@
+# IoT Project
+# Shared MQTT Client Core
+
+# mqtt_core.py
+# One paho client and one network thread per (broker, port, client ID), shared by every
+# panel in the process. Topic subscriptions are multiplexed to registered handlers.
+# The network thread reconnects with jittered exponential backoff, and publishes made
+# while offline wait in a bounded (optionally disk-backed) outbox until the next connect.
+# CONNECTION_FACTORY lets another transport, such as FleetSim's in-process broker, stand in.
+import itertools
+import logging
+import os
+import random
+import struct
+import threading
+import time
+from collections import deque
+import paho.mqtt.client as mqtt
+import Metrics
+import TopicRouter
+
+log = logging.getLogger(__name__)
+
+# Reconnect settings
+RECONNECT_MIN_DELAY = 0.5  # Seconds before the first retry
+RECONNECT_MAX_DELAY = 30.0  # Backoff cap
+LOOP_TIMEOUT = 1.0  # Seconds the network thread blocks waiting for traffic
+
+# Offline publish queue settings
+OUTBOX_SIZE = 10000  # Oldest queued publishes are dropped beyond this
+OUTBOX_DIR = None  # Directory for disk-backed outboxes, None keeps them in memory
+OUTBOX_RECORD = struct.Struct("<HIBB")  # topic length, payload length, qos, retain
+
+# Connections acquire() opens: factory(broker, port, client_id, clean_session), None for SharedConnection
+CONNECTION_FACTORY = None
+
+# Open connections by (broker, port, client ID)
+_connections = {}
+_connections_lock = threading.Lock()
+
+# Hot-path metrics, shared by every connection in the process
+_received = Metrics.counter("mqtt_messages_received_total", "Messages delivered by the broker")
+_published = Metrics.counter("mqtt_messages_published_total", "Messages handed to paho")
+_queued = Metrics.counter("mqtt_messages_queued_total", "Messages put in the outbox while offline")
+_connects = Metrics.counter("mqtt_connects_total", "Completed connections")
+_disconnects = Metrics.counter("mqtt_disconnects_total", "Dropped or closed connections")
+_publish_seconds = Metrics.histogram("mqtt_publish_seconds", "Time spent in publish calls")
+_message_seconds = Metrics.histogram("mqtt_callback_seconds", "Time spent in MQTT callbacks", callback="on_message")
+_connect_seconds = Metrics.histogram("mqtt_callback_seconds", "Time spent in MQTT callbacks", callback="on_connect")
+_publish_callback_seconds = Metrics.histogram(
+    "mqtt_callback_seconds", "Time spent in MQTT callbacks", callback="on_publish"
+)
+
+
+# Bounded FIFO of publishes made while offline.
+# The file holds the queue followed by records appended since; it is rewritten from the queue
+# once it reaches twice maxsize records and after a flush, so it stays bounded too.
+class Outbox:
+    def __init__(self, maxsize=OUTBOX_SIZE, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.items = deque()
+        self.pending = []  # Drained but not yet committed, still in the file
+        self.dropped = 0
+        self.file = None
+        self.records = 0  # Records in the file
+        if path:
+            self.load()
+            self.rewrite()  # Also cuts off a torn last record before anything is appended
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self):
+        # Recover publishes queued before a restart
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        items = deque(maxlen=self.maxsize)  # Drops were counted by the process that made them
+        while offset + OUTBOX_RECORD.size <= len(data):
+            topic_length, payload_length, qos, retain = OUTBOX_RECORD.unpack_from(data, offset)
+            offset += OUTBOX_RECORD.size
+            end = offset + topic_length + payload_length
+            if end > len(data):
+                break  # Torn last record
+            topic = data[offset:offset + topic_length].decode("utf-8")
+            items.append((topic, data[offset + topic_length:end], qos, bool(retain)))
+            offset = end
+        self.items.extend(items)
+
+    def rewrite(self):
+        # Replace the file with the uncommitted and queued items, atomically
+        if self.file:
+            self.file.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for topic, payload, qos, retain in itertools.chain(self.pending, self.items):
+                f.write(self.encode(topic, payload, qos, retain))
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "ab")
+        self.records = len(self.pending) + len(self.items)
+
+    @staticmethod
+    def encode(topic, payload, qos, retain):
+        topic_bytes = topic.encode("utf-8")
+        return OUTBOX_RECORD.pack(len(topic_bytes), len(payload), qos, retain) + topic_bytes + payload
+
+    def put(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        if len(self.items) >= self.maxsize:
+            self.items.popleft()
+            self.dropped += 1
+        self.items.append((topic, payload, qos, retain))
+        if self.file:
+            if self.records >= len(self.pending) + 2 * self.maxsize:
+                self.rewrite()  # Already holds the new item
+            else:
+                self.file.write(self.encode(topic, payload, qos, retain))
+                self.file.flush()
+                self.records += 1
+
+    def drain(self):
+        # The file keeps the drained items until commit(), so a crash mid-flush loses nothing
+        items = list(self.items)
+        self.items.clear()
+        self.pending.extend(items)
+        return items
+
+    def commit(self):
+        # Everything drained so far has been published
+        self.pending = []
+        if self.file:
+            self.rewrite()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+# Subclasses can replace create_client() and start() to run over another transport
+class SharedConnection:
+    def __init__(self, broker, port, client_id, clean_session=True, rng=None):
+        self.key = (broker, int(port), client_id)
+        self.broker = broker
+        self.port = int(port)
+        self.client_id = client_id
+        self.refcount = 0
+        self.connected = False
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.lock = threading.RLock()
+        self.router = TopicRouter.TopicRouter()  # Topic filter -> handler(client, userdata, msg)
+        self.qos = {}  # Topic filter -> highest requested QoS
+        self.listeners = []  # (on_connect, on_disconnect, on_log, on_publish)
+
+        outbox_path = None
+        if OUTBOX_DIR:
+            os.makedirs(OUTBOX_DIR, exist_ok=True)
+            safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in client_id)
+            outbox_path = os.path.join(OUTBOX_DIR, f"{broker}_{self.port}_{safe_id}.outbox")
+        self.outbox = Outbox(path=outbox_path)
+        self.connects = 0
+        self.failed_attempts = 0
+        self.flushed = 0
+        self.last_flush_rate = 0.0  # msgs/sec of the last outbox flush
+        self.delay = RECONNECT_MIN_DELAY  # Current reconnect backoff
+        self.random = rng or random.Random()  # Backoff jitter
+        self.socket_open = False
+        self.unacked = deque()  # MQTTMessageInfo of QoS 1/2 publishes, oldest first
+
+        self.client = self.create_client(client_id, clean_session)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+
+    def create_client(self, client_id, clean_session):
+        return mqtt.Client(client_id=client_id, clean_session=clean_session)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"mqtt-{self.client_id}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        try:
+            self.client.disconnect()
+        except Exception as e:
+            log.warning("Disconnection failed: %s", e)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(LOOP_TIMEOUT * 2)
+        self.outbox.close()
+
+    def run(self):
+        # Network thread
+        while self.running:
+            try:
+                wait = self.step()
+            except Exception:
+                # paho re-raises callback exceptions; the thread must outlive them
+                log.exception("Network loop error")
+                wait = LOOP_TIMEOUT
+            if wait:
+                self.wakeup.wait(wait)
+
+    def step(self):
+        # Connects, or services the socket for up to LOOP_TIMEOUT.
+        # Returns the seconds to back off after a failed attempt, otherwise 0.
+        if not self.socket_open:
+            try:
+                self.client.connect(self.broker, self.port)
+                self.socket_open = True
+            except Exception as e:
+                return self.backoff(e)
+        # paho reports a drop to on_disconnect from inside loop(), so look before calling it
+        was_connected = self.connected
+        rc = self.client.loop(timeout=LOOP_TIMEOUT)
+        if rc != mqtt.MQTT_ERR_SUCCESS and self.running:
+            self.socket_open = False
+            if was_connected:
+                self.on_disconnect(self.client, None, rc)
+            else:
+                # A refused CONNACK, or the socket closed before one, is a failed attempt too
+                return self.backoff(mqtt.error_string(rc))
+        return 0
+
+    def backoff(self, reason):
+        # Jittered exponential backoff; only an accepted CONNACK resets it (in on_connect)
+        self.failed_attempts += 1
+        wait = self.delay / 2 + self.random.uniform(0, self.delay / 2)
+        log.warning("Connection failed: %s. Retrying in %.1fs", reason, wait)
+        self.delay = min(self.delay * 2, RECONNECT_MAX_DELAY)
+        return wait
+
+    def is_connected(self):
+        return self.connected
+
+    def in_flight(self):
+        # QoS 1/2 messages paho is still waiting to have acknowledged
+        return sum(1 for info in list(self.unacked) if not info.is_published())
+
+    def track(self, info, qos):
+        # Remembers a QoS 1/2 publish for in_flight(), forgetting the acknowledged oldest ones
+        with self.lock:
+            if qos and info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.unacked.append(info)
+            while self.unacked and self.unacked[0].is_published():
+                self.unacked.popleft()
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "backlog": len(self.outbox),
+            "dropped": self.outbox.dropped,
+            "flushed": self.flushed,
+            "flush_rate": self.last_flush_rate,
+            "connects": self.connects,
+            "failed_attempts": self.failed_attempts,
+        }
+
+    def add_listener(self, on_connect=None, on_disconnect=None, on_log=None, on_publish=None):
+        with self.lock:
+            self.listeners.append((on_connect, on_disconnect, on_log, on_publish))
+            connected = self.connected
+        # Only pay for log and publish callbacks when someone asks for them.
+        # paho's callback setters take its callback lock, so never set them under self.lock.
+        if on_log:
+            self.client.on_log = self.on_log
+        if on_publish:
+            self.client.on_publish = self.on_publish
+        # A listener joining an open connection is told about it straight away
+        if connected and on_connect:
+            on_connect(self.client, None, {}, 0)
+
+    def remove_listener(self, on_connect=None, on_disconnect=None, on_log=None, on_publish=None):
+        with self.lock:
+            self.listeners = [
+                listener for listener in self.listeners
+                if listener != (on_connect, on_disconnect, on_log, on_publish)
+            ]
+            wants_log = any(listener[2] for listener in self.listeners)
+            wants_publish = any(listener[3] for listener in self.listeners)
+        if not wants_log:
+            self.client.on_log = None
+        if not wants_publish:
+            self.client.on_publish = None
+
+    def subscribe(self, topic, handler, qos=0):
+        # The broker is sent `topic` as is, messages arrive on topics matching its route_filter
+        with self.lock:
+            self.router.add(TopicRouter.route_filter(topic), handler)
+            changed = topic not in self.qos or qos > self.qos[topic]
+            self.qos[topic] = max(qos, self.qos.get(topic, 0))
+            connected = self.connected
+        # Topics subscribed while offline are sent from on_connect
+        if changed and connected:
+            self.client.subscribe(topic, qos=self.qos[topic])
+
+    def unsubscribe(self, topic, handler):
+        with self.lock:
+            if not self.router.remove(TopicRouter.route_filter(topic), handler):
+                return  # Other handlers still use this filter
+            self.qos.pop(topic, None)
+            connected = self.connected
+        if connected:
+            self.client.unsubscribe(topic)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        # Returns paho's MQTTMessageInfo, or None when the message went to the outbox.
+        # Never call into paho while holding self.lock, its callbacks take the lock too.
+        with self.lock:
+            queued = not self.connected
+            if queued:
+                self.outbox.put(topic, payload, qos, retain)
+        if queued:
+            _queued.inc()
+            return None
+        start = time.perf_counter()
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        _publish_seconds.observe(time.perf_counter() - start)
+        _published.inc()
+        self.track(info, qos)
+        return info
+
+    def flush_outbox(self, client):
+        # Publish the backlog in order; anything queued meanwhile is picked up by the next pass
+        start = time.perf_counter()
+        count = 0
+        while True:
+            with self.lock:
+                batch = self.outbox.drain()
+                if not batch:
+                    if count:
+                        self.outbox.commit()
+                    self.connected = True
+                    break
+            for topic, payload, qos, retain in batch:
+                self.track(client.publish(topic, payload, qos=qos, retain=retain), qos)
+            count += len(batch)
+        if count:
+            elapsed = time.perf_counter() - start
+            self.flushed += count
+            self.last_flush_rate = count / elapsed if elapsed > 0 else float(count)
+            log.info("Flushed %d queued messages (%.0f msgs/sec)", count, self.last_flush_rate)
+
+    def on_connect(self, client, userdata, flags, rc):
+        start = time.perf_counter()
+        with self.lock:
+            listeners = list(self.listeners)
+            subscriptions = list(self.qos.items())
+        if rc == 0:
+            self.connects += 1
+            self.delay = RECONNECT_MIN_DELAY
+            if subscriptions:
+                client.subscribe(subscriptions)
+            self.flush_outbox(client)
+        for on_connect, _, _, _ in listeners:
+            if on_connect:
+                on_connect(client, userdata, flags, rc)
+        if rc == 0:
+            _connects.inc()
+        _connect_seconds.observe(time.perf_counter() - start)
+
+    def on_disconnect(self, client, userdata, rc):
+        with self.lock:
+            was_connected = self.connected
+            self.connected = False
+            listeners = list(self.listeners)
+        if not was_connected:
+            return  # paho and the network thread can both report the same drop
+        _disconnects.inc()
+        for _, on_disconnect, _, _ in listeners:
+            if on_disconnect:
+                on_disconnect(client, userdata, rc)
+
+    def on_log(self, client, userdata, level, buf):
+        for _, _, on_log, _ in list(self.listeners):
+            if on_log:
+                on_log(client, userdata, level, buf)
+
+    def on_publish(self, client, userdata, mid):
+        start = time.perf_counter()
+        for _, _, _, on_publish in list(self.listeners):
+            if on_publish:
+                on_publish(client, userdata, mid)
+        _publish_callback_seconds.observe(time.perf_counter() - start)
+
+    def on_message(self, client, userdata, msg):
+        start = time.perf_counter()
+        # A failing handler is logged, the others and the network thread carry on
+        for handler in self.router.match(msg.topic):
+            try:
+                handler(client, userdata, msg)
+            except Exception:
+                log.exception("Handler for %s failed", msg.topic)
+        _message_seconds.observe(time.perf_counter() - start)
+        _received.inc()
+
+
+def acquire(broker, port, client_id, clean_session=True,
+            on_connect=None, on_disconnect=None, on_log=None, on_publish=None):
+    # Returns the shared connection for this broker and client ID, opening it on first use
+    key = (broker, int(port), client_id)
+    with _connections_lock:
+        connection = _connections.get(key)
+        created = connection is None
+        if created:
+            connection = (CONNECTION_FACTORY or SharedConnection)(broker, port, client_id, clean_session)
+            _connections[key] = connection
+        connection.refcount += 1
+    connection.add_listener(on_connect, on_disconnect, on_log, on_publish)
+    if created:
+        connection.start()
+    return connection
+
+
+def release(connection, on_connect=None, on_disconnect=None, on_log=None, on_publish=None):
+    # Drops one reference, the last one closes the connection and stops its network thread
+    connection.remove_listener(on_connect, on_disconnect, on_log, on_publish)
+    with _connections_lock:
+        connection.refcount -= 1
+        last = connection.refcount <= 0
+        if last:
+            _connections.pop(connection.key, None)
+    if last:
+        connection.stop()
+
+
+def connections():
+    with _connections_lock:
+        return list(_connections.values())
+
+
+# Depths are only computed when the metrics are read
+Metrics.gauge("mqtt_outbox_depth", "Messages waiting in outboxes", lambda: sum(len(c.outbox) for c in connections()))
+Metrics.gauge("mqtt_inflight_messages", "Unacknowledged QoS 1/2 publishes", lambda: sum(c.in_flight() for c in connections()))
+Metrics.gauge("mqtt_connections", "Open shared connections", lambda: len(connections()))
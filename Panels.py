@@ -0,0 +1,33 @@
+# IoT Project
+# All Panels
+
+# panels.py
+# Runs the subscriber GUI, the Connect button and the Relay button in one process.
+# With the same broker and client ID they share one MQTT connection and network thread.
+import sys
+from PyQt5.QtWidgets import QApplication
+import Connect
+import IoT_Project
+import Metrics
+import Relay
+
+if __name__ == "__main__":
+    Metrics.setup_logging()
+    Metrics.start()  # Only when IOT_METRICS_PORT or IOT_METRICS_FILE is set
+    app = QApplication(sys.argv)
+
+    main_window = IoT_Project.MainWindow()
+    main_window.mqtt_client.client_name = Connect.DEFAULT_CLIENT_ID
+    connect_window = Connect.MainWindow()
+    relay_window = Relay.MainWindow()
+    connect_window.move(920, 100)
+    relay_window.move(920, 360)
+    for window in (main_window, connect_window, relay_window):
+        window.show()
+
+    # Ensure clean disconnection
+    app.aboutToQuit.connect(main_window.mqtt_client.disconnect_from)
+    app.aboutToQuit.connect(connect_window.mc.disconnect_from)
+    app.aboutToQuit.connect(relay_window.mc.disconnect_from)
+    app.aboutToQuit.connect(main_window.close_history)
+    sys.exit(app.exec_())
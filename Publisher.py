@@ -1,79 +1,392 @@
 # IoT Project
 # Publisher
 
+import argparse
+import asyncio
+import logging
 import paho.mqtt.client as mqtt
 import random
+import threading
 import time
+import Codec
+import Command
+import Metrics
+import MqttCore
+import Scheduler
+import TopicRouter
+
+log = logging.getLogger(__name__)
 
 # Broker settings
 broker = "127.0.0.1"
 port = 1884
-topic = "pr/home/id3164/sts"
-command_topic = "pr/home/id3164/cmd"
+topic = TopicRouter.status_topic()
+command_topic = TopicRouter.command_topic()
+
+PUBLISH_PERIOD = 5.0  # Seconds between readings of the selected appliance
+LAG_REPORT_INTERVAL = 60  # Seconds between schedule lag reports
+OFFLINE_WARNING_INTERVAL = 10  # Seconds between warnings about readings queued while offline
+
+# Report-by-exception settings
+HEARTBEAT_INTERVAL = 60.0  # Seconds after which an unchanged reading is published anyway
+CHANGE_QOS = 2  # Readings that moved past the deadband are always sent exactly once
+TELEMETRY_QOS = 2  # Heartbeats, and every reading when report-by-exception is off
 
-# Creating a unique Client ID
-client_id = f"Publisher-{random.randint(1000, 9999)}"
+# Load generator settings
+LOAD_REPORT_INTERVAL = 5  # Seconds between load reports
 
-# Initialize MQTT client with the latest callback API version
-client = mqtt.Client(client_id=client_id, clean_session=False)
+# Global variable to store the selected appliance
+selected_appliance = None
+# Payload format requested by the subscribers
+payload_format = Codec.TEXT_FORMAT
 
 # Define callback functions
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print("Connected successfully to broker")
-        client.subscribe(command_topic)  # Subscribe to command topic
+        log.info("Connected successfully to broker")
     else:
-        print(f"Failed to connect, return code {rc}")
+        log.warning("Failed to connect, return code %s", rc)
 
 def on_disconnect(client, userdata, rc):
-    print(f"Disconnected from broker, result code {rc}")
+    log.info("Disconnected from broker, result code %s", rc)
 
 def on_publish(client, userdata, mid):
-    print(f"Message published with MID {mid}")
+    log.debug("Message published with MID %s", mid)
 
 def on_message(client, userdata, msg):
-    global selected_appliance
-    payload = msg.payload.decode("utf-8")
-    print(f"Command received: {payload}")
-    selected_appliance = payload.lower()  # Update the selected appliance
-
-# Assign callbacks
-client.on_connect = on_connect
-client.on_disconnect = on_disconnect
-client.on_publish = on_publish
-client.on_message = on_message
-
-# Connect to the broker
-try:
-    print(f"Connecting to broker {broker}:{port}")
-    client.connect(broker, port)
-except Exception as e:
-    print(f"Connection failed: {e}")
-    exit(1)
-
-# Start the loop
-client.loop_start()
+    global selected_appliance, payload_format
+    request_id, command, reply_to = Command.parse_request(msg.payload)
+    log.info("Command received: %s", command)
+    requested_format = Codec.parse_format_command(command)
+    if requested_format:
+        payload_format = requested_format  # Switch the payload format
+        result = f"format {payload_format}"
+    else:
+        selected_appliance = command.lower()  # Update the selected appliance
+        result = f"publishing {selected_appliance}"
+    # Correlated commands are acknowledged so the sender can time the round trip
+    if request_id is not None and reply_to:
+        client.publish(reply_to, Command.make_response(request_id, True, result), qos=1)
 
-# Global variable to store the selected appliance
-selected_appliance = None
+def create_client(client_id):
+    # Initialize MQTT client with the latest callback API version
+    client = mqtt.Client(client_id=client_id, clean_session=False)
+
+    # Assign callbacks
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_publish = on_publish
+    client.on_message = on_message
+    return client
+
+# Drops readings that stay within a per-appliance deadband of the last one sent
+class ReportByException:
+    def __init__(self, deadband=0.0, deadbands=None, heartbeat=HEARTBEAT_INTERVAL):
+        self.deadband = deadband  # kWh
+        self.deadbands = dict(deadbands or {})  # appliance -> kWh, overrides the default
+        self.heartbeat = heartbeat  # Seconds, 0 never republishes an unchanged reading
+        self.last = {}  # appliance -> (kWh, time sent)
+        self.changes = 0
+        self.heartbeats = 0
+        self.suppressed = 0
+        self.changes_total = Metrics.counter("publisher_readings_sent_total", "Readings published", reason="change")
+        self.heartbeats_total = Metrics.counter("publisher_readings_sent_total", "Readings published", reason="heartbeat")
+        self.suppressed_total = Metrics.counter("publisher_readings_suppressed_total", "Readings inside the deadband")
+
+    def check(self, appliance, kwh, now):
+        # Returns "change", "heartbeat", or None when the reading should not be published
+        last = self.last.get(appliance)
+        if last is None or abs(kwh - last[0]) > self.deadbands.get(appliance, self.deadband):
+            self.changes += 1
+            self.changes_total.inc()
+            reason = "change"
+        elif self.heartbeat and now - last[1] >= self.heartbeat:
+            self.heartbeats += 1
+            self.heartbeats_total.inc()
+            reason = "heartbeat"
+        else:
+            self.suppressed += 1
+            self.suppressed_total.inc()
+            return None
+        self.last[appliance] = (kwh, now)
+        return reason
+
+    def stats(self):
+        total = self.changes + self.heartbeats + self.suppressed
+        return {
+            "changes": self.changes,
+            "heartbeats": self.heartbeats,
+            "suppressed": self.suppressed,
+            "suppressed_pct": 100.0 * self.suppressed / total if total else 0.0,
+        }
+
+
+# Simulates many homes and appliances from one asyncio scheduler
+class LoadGenerator:
+    def __init__(self, client, homes, appliances, rate, qos=0, retain=False,
+                 payload_size=0, payload_format=Codec.TEXT_FORMAT, duration=None, quiet=False):
+        if homes < 1 or appliances < 1 or rate <= 0:
+            raise ValueError("the load generator needs at least one stream and a positive rate")
+        self.client = client
+        names = Codec.load_appliances(appliances)
+        self.streams = [
+            (TopicRouter.status_topic(f"sim{home:04d}"), names[appliance])
+            for home in range(homes)
+            for appliance in range(appliances)
+        ]
+        self.rate = rate * len(self.streams)  # Total msgs/sec, each stream publishes at `rate`
+        self.qos = qos
+        self.retain = retain
+        self.payload_size = payload_size
+        self.payload_format = payload_format
+        self.duration = duration
+        self.quiet = quiet  # No progress lines, for callers that print their own summary
+
+        # Publish latency is measured from publish() until paho's on_publish for the MID
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.early_acks = {}
+        self.latencies = []
+        self.sent = 0
+        self.acked = 0
+
+        # The load generator talks to paho directly, so it records the shared metrics itself
+        self.published = Metrics.counter("mqtt_messages_published_total", "Messages handed to paho")
+        self.publish_seconds = Metrics.histogram("mqtt_publish_seconds", "Time spent in publish calls")
+        self.ack_seconds = Metrics.histogram("mqtt_publish_ack_seconds", "Time from publish to on_publish")
+        Metrics.gauge("mqtt_inflight_messages", "Unacknowledged QoS 1/2 publishes", lambda: len(self.in_flight))
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.lock:
+            start = self.in_flight.pop(mid, None)
+            if start is None:
+                self.early_acks[mid] = now  # Acked before publish() returned
+                return
+            self.latencies.append(now - start)
+            self.acked += 1
+        self.ack_seconds.observe(now - start)
 
-# Continuous publishing loop
-try:
-    while True:
-        if selected_appliance:
-            # Generate random kWh reading for the selected appliance
+    def publish(self, topic, appliance):
+        reading = round(random.uniform(0.1, 2.0), 2)
+        message = Codec.encode(appliance, reading, self.payload_format, time.time(), self.payload_size)
+        start = time.perf_counter()
+        info = self.client.publish(topic, message, qos=self.qos, retain=self.retain)
+        self.publish_seconds.observe(time.perf_counter() - start)
+        self.published.inc()
+        with self.lock:
+            self.sent += 1
+            acked_at = self.early_acks.pop(info.mid, None)
+            if acked_at is None:
+                self.in_flight[info.mid] = start
+            else:
+                self.latencies.append(acked_at - start)
+                self.acked += 1
+
+    def report(self, elapsed):
+        with self.lock:
+            latencies = self.latencies
+            self.latencies = []
+            sent, acked, in_flight = self.sent, self.acked, len(self.in_flight)
+        if self.quiet:
+            return latencies
+        p = Metrics.percentiles(latencies)
+        print(
+            f"[{elapsed:7.1f}s] sent {sent} ({sent / elapsed:.0f} msgs/sec), acked {acked}, "
+            f"in flight {in_flight}, publish latency ms "
+            f"p50={p[50] * 1000:.2f} p90={p[90] * 1000:.2f} p99={p[99] * 1000:.2f}"
+        )
+        return latencies
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        next_report = LOAD_REPORT_INTERVAL
+        index = 0
+        all_latencies = []
+        log.info("Load generator: %s streams at %.0f msgs/sec total", len(self.streams), self.rate)
+        while True:
+            elapsed = loop.time() - start
+            if self.duration is not None and elapsed >= self.duration:
+                break
+            # Publish every message that is due by now, then yield until the next slot
+            due = int(elapsed * self.rate) - self.sent
+            for _ in range(due):
+                topic, appliance = self.streams[index]
+                self.publish(topic, appliance)
+                index = (index + 1) % len(self.streams)
+            if elapsed >= next_report:
+                all_latencies.extend(self.report(elapsed))
+                next_report += LOAD_REPORT_INTERVAL
+            await asyncio.sleep(min(1 / self.rate, 0.01))
+        all_latencies.extend(self.report(loop.time() - start))
+        return all_latencies
+
+
+def run_publisher(connection, period=PUBLISH_PERIOD, streams=(), reporter=None, telemetry_qos=TELEMETRY_QOS):
+    # reporter is a ReportByException, or None to publish every reading
+    # Subscribe to command topic, re-subscribed by the connection after every reconnect
+    connection.subscribe(command_topic, on_message)
+
+    # Streams due together are published in one pass; None is the selected appliance
+    next_report = time.monotonic() + LAG_REPORT_INTERVAL
+    next_offline_warning = 0.0
+    offline_queued = 0  # Readings queued since the last offline warning
+
+    def publish_due(appliances, now):
+        nonlocal next_report, next_offline_warning, offline_queued
+        readings = [] if log.isEnabledFor(logging.DEBUG) else None
+        for appliance in appliances:
+            appliance = appliance or selected_appliance
+            if not appliance:
+                continue
+            # Generate random kWh reading for the appliance
             reading = round(random.uniform(0.1, 2.0), 2)  # Random kWh reading
-            message = f"{selected_appliance}:{reading}"
-            # Publish the message
-            print(f"Publishing: {message}")
-            client.publish(topic, message, qos=2, retain=True)
-        # Wait for 5 seconds before the next publication
-        time.sleep(5)
-except KeyboardInterrupt:
-    print("Publisher stopped by user.")
-except Exception as e:
-    print(f"Error during publishing: {e}")
-
-# Disconnect after publishing
-client.disconnect()
-client.loop_stop()
\ No newline at end of file
+            reason = reporter.check(appliance, reading, now) if reporter else "telemetry"
+            if reason is None:
+                continue
+            # A change is state the subscribers must see; heartbeats only refresh it
+            qos = CHANGE_QOS if reason == "change" else telemetry_qos
+            message = Codec.encode(appliance, reading, payload_format, time.time())
+            if readings is not None:
+                readings.append(f"{appliance}:{reading}")
+            # Readings made while the broker is down wait in the outbox
+            if connection.publish(topic, message, qos=qos, retain=True) is None:
+                offline_queued += 1
+        if offline_queued and now >= next_offline_warning:
+            log.warning("Broker offline, %d readings queued since the last warning, %d in the outbox",
+                        offline_queued, len(connection.outbox))
+            offline_queued = 0
+            next_offline_warning = now + OFFLINE_WARNING_INTERVAL
+        if readings:
+            log.debug("Publishing: %s (%s)", ', '.join(readings), payload_format)
+        if now >= next_report:
+            stats = scheduler.stats()
+            log.info("Schedule: %d ticks in %d batches, %d skipped, lag ms p50=%.2f p99=%.2f max=%.2f",
+                     stats["ticks"], stats["batches"], stats["skipped"],
+                     stats["lag_ms_p50"], stats["lag_ms_p99"], stats["lag_ms_max"])
+            if reporter:
+                stats = reporter.stats()
+                log.info("Report by exception: %d changes and %d heartbeats sent, %d suppressed (%.0f%%)",
+                         stats["changes"], stats["heartbeats"], stats["suppressed"], stats["suppressed_pct"])
+            next_report += LAG_REPORT_INTERVAL
+
+    scheduler = Scheduler.PeriodicScheduler(publish_due)
+    scheduler.add(None, period)
+    for appliance, stream_period in streams:
+        scheduler.add(appliance, stream_period)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        log.info("Publisher stopped by user.")
+    except Exception as e:
+        log.error("Error during publishing: %s", e)
+
+def run_load_generator(client, args):
+    generator = LoadGenerator(
+        client, args.homes, args.appliances, args.rate, args.qos, args.retain,
+        args.payload_size, args.format, args.duration,
+    )
+    client.on_publish = generator.on_publish
+    client.max_inflight_messages_set(args.inflight)
+    try:
+        latencies = asyncio.run(generator.run())
+        p = Metrics.percentiles(latencies)
+        print(f"Total: sent {generator.sent}, acked {generator.acked}, publish latency ms "
+              f"p50={p[50] * 1000:.2f} p90={p[90] * 1000:.2f} p99={p[99] * 1000:.2f}")
+    except KeyboardInterrupt:
+        log.info("Load generator stopped by user.")
+
+def parse_stream(value):
+    # "appliance=seconds"
+    appliance, _, period = value.rpartition("=")
+    try:
+        period = float(period)
+    except ValueError:
+        period = 0.0
+    if not appliance or period <= 0:
+        raise argparse.ArgumentTypeError(f"expected APPLIANCE=SECONDS, got {value!r}")
+    return appliance.lower(), period
+
+def parse_deadband(value):
+    # "appliance=kWh"
+    appliance, _, deadband = value.rpartition("=")
+    try:
+        deadband = float(deadband)
+    except ValueError:
+        deadband = -1.0
+    if not appliance or deadband < 0:
+        raise argparse.ArgumentTypeError(f"expected APPLIANCE=KWH, got {value!r}")
+    return appliance.lower(), deadband
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Smart home kWh publisher")
+    parser.add_argument("--broker", default=broker)
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--home", default=TopicRouter.DEFAULT_HOME, help="home ID to publish readings for")
+    parser.add_argument("--period", type=float, default=PUBLISH_PERIOD,
+                        help="seconds between readings of the selected appliance")
+    parser.add_argument("--stream", type=parse_stream, action="append", default=[],
+                        help="extra appliance stream with its own period, e.g. kettle=0.1 (may be repeated)")
+    parser.add_argument("--deadband", type=float, default=None,
+                        help="report by exception: only publish readings that moved more than this many kWh")
+    parser.add_argument("--appliance-deadband", type=parse_deadband, action="append", default=[],
+                        help="per-appliance deadband, e.g. kettle=0.5 (may be repeated)")
+    parser.add_argument("--heartbeat", type=float, default=HEARTBEAT_INTERVAL,
+                        help="with a deadband, republish unchanged readings after this many seconds (0 = never)")
+    parser.add_argument("--telemetry-qos", type=int, choices=(0, 1, 2), default=TELEMETRY_QOS,
+                        help="QoS of heartbeats and routine readings; changes are always sent at QoS 2")
+    parser.add_argument("--load", action="store_true", help="run the multi-home load generator")
+    parser.add_argument("--homes", type=int, default=10, help="simulated homes (pr/home/<id>/sts)")
+    parser.add_argument("--appliances", type=int, default=4, help="appliances per home")
+    parser.add_argument("--rate", type=float, default=1.0, help="msgs/sec per appliance")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0)
+    parser.add_argument("--retain", action="store_true")
+    parser.add_argument("--payload-size", type=int, default=0, help="pad payloads to this many bytes")
+    parser.add_argument("--format", choices=Codec.PAYLOAD_FORMATS, default=Codec.TEXT_FORMAT)
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run, forever by default")
+    parser.add_argument("--inflight", type=int, default=1000, help="max in-flight QoS 1/2 messages")
+    parser.add_argument("--outbox-dir", default=None, help="keep readings queued while offline on disk")
+    Metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.load and (args.homes < 1 or args.appliances < 1 or args.rate <= 0):
+        parser.error("--load needs at least one home and appliance and a positive --rate")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    Metrics.configure(args)
+    topic = TopicRouter.status_topic(args.home)
+    command_topic = TopicRouter.command_topic(args.home)
+
+    # Creating a unique Client ID
+    client_id = f"Publisher-{random.randint(1000, 9999)}"
+    log.info("Connecting to broker %s:%s", args.broker, args.port)
+
+    if args.load:
+        # The load generator talks to paho directly to track every MID
+        client = create_client(client_id)
+        try:
+            client.connect(args.broker, args.port)
+        except Exception as e:
+            log.error("Connection failed: %s", e)
+            exit(1)
+        client.loop_start()
+        run_load_generator(client, args)
+        client.disconnect()
+        client.loop_stop()
+    else:
+        # The shared connection reconnects with backoff and queues readings while offline
+        MqttCore.OUTBOX_DIR = args.outbox_dir
+        connection = MqttCore.acquire(
+            args.broker, args.port, client_id, clean_session=False,
+            on_connect=on_connect, on_disconnect=on_disconnect, on_publish=on_publish,
+        )
+        reporter = None
+        if args.deadband is not None or args.appliance_deadband:
+            reporter = ReportByException(args.deadband or 0.0, dict(args.appliance_deadband), args.heartbeat)
+        run_publisher(connection, args.period, args.stream, reporter, args.telemetry_qos)
+
+        # Disconnect after publishing
+        MqttCore.release(connection, on_connect=on_connect, on_disconnect=on_disconnect, on_publish=on_publish)
@@ -2,19 +2,35 @@
 # Relay Button
 
 # relay_button_script.py
-import sys
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import *
-import paho.mqtt.client as mqtt
+import logging
 import random
+import sys
+import threading
+import time
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QIntValidator
+from PyQt5.QtWidgets import (
+    QApplication, QComboBox, QFormLayout, QLabel, QLineEdit, QMainWindow, QMessageBox, QPushButton, QSpinBox, QWidget,
+)
+import Codec
+import Metrics
+import TopicRouter
+# MqttCore (and with it paho) is imported on the first connect
+
+log = logging.getLogger(__name__)
 
 # Default Client ID
 DEFAULT_CLIENT_ID = "IOT_client-3164"
 broker_ip = "127.0.0.1"
 broker_port = 1884
-button_topic = 'pr/home/id3164/sts'
+button_topic = TopicRouter.status_topic()
+
+# Burst mode settings
+BURST_COUNT = 1000  # Messages per burst
+BURST_WINDOW = 100  # Max unacknowledged messages
+BURST_DRAIN_TIMEOUT = 10.0  # Seconds to wait for the last acks
+BURST_CONNECT_TIMEOUT = 10.0  # Seconds to wait for the burst's own connection
+BURST_LATENCY_SAMPLES = 10000  # Ack latencies kept for percentiles
 
 class MqttClient:
     def __init__(self):
@@ -24,49 +40,183 @@ class MqttClient:
         self.client_name = DEFAULT_CLIENT_ID
         self.publish_topic = ''
         self.on_connected_to_form = None
-        self.client = None
+        self.connection = None
+        self.log_listener = None
 
     def set_on_connected_to_form(self, on_connected_to_form):
         self.on_connected_to_form = on_connected_to_form
 
     def connect_to(self):
         try:
-            # Initialize MQTT client
-            self.client = mqtt.Client(client_id=self.client_name, clean_session=True)
-            self.client.on_connect = self.on_connect
-            self.client.on_disconnect = self.on_disconnect
-            self.client.on_log = self.on_log
-            print(f"Connecting to broker {self.broker}:{self.port}")
-            self.client.connect(self.broker, int(self.port))
-            self.client.loop_start()
+            # Reuse the open connection instead of starting another client and loop thread
+            if self.connection:
+                log.info("Already connected to broker.")
+                return
+            import MqttCore
+            log.info("Connecting to broker %s:%s", self.broker, self.port)
+            # paho formats a log line per packet once on_log is set, so only ask when it is shown
+            self.log_listener = self.on_log if log.isEnabledFor(logging.DEBUG) else None
+            self.connection = MqttCore.acquire(
+                self.broker, self.port, self.client_name,
+                on_connect=self.on_connect, on_disconnect=self.on_disconnect, on_log=self.log_listener,
+            )
         except Exception as e:
-            print(f"Connection failed: {e}")
+            log.error("Connection failed: %s", e)
 
     def disconnect_from(self):
         try:
-            if self.client:
-                self.client.disconnect()
+            if self.connection:
+                import MqttCore
+                MqttCore.release(
+                    self.connection,
+                    on_connect=self.on_connect, on_disconnect=self.on_disconnect, on_log=self.log_listener,
+                )
+                self.connection = None
         except Exception as e:
-            print(f"Disconnection failed: {e}")
+            log.error("Disconnection failed: %s", e)
 
     def publish_to(self, topic, message):
-        if self.client:
-            self.client.publish(topic, message)
-            print(f"Published to topic '{topic}': {message}")
+        if self.connection:
+            self.connection.publish(topic, message)
+            log.debug("Published to topic '%s': %s", topic, message)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("Connected OK")
+            log.info("Connected OK")
             if self.on_connected_to_form:
                 self.on_connected_to_form()
         else:
-            print(f"Bad connection. Returned code={rc}")
+            log.warning("Bad connection. Returned code=%s", rc)
 
     def on_disconnect(self, client, userdata, rc):
-        print(f"Disconnected. Result code={rc}")
+        log.info("Disconnected. Result code=%s", rc)
 
     def on_log(self, client, userdata, level, buf):
-        print(f"log: {buf}")
+        log.debug("log: %s", buf)
+
+
+# Sends a burst of relay messages with at most `window` of them unacknowledged.
+# The burst has a connection of its own, so its in-flight limit and acks never mix with the
+# panels sharing the relay's client.
+class RelayBurst:
+    def __init__(self, broker, port, client_id, topic, count=BURST_COUNT, rate=0.0, qos=1, window=BURST_WINDOW):
+        self.broker = broker
+        self.port = port
+        self.client_id = client_id
+        self.connection = None
+        self.connected = threading.Event()
+        self.topic = topic
+        self.count = count
+        self.rate = rate  # msgs/sec, 0 sends as fast as the window allows
+        self.qos = qos
+        self.window_size = window
+        self.window = threading.BoundedSemaphore(window)
+        self.lock = threading.Lock()
+        self.in_flight = {}  # MID -> publish time
+        self.early_acks = {}  # MID -> ack time, for acks that beat publish() returning
+        self.latencies = []
+        self.sent = 0
+        self.acked = 0
+        self.started = None
+        self.finished = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        import MqttCore
+        self.running = True
+        self.connection = MqttCore.acquire(
+            self.broker, self.port, self.client_id, on_connect=self.on_connect, on_publish=self.on_publish
+        )
+        # paho holds back QoS 1/2 messages beyond its own limit (20), which would hide the window
+        self.connection.client.max_inflight_messages_set(self.window_size)
+        self.thread = threading.Thread(target=self.run, name="relay-burst", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected.set()
+
+    def run(self):
+        import MqttCore
+        try:
+            deadline = time.perf_counter() + BURST_CONNECT_TIMEOUT
+            while not self.connected.wait(0.1):
+                if not self.running:
+                    return
+                if time.perf_counter() >= deadline:
+                    log.warning("Burst connection to %s:%s failed", self.broker, self.port)
+                    return
+            self.started = time.perf_counter()
+            for index in range(self.count):
+                if not self.running:
+                    break
+                if self.rate:
+                    # Paced from the burst start, so slow publishes do not lower the rate
+                    delay = self.started + index / self.rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                while not self.window.acquire(timeout=0.1):
+                    if not self.running:
+                        return
+                message = str(Codec.Reading("kWh", round(random.uniform(0.1, 2.0), 2)))
+                start = time.perf_counter()
+                info = self.connection.publish(self.topic, message, qos=self.qos)
+                with self.lock:
+                    acked_at = self.early_acks.pop(info.mid, None) if info is not None else None
+                if info is None:
+                    log.warning("Broker offline, burst stopped after %d messages", self.sent)
+                    self.window.release()
+                    break
+                with self.lock:
+                    self.sent += 1
+                    if acked_at is None:
+                        self.in_flight[info.mid] = start
+                if acked_at is not None:
+                    self.record_ack(acked_at - start)
+            # Wait on the outstanding MIDs
+            deadline = time.perf_counter() + BURST_DRAIN_TIMEOUT
+            while self.in_flight and self.running and time.perf_counter() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.finished = time.perf_counter()
+            self.running = False
+            MqttCore.release(self.connection, on_connect=self.on_connect, on_publish=self.on_publish)
+            log.info("Burst done: %s", self.stats())
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.lock:
+            start = self.in_flight.pop(mid, None)
+            if start is None:
+                self.early_acks[mid] = now  # publish() has not returned this MID yet
+                return
+        self.record_ack(now - start)
+
+    def record_ack(self, latency):
+        with self.lock:
+            self.acked += 1
+            if len(self.latencies) < BURST_LATENCY_SAMPLES:
+                self.latencies.append(latency)
+        self.window.release()
+
+    def stats(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            sent, acked, in_flight = self.sent, self.acked, len(self.in_flight)
+        elapsed = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        stats = {
+            "sent": sent,
+            "acked": acked,
+            "in_flight": in_flight,
+            "rate": acked / elapsed if elapsed > 0 else 0.0,
+        }
+        for point, latency in Metrics.percentiles(latencies, (50, 99)).items():
+            stats[f"ack_ms_p{point}"] = latency * 1000
+        return stats
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -95,6 +245,27 @@ class MainWindow(QMainWindow):
         self.relay_button.setStyleSheet("background-color: red")
         self.relay_button.clicked.connect(self.on_relay_button_click)
 
+        # Burst mode: many relay messages through a bounded in-flight window
+        self.burst_count = QSpinBox()
+        self.burst_count.setRange(1, 10000000)
+        self.burst_count.setValue(BURST_COUNT)
+        self.burst_rate = QSpinBox()
+        self.burst_rate.setRange(0, 1000000)
+        self.burst_rate.setSpecialValueText("Max")
+        self.burst_rate.setSuffix(" msgs/sec")
+        self.burst_qos = QComboBox()
+        self.burst_qos.addItems(["0", "1", "2"])
+        self.burst_qos.setCurrentIndex(1)
+        self.burst_window = QSpinBox()
+        self.burst_window.setRange(1, 65535)
+        self.burst_window.setValue(BURST_WINDOW)
+        self.burst_button = QPushButton("Start Burst")
+        self.burst_button.clicked.connect(self.on_burst_button_click)
+        self.burst_stats = QLabel("")
+        self.burst = None
+        self.burst_timer = QTimer(self)
+        self.burst_timer.timeout.connect(self.update_burst_stats)
+
         # Layout
         form_layout = QFormLayout()
         form_layout.addRow("Broker IP:", self.ip_input)
@@ -102,6 +273,12 @@ class MainWindow(QMainWindow):
         form_layout.addRow("Client ID:", self.client_id_input)
         form_layout.addRow("", self.connect_button)
         form_layout.addRow("Relay Button:", self.relay_button)
+        form_layout.addRow("Burst Count:", self.burst_count)
+        form_layout.addRow("Burst Rate:", self.burst_rate)
+        form_layout.addRow("Burst QoS:", self.burst_qos)
+        form_layout.addRow("In-flight Window:", self.burst_window)
+        form_layout.addRow("", self.burst_button)
+        form_layout.addRow("", self.burst_stats)
 
         container = QWidget()
         container.setLayout(form_layout)
@@ -128,10 +305,38 @@ class MainWindow(QMainWindow):
     def on_relay_button_click(self):
         # Generate a random kWh value
         random_kwh = round(random.uniform(0.1, 2.0), 2)
-        message = f"kWh:{random_kwh}"
+        message = str(Codec.Reading("kWh", random_kwh))  # Text format, "kWh:<value>"
         self.mc.publish_to(button_topic, message)
 
+    def on_burst_button_click(self):
+        if self.burst and self.burst.running:
+            self.burst.stop()
+            return
+        if not self.mc.connection or not self.mc.connection.is_connected():
+            QMessageBox.warning(self, "Error", "Connect to the broker before starting a burst!")
+            return
+        self.burst = RelayBurst(
+            self.mc.broker, self.mc.port, f"{self.mc.client_name}-burst", button_topic, self.burst_count.value(),
+            self.burst_rate.value(), int(self.burst_qos.currentText()), self.burst_window.value(),
+        )
+        self.burst.start()
+        self.burst_button.setText("Stop Burst")
+        self.burst_timer.start(200)
+
+    def update_burst_stats(self):
+        stats = self.burst.stats()
+        self.burst_stats.setText(
+            f"Sent: {stats['sent']} | Acked: {stats['acked']} | In flight: {stats['in_flight']}\n"
+            f"Rate: {stats['rate']:.0f} msgs/sec | Ack p50: {stats['ack_ms_p50']:.2f} ms | "
+            f"p99: {stats['ack_ms_p99']:.2f} ms"
+        )
+        if not self.burst.running:
+            self.burst_timer.stop()
+            self.burst_button.setText("Start Burst")
+
 if __name__ == "__main__":
+    Metrics.setup_logging()
+    Metrics.start()  # Only when IOT_METRICS_PORT or IOT_METRICS_FILE is set
     app = QApplication(sys.argv)
     mainwin = MainWindow()
     mainwin.show()
@@ -0,0 +1,113 @@
+# IoT Project
+# Periodic Scheduler
+
+# scheduler.py
+# Fires many streams, each at its own period, from one thread. Deadlines live in a heap and
+# advance by whole periods from the stream's start on the monotonic clock, so the time spent
+# publishing never accumulates as drift. Streams due within COALESCE_WINDOW of each other are
+# handed over together, and a stream that falls more than a period behind skips the ticks it
+# missed instead of bursting to catch up.
+import heapq
+import threading
+import time
+from collections import deque
+import Metrics
+
+COALESCE_WINDOW = 0.002  # Seconds; deadlines this close fire in one batch
+LAG_SAMPLES = 10000  # Recent lags kept for percentiles
+
+
+class PeriodicScheduler:
+    def __init__(self, handler, coalesce=COALESCE_WINDOW, clock=time.monotonic):
+        # handler(keys, now) gets every stream due in one wakeup
+        self.handler = handler
+        self.coalesce = coalesce
+        self.clock = clock
+        self.heap = []  # (deadline, sequence, key, period)
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Event()  # Wakes the loop when streams change or on stop
+        self.running = False
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self.ticks = 0
+        self.batches = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+
+    def add(self, key, period, phase=0.0):
+        if period <= 0:
+            raise ValueError("period must be positive")
+        with self.lock:
+            heapq.heappush(self.heap, (self.clock() + phase, self.sequence, key, period))
+            self.sequence += 1
+        self.changed.set()
+
+    def remove(self, key):
+        with self.lock:
+            self.heap = [entry for entry in self.heap if entry[2] != key]
+            heapq.heapify(self.heap)
+        self.changed.set()
+
+    def due(self, now):
+        # Pops every stream due by now (plus the coalesce window) and schedules its next tick
+        keys = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now + self.coalesce:
+                deadline, sequence, key, period = heapq.heappop(self.heap)
+                lag = max(0.0, now - deadline)
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                keys.append(key)
+                deadline += period
+                if deadline <= now:
+                    missed = int((now - deadline) // period) + 1
+                    self.skipped += missed
+                    deadline += missed * period
+                heapq.heappush(self.heap, (deadline, sequence, key, period))
+            self.ticks += len(keys)
+            if keys:
+                self.batches += 1
+        return keys
+
+    def next_deadline(self):
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def run(self, duration=None):
+        # Blocks until stop() or until duration seconds have passed
+        self.running = True
+        end = None if duration is None else self.clock() + duration
+        while self.running:
+            now = self.clock()
+            if end is not None and now >= end:
+                break
+            keys = self.due(now)
+            if keys:
+                self.handler(keys, now)
+                continue
+            deadline = self.next_deadline()
+            wait = None if deadline is None else deadline - now
+            if end is not None:
+                wait = end - now if wait is None else min(wait, end - now)
+            # Sleeps in the kernel until the next deadline, no busy polling
+            self.changed.wait(wait)
+            self.changed.clear()
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        self.changed.set()
+
+    def stats(self):
+        with self.lock:
+            lags = list(self.lags)
+            stats = {
+                "streams": len(self.heap),
+                "ticks": self.ticks,
+                "batches": self.batches,
+                "skipped": self.skipped,
+                "lag_ms_max": self.max_lag * 1000,
+            }
+        for point, lag in Metrics.percentiles(lags, (50, 99)).items():
+            stats[f"lag_ms_p{point}"] = lag * 1000
+        return stats
@@ -0,0 +1,125 @@
+# IoT Project
+# Startup Benchmark
+
+# startup_bench.py
+# Cold-starts each GUI entry point in a fresh interpreter and records the time spent on
+# imports, on building the window, and from launch to the window's first paint, along with
+# the heavy modules already loaded at that point. Results are appended as JSON lines.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_OUTPUT = "startup_results.jsonl"
+ENTRY_POINTS = ["IoT_Project", "Connect", "Relay"]
+HEAVY_MODULES = ["numpy", "paho.mqtt.client", "http.server", "asyncio"]  # Should load after the first paint
+PAINT_TIMEOUT = 10000  # Milliseconds to wait for the first paint
+
+
+def measure(entry_point, history_dir):
+    # Runs in the child interpreter and prints one JSON result
+    started = time.time()
+    import importlib
+    module = importlib.import_module(entry_point)
+    imported = time.time()
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication([entry_point])
+    window = module.MainWindow(history_dir) if entry_point == "IoT_Project" else module.MainWindow()
+    built = time.time()
+    painted = {}
+
+    class PaintWatcher(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Paint and not painted:
+                painted["time"] = time.time()
+                painted["loaded"] = [name for name in HEAVY_MODULES if name in sys.modules]
+                QTimer.singleShot(0, app.quit)
+            return False
+
+    watcher = PaintWatcher()
+    app.installEventFilter(watcher)
+    window.show()
+    QTimer.singleShot(PAINT_TIMEOUT, app.quit)
+    app.exec_()
+    if hasattr(window, "close_history"):
+        window.close_history()
+    print(json.dumps({
+        "started": started,
+        "imported": imported,
+        "built": built,
+        "painted": painted.get("time"),
+        "loaded": painted.get("loaded"),
+    }))
+
+
+def run_once(entry_point, history_dir, platform):
+    env = dict(os.environ)
+    if platform:
+        env["QT_QPA_PLATFORM"] = platform
+    launched = time.time()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", entry_point, "--history-dir", history_dir],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    times = json.loads(output.strip().splitlines()[-1])
+    if times["painted"] is None:
+        raise RuntimeError(f"{entry_point} did not paint within {PAINT_TIMEOUT} ms")
+    return {
+        "interpreter_ms": (times["started"] - launched) * 1000,
+        "import_ms": (times["imported"] - times["started"]) * 1000,
+        "window_ms": (times["built"] - times["imported"]) * 1000,
+        "first_paint_ms": (times["painted"] - launched) * 1000,
+        "loaded": times["loaded"],
+    }
+
+
+def summarize(entry_point, runs):
+    result = {"entry_point": entry_point, "runs": len(runs), "timestamp": time.time()}
+    for name in ("interpreter_ms", "import_ms", "window_ms", "first_paint_ms"):
+        values = sorted(run[name] for run in runs)
+        result[f"{name}_p50"] = values[len(values) // 2]
+        result[f"{name}_max"] = values[-1]
+    result["loaded_before_paint"] = sorted({name for run in runs for name in run["loaded"]})
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import time and time-to-first-paint of the GUI entry points")
+    parser.add_argument("--entry-points", nargs="+", default=ENTRY_POINTS, choices=ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per entry point")
+    parser.add_argument("--platform", default=None, help="Qt platform plugin, e.g. offscreen on a headless hub")
+    parser.add_argument("--history-dir", default=None, help="history for IoT_Project, an empty one by default")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON lines file results are appended to")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        measure(args.child, args.history_dir)
+        return 0
+    with tempfile.TemporaryDirectory(prefix="iot-startup-") as empty_history, open(args.output, "a") as output:
+        history_dir = args.history_dir or empty_history
+        for entry_point in args.entry_points:
+            result = summarize(entry_point, [
+                run_once(entry_point, history_dir, args.platform) for _ in range(args.runs)
+            ])
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            print(
+                f"{entry_point}: first paint {result['first_paint_ms_p50']:.0f} ms "
+                f"(max {result['first_paint_ms_max']:.0f}), interpreter {result['interpreter_ms_p50']:.0f} ms, "
+                f"imports {result['import_ms_p50']:.0f} ms, window {result['window_ms_p50']:.0f} ms, "
+                f"loaded before paint: {', '.join(result['loaded_before_paint']) or 'none'}"
+            )
+    print(f"Results appended to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+# IoT Project
+# Time-Series Storage
+
+# storage.py
+# Append-only store for (timestamp, home, appliance, kWh) samples.
+# Each (home, appliance) series is a directory of fixed-size-record segment files that are
+# memory-mapped for reads. Records inside a segment are sorted by timestamp, so a range is
+# two binary searches away; appends go through a write-behind buffer and a writer thread.
+# One process owns a history directory, enforced with an exclusive flock on its lock file;
+# any other process can only open it read-only.
+import os
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+from collections import deque
+from urllib.parse import quote, unquote
+import numpy as np
+
+HISTORY_DIR = "history"
+RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("kwh", "<f8")])
+SEGMENT_RECORDS = 1 << 20  # 16 MB per segment file
+SEGMENT_SPAN = 86400.0  # Seconds of samples per segment, so retention can drop whole days
+SEGMENT_SUFFIX = ".seg"
+FLUSH_INTERVAL = 1.0  # Seconds between write-behind flushes
+FLUSH_BATCH = 10000  # Pending samples that trigger an early flush
+UNKNOWN_HOME = "_"
+LOCK_FILE = ".lock"  # Held by the process that owns the history directory
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        self.count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        self.first = self.last = None
+        self.mapped = None
+        self.mapped_count = 0
+        if self.count:
+            records = self.records()
+            self.first = float(records["timestamp"][0])
+            self.last = float(records["timestamp"][-1])
+
+    def records(self):
+        # Re-map only when the file grew since the last read
+        if self.mapped_count != self.count:
+            self.mapped = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", shape=(self.count,))
+            self.mapped_count = self.count
+        return self.mapped
+
+    def append(self, records):
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+        if not self.count:
+            self.first = float(records["timestamp"][0])
+        self.last = float(records["timestamp"][-1])
+        self.count += len(records)
+
+    def slice(self, start, end):
+        records = self.records()
+        timestamps = records["timestamp"]
+        low = 0 if start is None else np.searchsorted(timestamps, start, "left")
+        high = self.count if end is None else np.searchsorted(timestamps, end, "right")
+        return records[low:high]
+
+
+class Series:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        names = sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+        self.segments = [Segment(os.path.join(path, name)) for name in names]
+
+    def append(self, records):
+        records = records[np.argsort(records["timestamp"], kind="stable")]
+        while len(records):
+            segment = self.segments[-1] if self.segments else None
+            # Segments stay sorted: late samples and full segments start a new file
+            if (segment is None or segment.count >= SEGMENT_RECORDS
+                    or (segment.count and records["timestamp"][0] < segment.last)
+                    or (segment.count and records["timestamp"][0] - segment.first >= SEGMENT_SPAN)):
+                index = int(os.path.basename(segment.path)[:-len(SEGMENT_SUFFIX)]) + 1 if segment else 0
+                name = f"{index:06d}{SEGMENT_SUFFIX}"
+                open(os.path.join(self.path, name), "wb").close()
+                segment = Segment(os.path.join(self.path, name))
+                self.segments.append(segment)
+            first = segment.first if segment.count else records["timestamp"][0]
+            span_room = int(np.searchsorted(records["timestamp"], first + SEGMENT_SPAN, "left"))
+            room = min(SEGMENT_RECORDS - segment.count, span_room)
+            segment.append(records[:room])
+            records = records[room:]
+
+    def drop_before(self, cutoff):
+        # Deletes segments whose newest sample is older than the cutoff
+        expired = [segment for segment in self.segments if segment.count and segment.last < cutoff]
+        for segment in expired:
+            os.remove(segment.path)
+        self.segments = [segment for segment in self.segments if segment not in expired]
+        return sum(segment.count for segment in expired)
+
+    def slices(self, start=None, end=None):
+        return [
+            segment.slice(start, end) for segment in self.segments
+            if segment.count
+            and (start is None or segment.last >= start)
+            and (end is None or segment.first <= end)
+        ]
+
+    def query(self, start=None, end=None):
+        parts = self.slices(start, end)
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        records = np.concatenate(parts)
+        # Only segments written out of order overlap and need a re-sort
+        if any(parts[i]["timestamp"][0] < parts[i - 1]["timestamp"][-1] for i in range(1, len(parts))):
+            records = records[np.argsort(records["timestamp"], kind="stable")]
+        return records
+
+    def tail(self, limit):
+        # The `limit` newest samples by timestamp. A late sample can sit in the newest segment,
+        # so segments are visited by their newest sample, until none can hold a newer one.
+        parts = []
+        collected = 0
+        cutoff = None
+        for segment in sorted((s for s in self.segments if s.count), key=lambda s: s.last, reverse=True):
+            if cutoff is not None and segment.last <= cutoff:
+                break
+            parts.append(segment.records()[-limit:])
+            collected += len(parts[-1])
+            if collected >= limit:
+                timestamps = np.concatenate([part["timestamp"] for part in parts])
+                cutoff = np.partition(timestamps, collected - limit)[collected - limit]
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        if len(parts) == 1:
+            return np.array(parts[0])  # Segments are sorted
+        records = np.concatenate(parts)
+        if len(records) > limit:
+            records = records[np.argpartition(records["timestamp"], len(records) - limit)[-limit:]]
+        return records[np.argsort(records["timestamp"], kind="stable")]
+
+
+class HistoryLocked(RuntimeError):
+    pass
+
+
+class TimeSeriesStore:
+    def __init__(self, path=HISTORY_DIR, read_only=False):
+        # Raises HistoryLocked when another process owns the directory and read_only is False
+        self.path = path
+        self.read_only = read_only  # Appends are dropped, nothing on disk is changed
+        self.pending = deque()
+        self.lock = threading.Lock()  # Guards the series index and segment files
+        self.series = {}
+        os.makedirs(path, exist_ok=True)
+        self.lock_file = None
+        if not read_only and fcntl:
+            self.lock_file = open(os.path.join(path, LOCK_FILE), "a")
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                raise HistoryLocked(f"{path} is in use by another process")
+        for home in os.listdir(path):
+            home_path = os.path.join(path, home)
+            # Dot directories hold derived data such as Compaction's rollups
+            if home.startswith(".") or not os.path.isdir(home_path):
+                continue
+            for appliance in os.listdir(home_path):
+                key = (unquote(home), unquote(appliance))
+                self.series[key] = Series(os.path.join(home_path, appliance))
+
+        self.written = 0
+        self.running = not read_only
+        self.wakeup = threading.Event()
+        self.writer = None
+        if not read_only:
+            self.writer = threading.Thread(target=self.run, name="storage-writer", daemon=True)
+            self.writer.start()
+
+    def append(self, timestamp, home, appliance, kwh):
+        # Never blocks: safe to call from the MQTT network thread
+        if self.read_only:
+            return
+        self.pending.append((timestamp, home or UNKNOWN_HOME, appliance, kwh))
+        if len(self.pending) >= FLUSH_BATCH:
+            self.wakeup.set()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            count = len(self.pending)
+            if not count:
+                return
+            grouped = {}
+            for _ in range(count):
+                timestamp, home, appliance, kwh = self.pending.popleft()
+                grouped.setdefault((home, appliance), []).append((timestamp, kwh))
+            for key, samples in grouped.items():
+                series = self.series.get(key)
+                if series is None:
+                    home, appliance = key
+                    series = Series(os.path.join(self.path, quote(home, safe=""), quote(appliance, safe="")))
+                    self.series[key] = series
+                series.append(np.array(samples, dtype=RECORD_DTYPE))
+            self.written += count
+
+    def keys(self):
+        with self.lock:
+            return list(self.series)
+
+    def query(self, home, appliance, start=None, end=None):
+        # Samples of one series with start <= timestamp <= end, as a RECORD_DTYPE array
+        self.flush()
+        with self.lock:
+            series = self.series.get((home or UNKNOWN_HOME, appliance))
+            if series is None:
+                return np.empty(0, dtype=RECORD_DTYPE)
+            return series.query(start, end)
+
+    def aggregate(self, home, appliance, start=None, end=None):
+        # Reduces each mapped segment slice in place, nothing is copied
+        self.flush()
+        with self.lock:
+            series = self.series.get((home or UNKNOWN_HOME, appliance))
+            parts = [part["kwh"] for part in series.slices(start, end) if len(part)] if series else []
+            if not parts:
+                return {"count": 0, "sum": 0.0, "min": None, "max": None, "mean": None}
+            count = sum(len(part) for part in parts)
+            total = float(sum(part.sum() for part in parts))
+            return {
+                "count": count,
+                "sum": total,
+                "min": float(min(part.min() for part in parts)),
+                "max": float(max(part.max() for part in parts)),
+                "mean": total / count,
+            }
+
+    def drop_before(self, cutoff):
+        # Retention: frees whole segments older than the cutoff, returns the samples dropped
+        self.flush()
+        with self.lock:
+            return sum(series.drop_before(cutoff) for series in self.series.values())
+
+    def tail(self, limit):
+        # The latest `limit` samples across all series, oldest first: [(timestamp, home, appliance, kwh)]
+        if limit <= 0:
+            return []
+        self.flush()
+        with self.lock:
+            keys = list(self.series)
+            tails = [self.series[key].tail(limit) for key in keys]
+        if not tails:
+            return []
+        records = np.concatenate(tails)
+        owners = np.repeat(np.arange(len(keys)), [len(tail) for tail in tails])
+        # Top `limit` by timestamp across series, only those become Python objects
+        if len(records) > limit:
+            newest = np.argpartition(records["timestamp"], len(records) - limit)[-limit:]
+            records = records[newest]
+            owners = owners[newest]
+        order = np.argsort(records["timestamp"], kind="stable")
+        return [
+            (timestamp, *keys[owner], kwh)
+            for timestamp, kwh, owner in zip(
+                records["timestamp"][order].tolist(), records["kwh"][order].tolist(), owners[order].tolist()
+            )
+        ]
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        if self.writer:
+            self.writer.join(FLUSH_INTERVAL * 2)
+        self.flush()
+        if self.lock_file:
+            self.lock_file.close()  # Releases the flock
+            self.lock_file = None
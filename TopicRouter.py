@@ -0,0 +1,151 @@
+# IoT Project
+# Topic Router
+
+# topic_router.py
+# Topic scheme helpers and a topic-filter trie that maps an inbound topic to its handlers.
+# Matching walks one trie level per topic level, and results are cached per topic, so the
+# cost of dispatch does not grow with the number of subscribed homes.
+import threading
+
+DEFAULT_HOME = "id3164"
+STATUS_FILTER = "pr/home/+/sts"  # Every home's readings
+TOPIC_CACHE_SIZE = 4096  # Distinct topics whose match results are cached
+
+
+def status_topic(home=DEFAULT_HOME):
+    return f"pr/home/{home}/sts"
+
+
+def command_topic(home=DEFAULT_HOME):
+    return f"pr/home/{home}/cmd"
+
+
+def ack_topic(home=DEFAULT_HOME, requester="_"):
+    # Where a home answers commands sent by one requester
+    return f"pr/home/{home}/ack/{requester}"
+
+
+def alert_topic(home=DEFAULT_HOME):
+    return f"pr/home/{home}/alert"
+
+
+def ping_topic(requester="_"):
+    # Loopback health probes, kept out of pr/home/# so captures and subscribers never see them
+    return f"pr/ping/{requester}"
+
+
+def shared_filter(group, topic_filter):
+    # The broker hands each matching message to one member of the group
+    return f"$share/{group}/{topic_filter}"
+
+
+def route_filter(topic_filter):
+    # The filter a subscription's messages are published under: $share/<group>/ stripped
+    if topic_filter.startswith("$share/"):
+        return topic_filter.split("/", 2)[2]
+    return topic_filter
+
+
+def validate_filter(topic_filter):
+    # Returns None for a valid MQTT topic filter, otherwise the reason it is invalid
+    if not topic_filter:
+        return "Topic filter cannot be empty"
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if "#" in level and (level != "#" or index != len(levels) - 1):
+            return "'#' must be a whole level at the end of the filter"
+        if "+" in level and level != "+":
+            return "'+' must be a whole level"
+    return None
+
+
+class _Node:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class TopicRouter:
+    def __init__(self, cache_size=TOPIC_CACHE_SIZE):
+        self.root = _Node()
+        self.cache = {}
+        self.cache_size = cache_size
+        self.generation = 0  # Bumped on every change so a stale match is never cached
+        self.lock = threading.Lock()
+
+    def add(self, topic_filter, handler):
+        with self.lock:
+            node = self.root
+            for level in topic_filter.split("/"):
+                node = node.children.setdefault(level, _Node())
+            node.handlers.append(handler)
+            self.generation += 1
+            self.cache = {}
+
+    def remove(self, topic_filter, handler):
+        # Returns True when no handler is left for this filter
+        with self.lock:
+            path = [self.root]
+            for level in topic_filter.split("/"):
+                node = path[-1].children.get(level)
+                if node is None:
+                    return True
+                path.append(node)
+            if handler in path[-1].handlers:
+                path[-1].handlers.remove(handler)
+            empty = not path[-1].handlers
+            # Prune branches that no longer lead to a handler
+            levels = topic_filter.split("/")
+            for depth in range(len(levels), 0, -1):
+                node = path[depth]
+                if node.handlers or node.children:
+                    break
+                del path[depth - 1].children[levels[depth - 1]]
+            self.generation += 1
+            self.cache = {}
+            return empty
+
+    def match(self, topic):
+        handlers = self.cache.get(topic)
+        if handlers is not None:
+            return handlers
+        generation = self.generation
+        found = []
+        levels = topic.split("/")
+        # Wildcards never match topics starting with '$' at the first level
+        self._walk(self.root, levels, 0, found, not topic.startswith("$"))
+        # A handler subscribed through several matching filters runs once
+        handlers = tuple(dict.fromkeys(found))
+        with self.lock:
+            if generation == self.generation:
+                if len(self.cache) >= self.cache_size:
+                    self.cache = {}
+                self.cache[topic] = handlers
+        return handlers
+
+    def _walk(self, node, levels, index, found, wildcards):
+        if index == len(levels):
+            found.extend(node.handlers)
+            hash_node = node.children.get("#")
+            if hash_node:  # "a/#" also matches "a"
+                found.extend(hash_node.handlers)
+            return
+        if wildcards:
+            hash_node = node.children.get("#")
+            if hash_node:
+                found.extend(hash_node.handlers)
+        child = node.children.get(levels[index])
+        if child:
+            self._walk(child, levels, index + 1, found, True)
+        if wildcards:
+            plus_node = node.children.get("+")
+            if plus_node:
+                self._walk(plus_node, levels, index + 1, found, True)
+
+    def dispatch(self, topic, *args):
+        handlers = self.match(topic)
+        for handler in handlers:
+            handler(*args)
+        return len(handlers)
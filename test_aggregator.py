@@ -0,0 +1,65 @@
+# IoT Project
+# Rolling Aggregation Tests
+
+# test_aggregator.py
+import pytest
+import Aggregator
+
+T0 = 1700000000.0
+
+
+def test_running_statistics_and_windows():
+    aggregator = Aggregator.RollingAggregator()
+    for offset, kwh in ((0, 1.0), (30, 3.0), (600, 2.0)):
+        aggregator.update(T0 + offset, "h1", "oven", kwh)
+    summary = aggregator.series_summary("h1", "oven", now=T0 + 600)
+    assert (summary["count"], summary["sum"], summary["min"], summary["max"]) == (3, 6.0, 1.0, 3.0)
+    assert summary["mean"] == 2.0
+    assert summary["1m"] == 2.0  # The first two readings left the minute window
+    assert summary["15m"] == 6.0
+    assert aggregator.series_summary("h1", "oven", now=T0 + 4300)["1h"] == 0.0
+    assert aggregator.series_summary("h2", "oven") is None
+
+
+def test_appliance_summary_spans_homes():
+    aggregator = Aggregator.RollingAggregator()
+    aggregator.update(T0, "h1", "kettle", 1.0)
+    aggregator.update(T0, "h2", "kettle", 2.0)
+    aggregator.update(T0, "h2", "oven", 5.0)
+    summary = aggregator.appliance_summary("kettle", now=T0)
+    assert (summary["count"], summary["sum"], summary["1m"]) == (2, 3.0, 3.0)
+    assert aggregator.appliance_summary("dryer") is None
+
+
+def test_backfill_matches_updates():
+    timestamps = [T0 + 7.5 * index for index in range(200)]
+    values = [0.1 + (index % 13) / 10 for index in range(200)]
+    updated = Aggregator.RollingAggregator()
+    for timestamp, kwh in zip(timestamps, values):
+        updated.update(timestamp, "h1", "oven", kwh)
+    backfilled = Aggregator.RollingAggregator()
+    backfilled.backfill("h1", "oven", timestamps, values)
+    now = timestamps[-1]
+    expected = updated.series_summary("h1", "oven", now)
+    actual = backfilled.series_summary("h1", "oven", now)
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        assert actual[key] == pytest.approx(value)
+
+
+def test_merge_folds_in_summaries():
+    aggregator = Aggregator.RollingAggregator()
+    aggregator.update(T0, "h1", "oven", 1.0)
+    aggregator.merge(T0 + 1, "h1", "oven", 4, 10.0, 0.5, 4.0, 2.0)
+    summary = aggregator.series_summary("h1", "oven", now=T0 + 1)
+    assert (summary["count"], summary["sum"], summary["min"], summary["max"]) == (5, 11.0, 0.5, 4.0)
+    assert summary["1m"] == 11.0
+    assert aggregator.last[aggregator.slots[("h1", "oven")]] == 2.0
+
+
+def test_grows_past_initial_capacity():
+    aggregator = Aggregator.RollingAggregator(capacity=2)
+    for home in range(5):
+        aggregator.update(T0, f"h{home}", "oven", float(home))
+    assert aggregator.appliance_summary("oven", now=T0)["sum"] == 10.0
+    assert aggregator.series_summary("h4", "oven", now=T0)["max"] == 4.0
@@ -0,0 +1,66 @@
+# IoT Project
+# Alerting Tests
+
+# test_alerts.py
+# Readings go through submit() and the worker thread, alerts are collected from on_alert.
+import threading
+import time
+import pytest
+import Alerts
+
+
+@pytest.fixture
+def delivered():
+    alerts = []
+    event = threading.Event()
+
+    def on_alert(alert):
+        alerts.append(alert)
+        event.set()
+
+    yield alerts, event, on_alert
+
+
+def test_threshold_alert_reaches_on_alert(delivered):
+    alerts, event, on_alert = delivered
+    engine = Alerts.AlertEngine([Alerts.ThresholdRule("oven", above=2.0)], on_alert=on_alert)
+    engine.submit(100.0, "id1", "kettle", 3.0)  # Rule is for ovens only
+    engine.submit(101.0, "id1", "oven", 1.0)
+    engine.submit(102.0, "id1", "oven", 3.0)
+    assert event.wait(2)
+    engine.stop()
+    assert [(alert.home, alert.appliance, alert.rule) for alert in alerts] == [("id1", "oven", "threshold")]
+    assert engine.recent_alerts() == alerts
+
+
+def test_repeats_within_the_cooldown_are_suppressed(delivered):
+    alerts, event, on_alert = delivered
+    engine = Alerts.AlertEngine([Alerts.ThresholdRule(above=2.0)], on_alert=on_alert, cooldown=60)
+    for offset in range(5):
+        engine.submit(100.0 + offset, "id1", "oven", 3.0)
+    engine.submit(200.0, "id1", "oven", 3.0)
+    engine.submit(201.0, "id2", "oven", 3.0)
+    deadline = time.monotonic() + 2
+    while len(alerts) < 3 and time.monotonic() < deadline:
+        event.wait(0.1)
+        event.clear()
+    engine.stop()
+    assert [(alert.timestamp, alert.home) for alert in alerts] == [(100.0, "id1"), (200.0, "id1"), (201.0, "id2")]
+
+
+def test_rate_of_change_uses_the_previous_reading():
+    rule = Alerts.RateOfChangeRule(max_rate=1.0)
+    state = Alerts.SeriesState()
+    assert rule.check(state, 10.0, 5.0) is None  # No previous reading
+    state.update(10.0, 1.0)
+    assert rule.check(state, 11.0, 1.5) is None
+    assert rule.check(state, 11.0, 3.0) is not None
+
+
+def test_stop_wakes_an_idle_worker():
+    engine = Alerts.AlertEngine([])
+    time.sleep(0.05)
+    started = time.monotonic()
+    engine.stop()
+    assert not engine.thread.is_alive()
+    assert time.monotonic() - started < 0.5
@@ -0,0 +1,45 @@
+# IoT Project
+# Consumption Chart Tests
+
+# test_chart.py
+# Ring buffers and decimation only, nothing here needs a QApplication.
+import numpy as np
+import Chart
+
+
+def test_ring_keeps_the_newest_points():
+    series = Chart.RingSeries(capacity=4)
+    series.extend([1.0, 2.0, 3.0], [10.0, 20.0, 30.0])
+    series.extend([4.0, 5.0], [40.0, 50.0])
+    timestamps, values = series.ordered()
+    assert timestamps.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert values.tolist() == [20.0, 30.0, 40.0, 50.0]
+
+
+def test_points_from_several_homes_come_back_sorted():
+    series = Chart.RingSeries(capacity=8)
+    series.extend([10.0, 12.0, 11.0], [1.0, 3.0, 2.0])  # Two homes interleaved in one batch
+    series.extend([9.0, 13.0], [0.5, 4.0])  # Late sample in the next batch
+    timestamps, values = series.ordered()
+    assert timestamps.tolist() == [9.0, 10.0, 11.0, 12.0, 13.0]
+    assert values.tolist() == [0.5, 1.0, 2.0, 3.0, 4.0]
+    assert timestamps.searchsorted(11.0) == 2
+
+
+def test_sorting_a_wrapped_ring_then_overwriting_drops_the_oldest():
+    series = Chart.RingSeries(capacity=4)
+    series.extend([5.0, 6.0, 7.0], [5.0, 6.0, 7.0])
+    series.extend([8.0, 1.0], [8.0, 1.0])
+    assert series.ordered()[0].tolist() == [1.0, 6.0, 7.0, 8.0]
+    series.extend([9.0], [9.0])
+    assert series.ordered()[0].tolist() == [6.0, 7.0, 8.0, 9.0]
+
+
+def test_decimate_gives_one_min_max_pair_per_column():
+    timestamps = np.arange(0.0, 100.0)
+    values = np.arange(100.0) % 10
+    x, y = Chart.decimate(timestamps, values, 0.0, 100.0, 10)
+    assert x.tolist() == sorted(x.tolist())
+    assert x.tolist() == [column for column in range(9) for _ in range(2)]  # t=99 lands in column 8
+    assert len(y) == len(x)
+    assert y.min() == 0.0 and y.max() == 9.0
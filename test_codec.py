@@ -0,0 +1,46 @@
+# IoT Project
+# Reading Codec Tests
+
+# test_codec.py
+import pytest
+import Codec
+
+
+@pytest.mark.parametrize("payload_format", Codec.PAYLOAD_FORMATS)
+def test_round_trip_with_padding(payload_format):
+    payload = Codec.encode("washing machine", 1.25, payload_format, 1700000000.5, size=64)
+    assert len(payload) == 64
+    reading = Codec.decode(payload, "pr/home/id3164/sts")
+    assert (reading.appliance, reading.kwh, reading.home) == ("washing machine", 1.25, "id3164")
+    assert reading.timestamp == (1700000000.5 if payload_format == Codec.BINARY_FORMAT else 0.0)
+
+
+def test_decoded_names_are_shared():
+    first = Codec.decode(b"oven:1.0")
+    second = Codec.decode(Codec.encode("oven", 2.0, Codec.BINARY_FORMAT))
+    assert first.appliance is second.appliance
+
+
+@pytest.mark.parametrize("payload", [b"", b"no separator", b"oven:warm", Codec.BINARY_MAGIC_BYTE + b"\x01"])
+def test_non_readings_decode_to_none(payload):
+    assert Codec.decode(payload) is None
+
+
+def test_unknown_binary_version_is_rejected():
+    payload = bytearray(Codec.encode("oven", 1.0, Codec.BINARY_FORMAT))
+    payload[1] = Codec.BINARY_VERSION + 1
+    assert Codec.decode(bytes(payload)) is None
+
+
+def test_format_commands():
+    assert Codec.parse_format_command(Codec.format_command(Codec.BINARY_FORMAT)) == Codec.BINARY_FORMAT
+    assert Codec.parse_format_command("format: TEXT ") == Codec.TEXT_FORMAT
+    assert Codec.parse_format_command("format:xml") is None
+    assert Codec.parse_format_command("oven") is None
+
+
+def test_load_appliances_are_numbered_beyond_the_named_ones():
+    assert Codec.load_appliances(2) == ["oven", "kettle"]
+    names = Codec.load_appliances(10)
+    assert names[:8] == Codec.LOAD_APPLIANCES
+    assert names[8:] == ["appliance8", "appliance9"]
@@ -0,0 +1,82 @@
+# IoT Project
+# Command Channel Tests
+
+# test_command.py
+# Drives a CommandChannel through a recording connection and hand-made acks.
+import threading
+from types import SimpleNamespace
+import pytest
+import Command
+import TopicRouter
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.subscriptions = []
+        self.published = []
+
+    def subscribe(self, topic, handler, qos=0):
+        self.subscriptions.append((topic, handler, qos))
+
+    def unsubscribe(self, topic, handler):
+        self.subscriptions.remove((topic, handler, 1))
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, Command.parse_request(payload)))
+
+
+@pytest.fixture
+def connection():
+    return RecordingConnection()
+
+
+def ack(channel, request_id, ok=True, result=""):
+    channel.on_ack(None, None, SimpleNamespace(payload=Command.make_response(request_id, ok, result)))
+
+
+def test_request_round_trip():
+    reply_to = TopicRouter.ack_topic("id1", "panel")
+    assert Command.parse_request(Command.make_request("panel-1", "oven", reply_to)) == ("panel-1", "oven", reply_to)
+    assert Command.parse_request(b"oven") == (None, "oven", None)
+    assert Command.parse_request(b"{not json") == (None, "{not json", None)
+
+
+def test_acks_reach_callbacks_and_window_releases_queued(connection):
+    channel = Command.CommandChannel(connection, "panel", timeout=60, max_in_flight=2)
+    results = []
+    ids = [channel.send("id1", f"cmd{index}", lambda *result: results.append(result)) for index in range(3)]
+    assert connection.subscriptions == [(TopicRouter.ack_topic("id1", "panel"), channel.on_ack, 1)]
+    assert [request[1] for _, request in connection.published] == ["cmd0", "cmd1"]
+    assert channel.stats()["queued"] == 1
+
+    ack(channel, ids[0], result="done")
+    assert [request[1] for _, request in connection.published] == ["cmd0", "cmd1", "cmd2"]
+    ack(channel, ids[1], ok=False)
+    ack(channel, ids[2])
+    ack(channel, ids[2])  # Duplicate, ignored
+    assert [(request_id, ok, result) for request_id, ok, _, result in results] == [
+        (ids[0], True, "done"), (ids[1], False, ""), (ids[2], True, "")
+    ]
+    stats = channel.stats()
+    assert (stats["sent"], stats["acked"], stats["failed"], stats["in_flight"]) == (3, 2, 1, 0)
+    assert stats["rtt_ms_p99"] >= stats["rtt_ms_p50"] >= 0
+    channel.close()
+    assert connection.subscriptions == []
+
+
+def test_unanswered_commands_time_out(connection):
+    channel = Command.CommandChannel(connection, "panel", timeout=0.05)
+    timed_out = threading.Event()
+    results = []
+
+    def callback(*result):
+        results.append(result)
+        timed_out.set()
+
+    request_id = channel.send("id1", "oven", callback)
+    assert timed_out.wait(2)
+    assert results == [(request_id, False, None, "timeout")]
+    ack(channel, request_id)  # Late, after the timeout
+    assert channel.stats()["timeouts"] == 1
+    assert channel.stats()["acked"] == 0
+    channel.close()
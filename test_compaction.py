@@ -0,0 +1,96 @@
+# IoT Project
+# History Compaction Tests
+
+# test_compaction.py
+# Two whole days of 30-second samples, rolled up and read back through the tiers.
+import time
+import numpy as np
+import pytest
+import Compaction
+import Storage
+
+PERIOD = 30.0
+KEY = ("h1", "oven")
+
+
+@pytest.fixture
+def history(tmp_path):
+    now = time.time()
+    day = now // 86400 * 86400 - 2 * 86400  # Start of the day before yesterday
+    timestamps = day + np.arange(0, 2 * 86400, PERIOD)
+    values = 0.5 + (np.arange(len(timestamps)) % 7) / 10
+    store = Storage.TimeSeriesStore(str(tmp_path / "history"))
+    for timestamp, kwh in zip(timestamps.tolist(), values.tolist()):
+        store.append(timestamp, *KEY, kwh)
+    store.flush()
+    compactor = Compaction.Compactor(store, interval=3600)
+    yield store, compactor, day, now, values
+    compactor.stop()
+    store.close()
+
+
+def test_rollup_merges_buckets():
+    records = Compaction.from_raw(np.array([(0.0, 1.0), (30.0, 3.0), (60.0, 2.0)], dtype=Storage.RECORD_DTYPE))
+    rolled = Compaction.rollup(records, 60)
+    assert rolled.tolist() == [(0.0, 2, 4.0, 1.0, 3.0), (60.0, 1, 2.0, 2.0, 2.0)]
+
+
+def test_tiers_hold_complete_buckets(history):
+    store, compactor, day, now, values = history
+    written, dropped = compactor.compact(now)
+    assert dropped == 0
+    assert compactor.stats() == {"raw": len(values), "1m": 2 * 1440, "1h": 48, "1d": 2}
+    assert written == 2 * 1440 + 48 + 2
+    days = compactor.tiers[2].query(KEY)
+    assert days["timestamp"].tolist() == [day, day + 86400]
+    assert days["count"].sum() == len(values)
+    assert days["sum"].sum() == pytest.approx(values.sum())
+    assert days["min"].min() == values.min() and days["max"].max() == values.max()
+    assert compactor.compact(now) == (0, 0)  # Nothing new to roll up
+
+
+def test_query_reads_the_tier_for_the_resolution(history):
+    store, compactor, day, now, values = history
+    compactor.compact(now)
+    hours = compactor.query(*KEY, start=day, end=day + 86400 - 1, resolution=3600)
+    assert len(hours) == 24
+    assert set(hours["count"].tolist()) == {3600 / PERIOD}
+    minutes = compactor.query(*KEY, start=day + 3600, end=day + 7200 - 1, resolution=60)
+    assert minutes["timestamp"].tolist() == [day + 3600 + 60 * index for index in range(60)]
+    raw = compactor.query(*KEY, start=day, end=day + 120)
+    assert raw["count"].tolist() == [1] * 5
+
+
+def test_query_fills_in_after_the_watermark(history):
+    store, compactor, day, now, values = history
+    compactor.compact(now)
+    # Today's samples are not rolled up yet, the 1d query builds their bucket from finer data
+    store.append(day + 2 * 86400 + 5, *KEY, 4.0)
+    store.append(day + 2 * 86400 + 3605, *KEY, 6.0)
+    days = compactor.query(*KEY, start=day, resolution=86400)
+    assert days["timestamp"].tolist() == [day, day + 86400, day + 2 * 86400]
+    assert days[-1]["count"] == 2
+    assert days[-1]["sum"] == 10.0
+
+
+def test_old_starts_move_to_tiers_that_still_have_data(history):
+    store, compactor, day, now, values = history
+    assert compactor.level_for(0, now - 86400, now) == -1
+    assert compactor.level_for(60, now - 86400, now) == 0
+    assert compactor.level_for(60, now - 8 * 86400, now) == 0
+    assert compactor.level_for(0, now - 8 * 86400, now) == 0  # Raw is kept for 7 days
+    assert compactor.level_for(60, now - 40 * 86400, now) == 1  # 1m is kept for 30 days
+    assert compactor.level_for(86400, None, now) == 2
+
+
+def test_retention_drops_raw_and_minute_data(history):
+    store, compactor, day, now, values = history
+    compactor.compact(now)
+    later = now + 31 * 86400
+    compactor.last_retention = 0.0
+    written, dropped = compactor.compact(later)
+    stats = compactor.stats()
+    assert stats["raw"] == 0
+    assert stats["1m"] == 0
+    assert stats["1h"] == 48 and stats["1d"] == 2
+    assert dropped == len(values) + 2 * 1440
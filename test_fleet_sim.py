@@ -0,0 +1,77 @@
+# IoT Project
+# Fleet Simulation Tests
+
+# test_fleet_sim.py
+# Shared connections on the simulated broker: reconnect backoff while the broker turns them
+# away, and the count of publishes in flight.
+import pytest
+import FleetSim
+import MqttCore
+
+LATENCY = 0.005  # Seconds per hop, without jitter; a refusal is seen two hops after connecting
+
+
+def attempt_times(simulation):
+    # Simulated times of every connect the broker sees
+    times = []
+    connect = simulation.broker.connect
+
+    def record(client):
+        times.append(simulation.clock.now)
+        return connect(client)
+
+    simulation.broker.connect = record
+    return times
+
+
+def assert_backoff(gaps):
+    # Each retry waits between half and all of a delay that doubles up to the cap
+    delay = MqttCore.RECONNECT_MIN_DELAY
+    for gap in gaps:
+        wait = gap - 2 * LATENCY
+        assert delay / 2 - 1e-9 <= wait <= delay + 1e-9
+        delay = min(delay * 2, MqttCore.RECONNECT_MAX_DELAY)
+
+
+@pytest.mark.parametrize("close_early", [False, True])
+def test_refused_connects_back_off(close_early):
+    with FleetSim.Simulation(latency=LATENCY, jitter=0) as simulation:
+        times = attempt_times(simulation)
+        simulation.reject_connections(0, 120, close_early=close_early)
+        connection = MqttCore.acquire(FleetSim.SIM_BROKER, FleetSim.SIM_PORT, "backoff-test")
+        simulation.run(119)
+        refused = len(times)
+        assert connection.connects == 0
+        assert connection.failed_attempts == refused == simulation.broker.refused
+        assert connection.delay == MqttCore.RECONNECT_MAX_DELAY
+        # Full waits reach the 30s cap after 31.5s and leave room for 3 more tries in 119s,
+        # half waits reach it after 15.75s and leave room for 6 more
+        assert 9 <= refused <= 13
+        assert_backoff([later - earlier for earlier, later in zip(times, times[1:])])
+
+        # Once the broker accepts again, the next attempt connects and the backoff starts over
+        simulation.run(MqttCore.RECONNECT_MAX_DELAY + 2)
+        assert connection.connected
+        assert connection.connects == 1
+        assert connection.delay == MqttCore.RECONNECT_MIN_DELAY
+
+        simulation.reject_connections(simulation.clock.now - simulation.clock.start, 10, close_early=close_early)
+        simulation.run(10)
+        assert connection.failed_attempts == len(times) - 1
+        assert_backoff([later - earlier for earlier, later in zip(times[refused + 1:], times[refused + 2:])])
+        MqttCore.release(connection)
+
+
+def test_in_flight_counts_unacknowledged_publishes():
+    with FleetSim.Simulation(latency=LATENCY, jitter=0) as simulation:
+        connection = MqttCore.acquire(FleetSim.SIM_BROKER, FleetSim.SIM_PORT, "inflight-test")
+        simulation.run(1)
+        for index in range(30):
+            connection.publish("pr/relay", f"relay:{index}", qos=1)
+        connection.publish("pr/relay", "relay:qos0", qos=0)
+        assert connection.in_flight() == 30
+        simulation.run(1)
+        assert connection.in_flight() == 0
+        connection.publish("pr/relay", "relay:last", qos=1)
+        assert len(connection.unacked) == 1  # Acknowledged ones are forgotten on the next publish
+        MqttCore.release(connection)
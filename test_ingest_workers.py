@@ -0,0 +1,50 @@
+# IoT Project
+# Ingest Worker Tests
+
+# test_ingest_workers.py
+# Runs against FleetSim's in-process broker, which spreads $share subscriptions like mosquitto.
+from types import SimpleNamespace
+import FleetSim
+import IngestWorkers
+import MqttCore
+import TopicRouter
+
+
+def test_route_filter_strips_share_group():
+    shared = TopicRouter.shared_filter(IngestWorkers.SHARE_GROUP, TopicRouter.STATUS_FILTER)
+    assert shared == "$share/iot-ingest/pr/home/+/sts"
+    assert TopicRouter.route_filter(shared) == TopicRouter.STATUS_FILTER
+    assert TopicRouter.route_filter(TopicRouter.STATUS_FILTER) == TopicRouter.STATUS_FILTER
+
+
+def test_shared_subscription_reaches_workers():
+    with FleetSim.Simulation(jitter=0) as simulation:
+        workers = [IngestWorkers.IngestWorker(index) for index in range(2)]
+        connections = []
+        for worker in workers:
+            connection = MqttCore.acquire(FleetSim.SIM_BROKER, FleetSim.SIM_PORT, f"ingest-test-{worker.index}")
+            worker.subscribe(connection, [TopicRouter.STATUS_FILTER], qos=2)
+            connections.append(connection)
+        simulation.add_devices(10, 2)
+        simulation.run(60)
+        published = sum(device.sent for device in simulation.devices)
+        for connection in connections:
+            MqttCore.release(connection)
+    received = [worker.take_summary()[1] for worker in workers]
+    assert published > 0
+    # Each reading goes to one member of the group; the last ones may still be in transit
+    assert published - len(simulation.devices) <= sum(received) <= published
+    assert all(received)
+
+
+def test_close_delivers_buffered_batches():
+    with FleetSim.Simulation():
+        pool = IngestWorkers.IngestPool(FleetSim.SIM_BROKER, FleetSim.SIM_PORT, workers=2, summary_interval=0.1)
+        pool.start()
+        count = 20000  # Keeps the sender busy, so messages are still buffered when close() starts
+        for index in range(count):
+            topic = TopicRouter.status_topic(f"id{index % 7}")
+            pool.on_message(None, None, SimpleNamespace(topic=topic, payload=b"oven:1.5"))
+        pool.close()
+    assert pool.dropped == 0
+    assert pool.received == count
@@ -0,0 +1,70 @@
+# IoT Project
+# Shared MQTT Client Core Tests
+
+# test_mqtt_core.py
+# The offline outbox: its bound in memory and on disk, and recovery after a restart.
+import MqttCore
+
+
+def put_readings(outbox, count, start=0):
+    for index in range(start, start + count):
+        outbox.put(f"pr/home/{index}/sts", f"oven:{index}", qos=1)
+
+
+def topics(items):
+    return [topic for topic, _, _, _ in items]
+
+
+def test_outbox_drops_oldest_beyond_maxsize():
+    outbox = MqttCore.Outbox(maxsize=3)
+    put_readings(outbox, 5)
+    assert len(outbox) == 3
+    assert outbox.dropped == 2
+    assert outbox.drain() == [
+        (f"pr/home/{index}/sts", f"oven:{index}".encode(), 1, False) for index in range(2, 5)
+    ]
+    assert len(outbox) == 0
+
+
+def test_outbox_reloads_queue_without_counting_old_drops(tmp_path):
+    path = str(tmp_path / "outbox")
+    outbox = MqttCore.Outbox(maxsize=3, path=path)
+    put_readings(outbox, 5)
+    outbox.close()
+    reloaded = MqttCore.Outbox(maxsize=3, path=path)
+    assert topics(reloaded.items) == [f"pr/home/{index}/sts" for index in range(2, 5)]
+    assert reloaded.dropped == 0
+    reloaded.close()
+
+
+def test_outbox_file_stays_bounded_during_long_outage(tmp_path):
+    path = tmp_path / "outbox"
+    outbox = MqttCore.Outbox(maxsize=5, path=str(path))
+    put_readings(outbox, 1000)
+    assert outbox.records <= 2 * outbox.maxsize
+    record_size = MqttCore.OUTBOX_RECORD.size + len("pr/home/999/sts") + len("oven:999")
+    assert path.stat().st_size <= 2 * outbox.maxsize * record_size
+    outbox.close()
+    reloaded = MqttCore.Outbox(maxsize=5, path=str(path))
+    assert topics(reloaded.items) == [f"pr/home/{index}/sts" for index in range(995, 1000)]
+    reloaded.close()
+
+
+def test_outbox_keeps_drained_items_until_commit(tmp_path):
+    path = str(tmp_path / "outbox")
+    outbox = MqttCore.Outbox(maxsize=10, path=path)
+    put_readings(outbox, 3)
+    assert len(outbox.drain()) == 3
+    put_readings(outbox, 1, start=3)
+    outbox.close()  # A crash before the flush finished
+
+    reloaded = MqttCore.Outbox(maxsize=10, path=path)
+    assert topics(reloaded.items) == [f"pr/home/{index}/sts" for index in range(4)]
+    reloaded.drain()
+    put_readings(reloaded, 1, start=4)
+    reloaded.commit()
+    reloaded.close()
+
+    after_flush = MqttCore.Outbox(maxsize=10, path=path)
+    assert topics(after_flush.items) == ["pr/home/4/sts"]
+    after_flush.close()
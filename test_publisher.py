@@ -0,0 +1,19 @@
+# IoT Project
+# Publisher Tests
+
+# test_publisher.py
+import pytest
+import Publisher
+
+
+def test_load_generator_streams_cover_every_home_and_appliance():
+    generator = Publisher.LoadGenerator(None, homes=3, appliances=2, rate=0.5)
+    assert len(generator.streams) == 6
+    assert generator.streams[:2] == [("pr/home/sim0000/sts", "oven"), ("pr/home/sim0000/sts", "kettle")]
+    assert generator.rate == 3.0
+
+
+@pytest.mark.parametrize("homes, appliances, rate", [(0, 4, 1.0), (10, 0, 1.0), (10, 4, 0.0), (10, 4, -1.0)])
+def test_load_generator_needs_streams_and_a_positive_rate(homes, appliances, rate):
+    with pytest.raises(ValueError):
+        Publisher.LoadGenerator(None, homes, appliances, rate)
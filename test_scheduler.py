@@ -0,0 +1,75 @@
+# IoT Project
+# Periodic Scheduler Tests
+
+# test_scheduler.py
+# Deadlines are checked with a hand-driven clock through due(); run() only in real time.
+import pytest
+import Scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_deadlines_advance_by_whole_periods(clock):
+    scheduler = Scheduler.PeriodicScheduler(None, coalesce=0.0, clock=clock)
+    scheduler.add("oven", 1.0)
+    assert scheduler.due(100.0) == ["oven"]
+    assert scheduler.due(100.9) == []
+    assert scheduler.due(101.3) == ["oven"]  # Late by 0.3s
+    assert scheduler.next_deadline() == 102.0  # No drift from the late tick
+    stats = scheduler.stats()
+    assert (stats["ticks"], stats["skipped"]) == (2, 0)
+    assert stats["lag_ms_max"] == pytest.approx(300)
+
+
+def test_close_deadlines_fire_in_one_batch(clock):
+    scheduler = Scheduler.PeriodicScheduler(None, coalesce=0.01, clock=clock)
+    scheduler.add("oven", 1.0)
+    scheduler.add("kettle", 1.0, phase=0.005)
+    scheduler.add("dryer", 1.0, phase=0.5)
+    assert scheduler.due(100.0) == ["oven", "kettle"]
+    assert scheduler.due(100.5) == ["dryer"]
+    assert scheduler.stats()["batches"] == 2
+
+
+def test_a_stream_far_behind_skips_missed_ticks(clock):
+    scheduler = Scheduler.PeriodicScheduler(None, coalesce=0.0, clock=clock)
+    scheduler.add("oven", 1.0)
+    assert scheduler.due(103.5) == ["oven"]
+    assert scheduler.stats()["skipped"] == 3
+    assert scheduler.next_deadline() == 104.0
+
+
+def test_remove_and_invalid_period(clock):
+    scheduler = Scheduler.PeriodicScheduler(None, clock=clock)
+    scheduler.add("oven", 1.0)
+    scheduler.add("kettle", 2.0)
+    scheduler.remove("oven")
+    assert scheduler.stats()["streams"] == 1
+    with pytest.raises(ValueError):
+        scheduler.add("dryer", 0)
+
+
+def test_run_calls_the_handler_until_stopped():
+    batches = []
+
+    def handler(keys, now):
+        batches.append(keys)
+        if len(batches) == 3:
+            scheduler.stop()
+
+    scheduler = Scheduler.PeriodicScheduler(handler)
+    scheduler.add("oven", 0.01)
+    scheduler.run(duration=5)
+    assert batches == [["oven"]] * 3
+    assert not scheduler.running
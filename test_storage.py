@@ -0,0 +1,91 @@
+# IoT Project
+# Time-Series Storage Tests
+
+# test_storage.py
+# Range queries and tails over segments, including samples that arrive late.
+import numpy as np
+import pytest
+import Storage
+
+T0 = 1700000000.0
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Storage.TimeSeriesStore(str(tmp_path / "history"))
+    yield store
+    store.close()
+
+
+def append_all(store, home, appliance, samples):
+    for timestamp, kwh in samples:
+        store.append(timestamp, home, appliance, kwh)
+    store.flush()
+
+
+def test_query_range_is_inclusive(store):
+    append_all(store, "h1", "oven", [(T0 + i, float(i)) for i in range(10)])
+    records = store.query("h1", "oven", T0 + 2, T0 + 5)
+    assert records["timestamp"].tolist() == [T0 + 2, T0 + 3, T0 + 4, T0 + 5]
+    assert len(store.query("h1", "oven")) == 10
+    assert len(store.query("h1", "kettle")) == 0
+
+
+def test_late_samples_start_a_segment_and_are_queried_in_order(store):
+    append_all(store, "h1", "oven", [(T0 + 10 + i, 1.0) for i in range(5)])
+    append_all(store, "h1", "oven", [(T0 + 12.5, 2.0), (T0 + 1, 3.0)])  # Late
+    series = store.series[("h1", "oven")]
+    assert len(series.segments) == 2
+    timestamps = store.query("h1", "oven")["timestamp"]
+    assert timestamps.tolist() == sorted(timestamps.tolist())
+    assert len(timestamps) == 7
+    assert store.query("h1", "oven", T0 + 12, T0 + 13)["kwh"].tolist() == [1.0, 2.0, 1.0]
+
+
+def test_tail_selects_newest_by_timestamp(store):
+    append_all(store, "h1", "oven", [(T0 + i, 1.0) for i in range(100)])
+    append_all(store, "h1", "oven", [(T0 + 50.5, 9.0)])  # Late, newest segment but old sample
+    append_all(store, "h2", "kettle", [(T0 + 98.5, 5.0), (T0 + 200, 6.0)])
+    tail = store.tail(4)
+    assert tail == [
+        (T0 + 98, "h1", "oven", 1.0),
+        (T0 + 98.5, "h2", "kettle", 5.0),
+        (T0 + 99, "h1", "oven", 1.0),
+        (T0 + 200, "h2", "kettle", 6.0),
+    ]
+    series_tail = store.series[("h1", "oven")].tail(3)
+    assert series_tail["timestamp"].tolist() == [T0 + 97, T0 + 98, T0 + 99]
+    assert store.tail(0) == []
+
+
+def test_segments_split_by_span(store, monkeypatch):
+    monkeypatch.setattr(Storage, "SEGMENT_SPAN", 10.0)
+    append_all(store, "h1", "oven", [(T0 + i, 1.0) for i in range(25)])
+    segments = store.series[("h1", "oven")].segments
+    assert [segment.count for segment in segments] == [10, 10, 5]
+    assert store.drop_before(T0 + 15) == 10
+    assert store.query("h1", "oven")["timestamp"][0] == T0 + 10
+
+
+def test_aggregate(store):
+    append_all(store, "h1", "oven", [(T0, 1.0), (T0 + 1, 3.0), (T0 + 2, 2.0)])
+    assert store.aggregate("h1", "oven", T0 + 1) == {"count": 2, "sum": 5.0, "min": 2.0, "max": 3.0, "mean": 2.5}
+    assert store.aggregate("h1", "kettle")["count"] == 0
+
+
+def test_reopen_and_single_owner(tmp_path):
+    path = str(tmp_path / "history")
+    store = Storage.TimeSeriesStore(path)
+    append_all(store, "", "oven", [(T0, 1.0)])
+    if Storage.fcntl:
+        with pytest.raises(Storage.HistoryLocked):
+            Storage.TimeSeriesStore(path)
+    reader = Storage.TimeSeriesStore(path, read_only=True)
+    reader.append(T0 + 1, "", "oven", 2.0)  # Dropped
+    assert reader.query("", "oven")["kwh"].tolist() == [1.0]
+    reader.close()
+    store.close()
+    reopened = Storage.TimeSeriesStore(path)
+    assert reopened.keys() == [(Storage.UNKNOWN_HOME, "oven")]
+    assert np.array_equal(reopened.query(None, "oven")["timestamp"], [T0])
+    reopened.close()
@@ -0,0 +1,89 @@
+# IoT Project
+# Topic Router Tests
+
+# test_topic_router.py
+import pytest
+import TopicRouter
+
+
+def handler(name):
+    def handle(*args):
+        pass
+    handle.__name__ = name
+    return handle
+
+
+@pytest.fixture
+def router():
+    return TopicRouter.TopicRouter()
+
+
+def names(handlers):
+    return sorted(handle.__name__ for handle in handlers)
+
+
+def test_wildcard_matching(router):
+    for topic_filter in ("pr/home/+/sts", "pr/home/#", "pr/+/id1/sts", "pr/home/id1/sts", "#", "pr/home/+"):
+        router.add(topic_filter, handler(topic_filter))
+    assert names(router.match("pr/home/id1/sts")) == sorted(
+        ["pr/home/+/sts", "pr/home/#", "pr/+/id1/sts", "pr/home/id1/sts", "#"]
+    )
+    assert names(router.match("pr/home/id2/cmd")) == ["#", "pr/home/#"]
+    assert names(router.match("pr/home")) == ["#", "pr/home/#"]  # "a/#" also matches "a"
+    assert names(router.match("pr/home/id1")) == ["#", "pr/home/#", "pr/home/+"]
+    assert names(router.match("pr/home/id1/sts/extra")) == ["#", "pr/home/#"]
+
+
+def test_plus_matches_empty_levels(router):
+    router.add("a/+/b", handler("a/+/b"))
+    assert names(router.match("a//b")) == ["a/+/b"]
+    assert router.match("a/b") == ()
+
+
+def test_dollar_topics_need_a_literal_first_level(router):
+    for topic_filter in ("#", "+/broker/load", "$SYS/#", "$SYS/+/load"):
+        router.add(topic_filter, handler(topic_filter))
+    assert names(router.match("$SYS/broker/load")) == ["$SYS/#", "$SYS/+/load"]
+    assert names(router.match("SYS/broker/load")) == ["#", "+/broker/load"]
+
+
+def test_handler_on_several_matching_filters_runs_once(router):
+    calls = []
+    router.add("pr/home/+/sts", calls.append)
+    router.add("pr/home/#", calls.append)
+    assert router.dispatch("pr/home/id1/sts", "reading") == 1
+    assert calls == ["reading"]
+
+
+def test_remove_prunes_and_invalidates_the_cache(router):
+    first, second = handler("first"), handler("second")
+    router.add("pr/home/+/sts", first)
+    router.add("pr/home/+/sts", second)
+    assert len(router.match("pr/home/id1/sts")) == 2
+    assert router.remove("pr/home/+/sts", first) is False
+    assert router.match("pr/home/id1/sts") == (second,)
+    assert router.remove("pr/home/+/sts", second) is True
+    assert router.match("pr/home/id1/sts") == ()
+    assert router.root.children == {}
+    assert router.remove("pr/home/+/sts", second) is True
+
+
+def test_cache_stays_bounded():
+    router = TopicRouter.TopicRouter(cache_size=4)
+    router.add("pr/home/+/sts", handler("status"))
+    for home in range(10):
+        assert len(router.match(TopicRouter.status_topic(f"id{home}"))) == 1
+    assert len(router.cache) <= 4
+
+
+@pytest.mark.parametrize("topic_filter, valid", [
+    ("pr/home/+/sts", True),
+    ("pr/home/#", True),
+    ("#", True),
+    ("", False),
+    ("pr/home/#/sts", False),
+    ("pr/home#", False),
+    ("pr/ho+me/sts", False),
+])
+def test_validate_filter(topic_filter, valid):
+    assert (TopicRouter.validate_filter(topic_filter) is None) == valid